@@ -18,29 +18,48 @@
 
 from __future__ import unicode_literals
 
+from array import array
 import bisect
 import gzip
+import hashlib
+import itertools
 import logging
 import os
 import re
 import shutil
-import sys
 import tempfile
+import threading
+import time
 import weakref
 
+import rdw_archive
+import rdw_delta
 import rdw_helpers
 
 from i18n import ugettext as _
 from rdiffweb.rdw_config import Configuration
 import zlib
 import errno
-from itertools import chain
+from collections import OrderedDict
 
 try:
     import subprocess32 as subprocess  # @UnresolvedImport @UnusedImport
 except:
     import subprocess  # @Reimport
 
+try:
+    import sqlite3
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite3  # @UnresolvedImport @Reimport
+
+try:
+    from os import scandir  # @UnresolvedImport
+except ImportError:
+    try:
+        from scandir import scandir  # @UnresolvedImport @Reimport
+    except ImportError:
+        scandir = None
+
 # Define the logger
 logger = logging.getLogger(__name__)
 
@@ -59,13 +78,13 @@ ZIP_SUFFIX = b".zip"
 # Tar gz extension
 TARGZ_SUFFIX = b".tar.gz"
 
-# Declare io_method()
-if sys.version.startswith("3"):
-    import io
-    io_method = io.BytesIO
-else:
-    import cStringIO
-    io_method = cStringIO.StringIO
+# Extension of the metadata index files.
+INDEX_SUFFIX = b".index"
+
+# Resolution in seconds of the modification times of some file systems. A
+# folder modified within this delay may be modified again without changing
+# its modification time.
+MTIME_RESOLUTION = 2
 
 
 class FileError:
@@ -101,14 +120,39 @@ class UnknownError(FileError):
         return self.error
 
 
+def _listdir(dirpath):
+    """
+    List the given directory. Return a dict {name: entry} where entry is
+    the scandir entry when available or None. scandir provides the file type
+    without a stat() of every entry.
+    """
+    if scandir:
+        return {x.name: x for x in scandir(dirpath)}
+    return dict.fromkeys(os.listdir(dirpath))
+
+
+def _isdir(dirpath, name, entry):
+    """Check if the listed item is a directory (symlinks are followed)."""
+    if entry is not None:
+        return entry.is_dir()
+    return os.path.isdir(os.path.join(dirpath, name))
+
+
 # Interfaced objects #
 
-class DirEntry:
+class DirEntry(object):
 
     """Includes name, isDir, fileSize, exists, and dict (changeDates) of sorted
     local dates when backed up"""
 
-    def __init__(self, repo_path, name, exists, increments):
+    # Avoid a __dict__ per instance, a directory may have many entries. Lazy
+    # values are stored in slots left unset until computed.
+    __slots__ = ('_repo', 'name', 'path', 'full_path', 'exists',
+                 '_increments', '_dirent', '_isdir', '_file_size',
+                 '_change_dates')
+
+    def __init__(self, repo_path, name, exists, increments, dirent=None):
+        """`dirent` is the scandir entry of the mirror file, if any."""
         assert isinstance(repo_path, RdiffPath)
         assert isinstance(name, str)
 
@@ -126,6 +170,7 @@ class DirEntry:
             repo_path.path,
             name)
         self.exists = exists
+        self._dirent = dirent
         # Store the increments sorted by date.
         # See self.last_change_date()
         self._increments = sorted(increments, key=lambda x: x.date)
@@ -143,7 +188,10 @@ class DirEntry:
             return self._isdir
         if self.exists:
             # If the entry exists, check if it's a directory
-            self._isdir = os.path.isdir(self.full_path)
+            if self._dirent is not None:
+                self._isdir = self._dirent.is_dir()
+            else:
+                self._isdir = os.path.isdir(self.full_path)
         else:
             # Check if increments is a directory
             for increment in self._increments:
@@ -160,7 +208,11 @@ class DirEntry:
         if hasattr(self, '_file_size'):
             return self._file_size
         if self.exists:
-            self._file_size = os.lstat(self.full_path).st_size
+            if self._dirent is not None:
+                st = self._dirent.stat(follow_symlinks=False)
+            else:
+                st = os.lstat(self.full_path)
+            self._file_size = st.st_size
         else:
             # The only viable place to get the filesize of a deleted entry
             # it to get it from file_statistics
@@ -243,6 +295,24 @@ class DirEntry:
             if (x >= self.first_change_date and
                 (self.exists or x <= self.last_change_date))]
 
+    def is_mirror_copy(self, restore_date):
+        """
+        Check if the revision of this file at the given restore date is
+        identical to the file located in the mirror. That's the case when the
+        file didn't changed after the restore date.
+        """
+        assert isinstance(restore_date, rdw_helpers.rdwTime)
+        # Symlinks and directories must be restored by rdiff-backup.
+        if not self.exists or self.isdir:
+            return False
+        if (self._dirent.is_symlink() if self._dirent is not None
+                else os.path.islink(self.full_path)):
+            return False
+        if restore_date not in self.restore_dates:
+            return False
+        # The last change date is the last backup date since the file exists.
+        return not [x for x in self.change_dates[:-1] if x >= restore_date]
+
 
 class HistoryEntry:
 
@@ -254,27 +324,62 @@ class HistoryEntry:
 
     @property
     def size(self):
-        try:
-            return (self._repo._session_statistics[self.date]
-                    .get_source_file_size())
-        except KeyError:
-            return 0
+        return self._repo.session_statistics.get_source_file_size(self.date)
 
     @property
     def errors(self):
         """Return error messages."""
         try:
-            self._repo._error_logs[self.date].read()
+            return self._repo._decode(
+                self._repo._error_logs[self.date].read())
         except KeyError:
             return ""
 
     @property
     def increment_size(self):
-        try:
-            return (self._repo._session_statistics[self.date]
-                    .get_increment_file_size())
-        except KeyError:
-            return 0
+        return self._repo.session_statistics.get_increment_file_size(
+            self.date)
+
+
+class HistoryEntries(object):
+
+    """
+    Lazy view of the HistoryEntry of a repository between two positions of
+    its backup dates (sorted from old to new). HistoryEntry objects are only
+    created when accessed. Slicing return a new view.
+    """
+
+    def __init__(self, repo, start=0, stop=None):
+        assert isinstance(repo, RdiffRepo)
+        self._repo = repo
+        count = len(repo.backup_dates)
+        self._start = max(0, min(start, count))
+        self._stop = count if stop is None else max(self._start, min(stop, count))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return [self[i] for i in xrange(start, stop, step)]
+            return HistoryEntries(self._repo, self._start + start,
+                                  self._start + stop)
+        if key < 0:
+            key += len(self)
+        if key < 0 or key >= len(self):
+            raise IndexError(key)
+        return HistoryEntry(self._repo,
+                            self._repo.backup_dates[self._start + key])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def __reversed__(self):
+        for i in xrange(len(self) - 1, -1, -1):
+            yield self[i]
 
 
 class IncrementEntry(object):
@@ -283,11 +388,20 @@ class IncrementEntry(object):
     repository. The base repository is provided in the default constructor
     and the date is provided using an error_log.* file"""
 
+    # Avoid a __dict__ per instance, a directory may have many increments.
+    __slots__ = ('repo_path', 'name', 'date', 'filename')
+
     MISSING_SUFFIX = b".missing"
 
     SUFFIXES = [b".missing", b".snapshot.gz", b".snapshot",
                 b".diff.gz", b".data.gz", b".data", b".dir", b".diff"]
 
+    # Match the end of increment names: the timestamp and the suffix.
+    _NAME_RE = re.compile(
+        br"(?:\.([^.]*))?(" +
+        b"|".join(re.escape(x) for x in SUFFIXES) +
+        br")?\Z")
+
     def __init__(self, repo_path, name):
         """Default constructor for an increment entry. User must provide the
             repository directory and an entry name. The entry name correspond
@@ -298,8 +412,9 @@ class IncrementEntry(object):
         self.repo_path = weakref.proxy(repo_path)
         # The given entry name may has quote charater, replace them
         self.name = name
-        # Calculate the date of the increment.
-        self.date = IncrementEntry.extract_date(self.name)
+        # Calculate the filename and date of the increment.
+        self.filename, date_string, unused = IncrementEntry._split_name(name)
+        self.date = IncrementEntry._parse_date(date_string)
 
     @property
     def repo(self):
@@ -311,17 +426,28 @@ class IncrementEntry(object):
         """
         Extract date from rdiff-backup filenames.
         """
-        # Remove suffix from filename
-        filename = IncrementEntry._remove_suffix(filename)
-        # Remove prefix from filename
-        date_string = filename.rsplit(b".", 1)[-1]
-        return_time = rdw_helpers.rdwTime()
+        return IncrementEntry._parse_date(
+            IncrementEntry._split_name(filename)[1])
+
+    @staticmethod
+    def _parse_date(date_string):
+        """Return the shared rdwTime of the given timestamp or None."""
+        if not date_string:
+            return None
         try:
-            return_time.initFromString(date_string)
-            return return_time
+            return rdw_helpers.parse_time(date_string)
         except ValueError:
             return None
 
+    @staticmethod
+    def _split_name(name):
+        """
+        Split an increment name into (filename, timestamp, suffix) in a
+        single pass. The timestamp and suffix may be None.
+        """
+        m = IncrementEntry._NAME_RE.search(name)
+        return name[:m.start()], m.group(1), m.group(2)
+
     def _open(self):
         """Should be used to open the increment file. This method handle
         compressed vs not-compressed file."""
@@ -334,11 +460,6 @@ class IncrementEntry(object):
         file can't be read."""
         return self._open().read()
 
-    @property
-    def filename(self):
-        filename = IncrementEntry._remove_suffix(self.name)
-        return filename.rsplit(b".", 1)[0]
-
     @property
     def has_suffix(self):
         for suffix in IncrementEntry.SUFFIXES:
@@ -354,6 +475,12 @@ class IncrementEntry(object):
     def isdir(self):
         return self.name.endswith(b".dir")
 
+    @property
+    def is_diff(self):
+        """Check if the current entry is a diff increment."""
+        return (self.name.endswith(b".diff.gz") or
+                self.name.endswith(b".diff"))
+
     @property
     def is_missing(self):
         """Check if the curent entry is a missing increment."""
@@ -365,14 +492,6 @@ class IncrementEntry(object):
         return (self.name.endswith(b".snapshot.gz") or
                 self.name.endswith(b".snapshot"))
 
-    @staticmethod
-    def _remove_suffix(filename):
-        """ returns None if there was no suffix to remove. """
-        for suffix in IncrementEntry.SUFFIXES:
-            if filename.endswith(suffix):
-                return filename[:-len(suffix)]
-        return filename
-
     def __str__(self):
         return self.name
 
@@ -415,58 +534,104 @@ class FileStatisticsEntry(IncrementEntry):
                         exc_info=1)
             return 0
 
-    def _search(self, path):
+    def get_source_sizes(self, paths):
+        """Return a dict of {path: SourceSize} for the given files. All the
+        paths are resolved in a single pass. Paths not found are omitted.
+        paths are relative paths from repo root."""
+        sizes = {}
+        for path, entry in self._lookup(paths).iteritems():
+            try:
+                sizes[path] = int(entry["source_size"])
+            except ValueError:
+                sizes[path] = 0
+        return sizes
+
+    def _readlines(self):
         """
-        This function search for a file entry in the file_statistics compress
-        file. Since python gzip seams to be 2 time slower, we directly use
-        zgrep to search the file. If zgrep is not available, fallback to
-        python implementation.
+        Iterate over the lines of the file statistics. Since python gzip seams
+        to be 2 time slower, compressed file are decompressed by chunk using
+        zlib.
+        """
+        if not self._is_compressed:
+            with self._open() as f:
+                for line in f:
+                    yield line
+            return
+
+        fullfn = os.path.join(self.repo.data_path, self.name)
+        in_file = gzip.open(fullfn, 'r')
+        decompress = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            in_file._read_gzip_header()
+            remaining = b''
+            while True:
+                buf = in_file.fileobj.read(CHUNK_SIZE)
+                if not buf:
+                    break
+                lines = (remaining + decompress.decompress(buf)).split(b'\n')
+                # Keep the incomplete line for the next chunk.
+                remaining = lines.pop()
+                for line in lines:
+                    yield line
+            remaining += decompress.flush()
+            for line in remaining.split(b'\n'):
+                if line:
+                    yield line
+        finally:
+            in_file.fileobj.close()
+            decompress = None
+
+    def _iter_entries(self):
+        """
+        Iterate over the entries of the file statistics. Yield tuples of
+        (path, changed, source_size, mirror_size, increment_size).
         """
         logger.debug("read file_statistics [%s]" %
                      self.repo._decode(self.name))
+        for line in self._readlines():
+            # Skip comments
+            if line.startswith(b"#"):
+                continue
+            # Split the line into array. Filename may contains spaces.
+            data = line.rstrip(b'\r\n').rsplit(b' ', 4)
+            if len(data) != 5:
+                continue
+            yield tuple(data)
 
-        path += b' '
-
-        # Open file are compress.
-        if self._is_compressed:
-            line = None
-            fullfn = os.path.join(self.repo.data_path, self.name)
-            in_file = gzip.open(fullfn, 'r')
-            decompress = zlib.decompressobj(-zlib.MAX_WBITS)
-            try:
-                in_file._read_gzip_header()
+    def _lookup(self, paths):
+        """
+        Search the file statistics of every given paths. Return a dict of
+        {path: entry} for the paths found.
 
-                while 1:
-                    buf = in_file.fileobj.read(CHUNK_SIZE)
-                    if not buf:
+        The file statistics are indexed the first time, then looked up from
+        the index. If the index can't be used, fallback to a single
+        streaming pass of the file.
+        """
+        paths = set(paths)
+        data = self.repo._index.get_file_statistics(
+            self.name, paths, self._iter_entries)
+        if data is None:
+            data = {}
+            for values in self._iter_entries():
+                if values[0] in paths:
+                    data[values[0]] = values
+                    if len(data) == len(paths):
                         break
-                    if not line:
-                        d_buf = decompress.decompress(buf)
-                    else:
-                        d_buf = line + decompress.decompress(buf)
-
-                    # Search beginning of a line matching our filename
-                    for line in io_method(d_buf):
-                        if line.startswith(path):
-                            break
-            finally:
-                in_file.fileobj.close()
-                decompress = None
-        else:
-            with self._open() as f:
-                for line in f:
-                    if not line.startswith(path):
-                        continue
-                    break
-
-        # Split the line into array
-        data = line.rstrip(b'\r\n').rsplit(b' ', 4)
         # From array create an entry
         return {
-            'changed': data[1],
-            'source_size': data[2],
-            'mirror_size': data[3],
-            'increment_size': data[4]}
+            path: {
+                'changed': values[1],
+                'source_size': values[2],
+                'mirror_size': values[3],
+                'increment_size': values[4]}
+            for path, values in data.iteritems()}
+
+    def _search(self, path):
+        """
+        This function search for a file entry in the file_statistics. Raise
+        KeyError if the entry is not found.
+        """
+        return self._lookup([path])[path]
 
 
 class SessionStatisticsEntry(IncrementEntry):
@@ -490,9 +655,22 @@ class SessionStatisticsEntry(IncrementEntry):
         if hasattr(self, '_data'):
             return
 
+        # Check if the statistics were already parsed in a previous session.
+        data = self.repo._index.get_session_statistics(self.name)
+        if data is not None:
+            self._data = data
+            return
+
+        self._data = self._parse()
+
+        # Keep the parsed values for the next time.
+        self.repo._index.set_session_statistics(self.name, self._data)
+
+    def _parse(self):
+        """Read the session_statistics file. Return a dict of {key: value}."""
         logger.debug("load session_statistics [%s]" %
                      self.repo._decode(self.name))
-        self._data = {}
+        data = {}
         with self._open() as f:
             for line in f:
                 # Skip comments
@@ -503,7 +681,8 @@ class SessionStatisticsEntry(IncrementEntry):
                 data_line = line.split(b" ", 2)
                 # Read line into tuple
                 (key, value) = tuple(data_line)[0:2]
-                self._data[key] = value
+                data[key] = value
+        return data
 
     def get_increment_file_size(self):
         """Return the IncrementFileSize from this entry"""
@@ -522,11 +701,434 @@ class SessionStatisticsEntry(IncrementEntry):
             return 0
 
 
+class SessionStatistics(object):
+
+    """
+    Statistics of every session of a repository.
+
+    The values are kept in parallel columns (one row per session) to limit
+    the memory used by repositories with thousands of sessions. The columns
+    are loaded in a single pass: the session statistics found in the index
+    are read with one query, the others are parsed and added to the index in
+    a single transaction. When new sessions appear, only those are loaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # The loaded values are never modified. Updates build new columns
+        # and publish them at once, so readers don't need the lock.
+        self._columns = _SessionStatisticsColumns()
+
+    @property
+    def dates(self):
+        return self._columns.dates
+
+    @property
+    def increment_file_size(self):
+        return self._columns.increment_file_size
+
+    @property
+    def source_file_size(self):
+        return self._columns.source_file_size
+
+    def update(self, repo):
+        """Load the sessions of the given repository not loaded yet."""
+        entries = repo._session_statistics
+        names = dict((entry.name, date) for date, entry in entries.items())
+        with self._lock:
+            current = self._columns
+            if not current.names.issubset(names):
+                # Sessions were removed, load everything again.
+                current = _SessionStatisticsColumns()
+            new_names = [x for x in names if x not in current.names]
+            if not new_names:
+                self._columns = current
+                return
+            logger.debug("load %d session statistics for [%s]",
+                         len(new_names), repo._decode(repo.repo_root))
+            columns = current.copy()
+            parsed = {}
+            for name in new_names:
+                date = names[name]
+                data = repo._index.get_session_statistics(name)
+                if data is None:
+                    try:
+                        data = entries[date]._parse()
+                    except (IOError, ValueError):
+                        # Try again on next update.
+                        logger.warn("fail to read [%s]", repo._decode(name),
+                                    exc_info=1)
+                        continue
+                    parsed[name] = data
+                columns.append(name, date, data)
+            if parsed:
+                repo._index.set_session_statistics_many(parsed)
+            self._columns = columns
+
+    def get_increment_file_size(self, date):
+        """Return the IncrementFileSize of the given session or 0."""
+        columns = self._columns
+        row = columns.rows.get(date.getSeconds())
+        return 0 if row is None else columns.increment_file_size[row]
+
+    def get_source_file_size(self, date):
+        """Return the SourceFileSize of the given session or 0."""
+        columns = self._columns
+        row = columns.rows.get(date.getSeconds())
+        return 0 if row is None else columns.source_file_size[row]
+
+
+class _SessionStatisticsColumns(object):
+
+    """Values of SessionStatistics. Only modified before being published."""
+
+    __slots__ = ('names', 'rows', 'dates', 'source_file_size',
+                 'increment_file_size')
+
+    def __init__(self):
+        # Names of the loaded session_statistics files.
+        self.names = set()
+        # Row number by date (in seconds).
+        self.rows = {}
+        self.dates = array(b'l')
+        self.source_file_size = array(b'l')
+        self.increment_file_size = array(b'l')
+
+    def copy(self):
+        other = _SessionStatisticsColumns()
+        other.names = set(self.names)
+        other.rows = dict(self.rows)
+        other.dates = array(b'l', self.dates)
+        other.source_file_size = array(b'l', self.source_file_size)
+        other.increment_file_size = array(b'l', self.increment_file_size)
+        return other
+
+    def append(self, name, date, data):
+        def to_int(key):
+            try:
+                return int(data.get(key, 0))
+            except ValueError:
+                return 0
+        self.names.add(name)
+        self.rows[date.getSeconds()] = len(self.dates)
+        self.dates.append(date.getSeconds())
+        self.source_file_size.append(to_int(b"SourceFileSize"))
+        self.increment_file_size.append(to_int(b"IncrementFileSize"))
+
+
+class RdiffRepoIndex(object):
+
+    """
+    Persistent index of the rdiff-backup-data folder.
+
+    Listing and parsing rdiff-backup-data is expensive for repositories
+    holding years of increments. This index keeps the data entries with their
+    parsed dates and the session statistics in a SQLite file located in
+    `index_dir`, outside of the repository, in a folder only accessible by
+    the current user. The index is keyed by the modification time of the
+    folder: when it didn't change, the folder is not listed at all. Otherwise
+    only the new and removed entries are processed.
+
+    If the index can't be used (e.g.: read-only folder), the data is computed
+    in memory. A corrupted index is deleted and created again.
+    """
+
+    def __init__(self, data_path, index_dir=None, max_file_statistics=5):
+        assert isinstance(data_path, str)
+        assert isinstance(max_file_statistics, int)
+        self.data_path = data_path
+        self.max_file_statistics = max_file_statistics
+        self.index_dir = index_dir or os.path.join(
+            tempfile.gettempdir(), b"rdiffweb-index")
+        assert isinstance(self.index_dir, str)
+        self.filename = os.path.join(
+            self.index_dir,
+            hashlib.sha1(os.path.abspath(data_path)).hexdigest() + INDEX_SUFFIX)
+
+    def _connect(self):
+        """
+        Called to create a new connection to the index.
+        """
+        # The index lists every path of the repository, it must not be
+        # readable or created by someone else.
+        rdw_helpers.makedirs_private(self.index_dir)
+        conn = sqlite3.connect(self.filename, timeout=10)
+        conn.text_factory = str
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in self._get_create_statements():
+            conn.execute(statement)
+        return conn
+
+    def _decode(self, value):
+        """Used to decode a path for logging."""
+        return rdw_helpers.decode_s(value, 'replace')
+
+    def _delete(self):
+        """Delete the index file with its write-ahead log."""
+        for suffix in [b"", b"-wal", b"-shm"]:
+            try:
+                os.remove(self.filename + suffix)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    @property
+    def entries(self):
+        """
+        Return a dict of {name: date} for every file and folder located
+        directly in rdiff-backup-data folder. The date is None when the name
+        doesn't contains a date.
+        """
+        if not hasattr(self, '_entries'):
+            try:
+                self._entries = self._execute(self._load_entries)
+            except (sqlite3.Error, EnvironmentError):
+                logger.warn("fail to use index [%s]" %
+                            self._decode(self.filename), exc_info=1)
+                self._entries = {
+                    x: IncrementEntry.extract_date(x)
+                    for x in os.listdir(self.data_path)}
+        return self._entries
+
+    def _execute(self, function):
+        """
+        Call `function(conn)` with a new connection to the index and return
+        its value. If the index is corrupted, it's deleted and the function is
+        called again with a new index.
+        """
+        for retry in [True, False]:
+            try:
+                conn = self._connect()
+                try:
+                    return function(conn)
+                finally:
+                    conn.close()
+            except sqlite3.OperationalError:
+                # Locked database, disk full, etc.
+                raise
+            except sqlite3.DatabaseError:
+                if not retry:
+                    raise
+                logger.warn("index [%s] is corrupted, create a new one" %
+                            self._decode(self.filename), exc_info=1)
+                self._delete()
+
+    def _get_create_statements(self):
+        return [
+            """create table if not exists properties (
+Key varchar (50) primary key,
+Value varchar (255) NOT NULL)""",
+            """create table if not exists entries (
+Name varchar (255) primary key,
+Seconds integer,
+TzOffset integer)""",
+            """create table if not exists session_statistics (
+Name varchar (255) NOT NULL,
+Key varchar (50) NOT NULL,
+Value varchar (255) NOT NULL,
+primary key (Name, Key))""",
+            """create table if not exists file_statistics_files (
+Name varchar (255) primary key,
+LastUsed real NOT NULL DEFAULT 0)""",
+            """create table if not exists file_statistics (
+Name varchar (255) NOT NULL,
+Path varchar (4096) NOT NULL,
+Changed varchar (20) NOT NULL,
+SourceSize varchar (20) NOT NULL,
+MirrorSize varchar (20) NOT NULL,
+IncrementSize varchar (20) NOT NULL,
+primary key (Name, Path))""",
+        ]
+
+    def get_file_statistics(self, name, paths, iter_entries):
+        """
+        Return a dict of {path: (path, changed, source_size, mirror_size,
+        increment_size)} for the given paths of the given file_statistics
+        filename. The file statistics are added to the index the first time
+        using `iter_entries`. Only the `max_file_statistics` most recently
+        used files are kept in the index. Return None if the index can't be
+        used.
+        """
+        assert isinstance(name, str)
+
+        def lookup(conn):
+            row = conn.execute(
+                "SELECT Name FROM file_statistics_files WHERE Name = ?",
+                (name,)).fetchone()
+            if not row:
+                logger.debug("index file statistics [%s]" %
+                             self._decode(name))
+                # Parse the file outside of the transaction and commit by
+                # batch to avoid locking the index during the whole parsing.
+                entries = iter_entries()
+                while True:
+                    batch = [(name,) + values
+                             for values in itertools.islice(entries, 10000)]
+                    if not batch:
+                        break
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO file_statistics (Name, Path, Changed, SourceSize, MirrorSize, IncrementSize) VALUES (?, ?, ?, ?, ?, ?)",
+                        batch)
+                    conn.commit()
+            conn.execute(
+                "INSERT OR REPLACE INTO file_statistics_files (Name, LastUsed) VALUES (?, ?)",
+                (name, time.time()))
+            # Only keep the most recently used files in the index.
+            pruned = [x for x, in conn.execute(
+                "SELECT Name FROM file_statistics_files WHERE Name != ? ORDER BY LastUsed DESC LIMIT -1 OFFSET ?",
+                (name, max(0, self.max_file_statistics - 1)))]
+            for table in ['file_statistics', 'file_statistics_files']:
+                conn.executemany(
+                    "DELETE FROM %s WHERE Name = ?" % table,
+                    [(x,) for x in pruned])
+            conn.commit()
+
+            # Lookup the paths by batch to limit the number of parameters.
+            batches = list(paths)
+            data = {}
+            for i in range(0, len(batches), 500):
+                batch = batches[i:i + 500]
+                query = ("SELECT Path, Changed, SourceSize, MirrorSize, IncrementSize FROM file_statistics WHERE Name = ? AND Path IN (%s)" %
+                         ", ".join("?" * len(batch)))
+                for values in conn.execute(query, [name] + batch):
+                    data[values[0]] = values
+            return data
+
+        try:
+            return self._execute(lookup)
+        except (sqlite3.Error, EnvironmentError):
+            logger.warn("fail to read file statistics from index [%s]" %
+                        self._decode(self.filename), exc_info=1)
+            return None
+
+    def get_session_statistics(self, name):
+        """
+        Return a dict of the indexed session statistics for the given
+        session_statistics filename. Return None if not indexed.
+        """
+        assert isinstance(name, str)
+        return self._session_statistics.get(name)
+
+    def _load_entries(self, conn):
+        """
+        Read the data entries from the index and update the index if
+        rdiff-backup-data was modified since the last time.
+        """
+        # Get the modification time before listing the folder. So we
+        # never record a modification time newer than the listing.
+        st_mtime = os.stat(self.data_path).st_mtime
+        mtime = repr(st_mtime)
+        cursor = conn.cursor()
+        entries = {
+            name: self._to_date(seconds, tz_offset)
+            for name, seconds, tz_offset in cursor.execute(
+                "SELECT Name, Seconds, TzOffset FROM entries")}
+        row = cursor.execute(
+            "SELECT Value FROM properties WHERE Key = 'mtime'").fetchone()
+        if row and row[0] == mtime:
+            return entries
+
+        # Compute the delta between the index and the folder.
+        logger.debug("update index for [%s]" %
+                     self._decode(self.data_path))
+        names = set(os.listdir(self.data_path))
+        removed = [x for x in entries if x not in names]
+        added = [x for x in names if x not in entries]
+        for name in removed:
+            del entries[name]
+        for name in added:
+            entries[name] = IncrementEntry.extract_date(name)
+
+        # Update the index.
+        cursor.executemany(
+            "DELETE FROM entries WHERE Name = ?",
+            [(x,) for x in removed])
+        for table in ['session_statistics', 'file_statistics', 'file_statistics_files']:
+            cursor.executemany(
+                "DELETE FROM %s WHERE Name = ?" % table,
+                [(x,) for x in removed])
+        cursor.executemany(
+            "INSERT INTO entries (Name, Seconds, TzOffset) VALUES (?, ?, ?)",
+            [(x,
+              entries[x].timeInSeconds if entries[x] else None,
+              entries[x].tzOffset if entries[x] else None)
+             for x in added])
+        if abs(time.time() - st_mtime) > MTIME_RESOLUTION:
+            cursor.execute(
+                "INSERT OR REPLACE INTO properties (Key, Value) VALUES ('mtime', ?)",
+                (mtime,))
+        else:
+            # The folder may be modified again within the same modification
+            # time, so it must be listed again next time.
+            cursor.execute("DELETE FROM properties WHERE Key = 'mtime'")
+        conn.commit()
+        return entries
+
+    @property
+    def _session_statistics(self):
+        """Return dict of {name: {key: value}} of indexed session statistics."""
+        if not hasattr(self, '_session_statistics_data'):
+            data = {}
+
+            def load(conn):
+                for name, key, value in conn.execute(
+                        "SELECT Name, Key, Value FROM session_statistics"):
+                    data.setdefault(name, {})[key] = value
+
+            try:
+                self._execute(load)
+            except (sqlite3.Error, EnvironmentError):
+                logger.warn("fail to read session statistics from index [%s]" %
+                            self._decode(self.filename), exc_info=1)
+            self._session_statistics_data = data
+        return self._session_statistics_data
+
+    def set_session_statistics(self, name, data):
+        """
+        Store the parsed session statistics for the given session_statistics
+        filename.
+        """
+        assert isinstance(name, str)
+        assert isinstance(data, dict)
+        self.set_session_statistics_many({name: data})
+
+    def set_session_statistics_many(self, values):
+        """
+        Store the parsed session statistics of multiple session_statistics
+        files in a single transaction. `values` is a dict {name: data}.
+        """
+        assert isinstance(values, dict)
+        self._session_statistics.update(values)
+
+        def store(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_statistics (Name, Key, Value) VALUES (?, ?, ?)",
+                [(name, key, value)
+                 for name, data in values.iteritems()
+                 for key, value in data.iteritems()])
+            conn.commit()
+
+        try:
+            self._execute(store)
+        except (sqlite3.Error, EnvironmentError):
+            logger.warn("fail to write session statistics to index [%s]" %
+                        self._decode(self.filename), exc_info=1)
+
+    def _to_date(self, seconds, tz_offset):
+        """Create a date object from the values stored in index."""
+        if seconds is None:
+            return None
+        date = rdw_helpers.rdwTime(int(seconds))
+        date.tzOffset = int(tz_offset)
+        return date
+
+
 class RdiffRepo:
 
     """Represent one rdiff-backup repository."""
 
-    def __init__(self, user_root, path):
+    def __init__(self, user_root, path, index_dir=None):
         assert isinstance(user_root, str)
         assert isinstance(path, str)
         self.encoding = 'utf-8'
@@ -542,6 +1144,9 @@ class RdiffRepo:
         # Check if the object is valid.
         self._check()
 
+        # Index used to avoid listing rdiff-backup-data.
+        self._index = RdiffRepoIndex(self.data_path, index_dir)
+
         # Check if the repository has hint for rdiffweb.
         self._load_hints()
 
@@ -554,9 +1159,8 @@ class RdiffRepo:
             logger.debug("get backup dates for [%s]" %
                          self._decode(self.repo_root))
             self._backup_dates = sorted([
-                IncrementEntry.extract_date(x)
-                for x in self.data_entries
-                if x.startswith(b"mirror_metadata")])
+                date
+                for unused, date in self._get_data_entries(b"mirror_metadata")])
         return self._backup_dates
 
     def _check(self):
@@ -573,8 +1177,8 @@ class RdiffRepo:
         """Return list of folder and file located directly in
         rdiff-backup-data folder. Each file represent a data entry."""
 
-        # Get entries from increment data.
-        return os.listdir(self.data_path)
+        # Get entries from index.
+        return self._index.entries.keys()
 
     def delete(self):
         """Delete the repository permanently."""
@@ -600,9 +1204,8 @@ class RdiffRepo:
         """Return dict of {date: IncrementEntry} to represent each file statistics."""
         if not hasattr(self, '_error_logs_data'):
             self._error_logs_data = {
-                IncrementEntry.extract_date(x): IncrementEntry(self.root_path, x)
-                for x in self.data_entries
-                if x.startswith(b"error_log.")}
+                date: IncrementEntry(self.root_path, x)
+                for x, date in self._get_data_entries(b"error_log.")}
         return self._error_logs_data
 
     @property
@@ -610,11 +1213,18 @@ class RdiffRepo:
         """Return dict of {date: filename} to represent each file statistics."""
         if not hasattr(self, '_file_statistics_data'):
             self._file_statistics_data = {
-                IncrementEntry.extract_date(x): x
-                for x in self.data_entries
-                if x.startswith(b"file_statistics.")}
+                date: x
+                for x, date in self._get_data_entries(b"file_statistics.")}
         return self._file_statistics_data
 
+    def _get_data_entries(self, prefix):
+        """Return list of (name, date) for every data entries starting with
+        the given prefix."""
+        return [
+            (name, date)
+            for name, date in self._index.entries.iteritems()
+            if name.startswith(prefix)]
+
     def get_encoding(self):
         """
         Return the interface encoding value.
@@ -644,7 +1254,7 @@ class RdiffRepo:
                             numLatestEntries=-1,
                             earliestDate=None,
                             latestDate=None):
-        """Returns a list of HistoryEntry's
+        """Returns a lazy sequence of HistoryEntry's (see HistoryEntries)
         earliestDate and latestDate are inclusive."""
 
         assert isinstance(numLatestEntries, int)
@@ -656,22 +1266,16 @@ class RdiffRepo:
         logger.debug("get history entries for [%s]" %
                      self._decode(self.repo_root))
 
-        entries = []
-        for backup_date in self.backup_dates:
-            # compare local times because of discrepency between client/server
-            # time zones
-            if earliestDate and backup_date < earliestDate:
-                continue
-
-            if latestDate and backup_date > latestDate:
-                continue
-
-            entries.append(HistoryEntry(self, backup_date))
-
-            if numLatestEntries != -1 and len(entries) == numLatestEntries:
-                return entries
-
-        return entries
+        # Backup dates are sorted, lookup the bounds of the date range.
+        start = 0
+        stop = len(self.backup_dates)
+        if earliestDate:
+            start = bisect.bisect_left(self.backup_dates, earliestDate)
+        if latestDate:
+            stop = bisect.bisect_right(self.backup_dates, latestDate)
+        if numLatestEntries != -1:
+            stop = min(stop, start + numLatestEntries)
+        return HistoryEntries(self, start, stop)
 
     def get_path(self, path):
         """Return a new instance of RdiffPath to represent the given path."""
@@ -747,11 +1351,21 @@ class RdiffRepo:
         statistics."""
         if not hasattr(self, '_session_statistics_data'):
             self._session_statistics_data = {
-                IncrementEntry.extract_date(x): SessionStatisticsEntry(self.root_path, x)
-                for x in self.data_entries
-                if x.startswith(b"session_statistics.")}
+                date: SessionStatisticsEntry(self.root_path, x)
+                for x, date in self._get_data_entries(b"session_statistics.")}
         return self._session_statistics_data
 
+    @property
+    def session_statistics(self):
+        """Return the SessionStatistics of this repository, loading the new
+        sessions if required."""
+        if not hasattr(self, '_session_stats'):
+            self._session_stats = SessionStatistics()
+        if not getattr(self, '_session_stats_loaded', False):
+            self._session_stats.update(self)
+            self._session_stats_loaded = True
+        return self._session_stats
+
     def set_encoding(self, name):
         """
         Change the encoding of the repository.
@@ -784,6 +1398,67 @@ class RdiffRepo:
         return self._decode(self.repo_root)
 
 
+class RdiffRepoCache(object):
+
+    """
+    Process-wide cache of RdiffRepo objects.
+
+    Keeping the repository objects between requests avoid listing and parsing
+    rdiff-backup-data again. A repository object is discarded when the
+    modification time of its rdiff-backup-data folder changes (e.g.: a new
+    backup is running or completed). The least recently used repositories are
+    evicted when the cache is full.
+    """
+
+    def __init__(self, max_size=100, index_dir=None):
+        assert isinstance(max_size, int)
+        self.max_size = max_size
+        self.index_dir = index_dir
+        self._lock = threading.RLock()
+        # Store {(user_root, path): (mtime, repo)}.
+        self._repos = OrderedDict()
+
+    def clear(self):
+        """Remove every repository from the cache."""
+        with self._lock:
+            self._repos.clear()
+
+    def get_repo(self, user_root, path):
+        """
+        Return an RdiffRepo for the given `user_root` and `path`. Raise
+        DoesNotExistError if the repository is not valid.
+        """
+        assert isinstance(user_root, str)
+        assert isinstance(path, str)
+        key = (user_root.rstrip(b"/"), path.strip(b"/"))
+
+        # Get modification time of rdiff-backup-data.
+        data_path = os.path.join(key[0], key[1], RDIFF_BACKUP_DATA)
+        try:
+            mtime = os.stat(data_path).st_mtime
+        except OSError:
+            mtime = None
+
+        # Lookup the cache and mark the repository as recently used.
+        with self._lock:
+            value = self._repos.pop(key, None)
+            if value and value[0] == mtime:
+                self._repos[key] = value
+                return value[1]
+
+        # Create a new repository object. Raise an error if not valid.
+        repo = RdiffRepo(key[0], key[1], self.index_dir)
+        stats = getattr(value[1], '_session_stats', None) if value else None
+        if stats:
+            # Keep the loaded statistics, only new sessions will be loaded.
+            repo._session_stats = stats
+        with self._lock:
+            self._repos[key] = (mtime, repo)
+            while len(self._repos) > self.max_size:
+                self._repos.popitem(last=False)
+        return repo
+
+
 class RdiffPath:
 
     """Represent an rdiff-backup repository. Either a root, a path or a file."""
@@ -843,7 +1518,13 @@ class RdiffPath:
     def dir_entries(self):
         """Get directory entries for the current path. It is similar to
         listdir() but for rdiff-backup."""
+        entries = self._get_dir_entries()
+        # Resolve the size of deleted files all at once.
+        self._load_file_sizes(entries)
+        return entries
 
+    def _get_dir_entries(self):
+        """Create the DirEntry objects for the current path."""
         logger.debug("get directory entries for [%s]" %
                      self._decode(self.full_path))
 
@@ -853,20 +1534,22 @@ class RdiffPath:
 
         # Process each increment entries and combine this with the existing
         # entries
+        existing_entries = self.existing_entries
         entriesDict = {}
         for filename, increments in grouped_increment_entries.iteritems():
             # Check if filename exists
-            exists = filename in self.existing_entries
+            exists = filename in existing_entries
             # Create DirEntry to represent the item
             new_entry = DirEntry(
                 self,
                 filename,
                 exists,
-                increments)
+                increments,
+                existing_entries.get(filename))
             entriesDict[filename] = new_entry
 
         # Then add existing entries
-        for filename in self.existing_entries:
+        for filename, dirent in existing_entries.iteritems():
             # Check if the entry was created by increments entry
             if filename in entriesDict:
                 continue
@@ -876,7 +1559,8 @@ class RdiffPath:
                 self,
                 filename,
                 True,
-                [])
+                [],
+                dirent)
             entriesDict[filename] = new_entry
 
         # Return the values (so the DirEntry objects)
@@ -895,26 +1579,51 @@ class RdiffPath:
 
     @property
     def existing_entries(self):
-        """Return the content of the directory using a simple listdir(). This
-        represent the last known backup. Thus it return existing entries."""
+        """Return the content of the directory as a dict {name: entry} (see
+        _listdir()). This represent the last known backup. Thus it return
+        existing entries."""
 
         if not hasattr(self, '_existing_entries'):
             logger.debug("get existing entries for [%s]" %
                          self._decode(self.full_path))
 
-            # Check if the directory exists. It may not exist if
-            # it has been delete
-            self._existing_entries = []
-            if os.access(self.full_path, os.F_OK):
-                # Get entries from directory structure
-                self._existing_entries = os.listdir(self.full_path)
+            # The directory may not exist if it has been delete
+            try:
+                self._existing_entries = _listdir(self.full_path)
+            except OSError as e:
+                if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+                    raise
+                self._existing_entries = {}
 
-                # Remove "rdiff-backup-data" directory
-                if self.path == b'':
-                    self._existing_entries.remove(RDIFF_BACKUP_DATA)
+            # Remove "rdiff-backup-data" directory
+            if self.path == b'':
+                self._existing_entries.pop(RDIFF_BACKUP_DATA, None)
 
         return self._existing_entries
 
+    def _load_file_sizes(self, entries):
+        """Used to resolve the size of every deleted file. Since it's read
+        from file_statistics, all the entries using the same file statistics
+        are searched in a single pass."""
+        deleted_entries = rdw_helpers.groupby(
+            [x for x in entries if not x.exists and not x.isdir],
+            lambda x: x.last_change_date)
+        for date, group in deleted_entries.iteritems():
+            stats = self.repo.get_file_statistic(date)
+            if not stats:
+                # Let DirEntry handle it.
+                continue
+            try:
+                # File stats uses unquoted name.
+                sizes = stats.get_source_sizes(
+                    [self.repo.unquote(x.path) for x in group])
+            except:
+                logger.warn("fail to read file statistic [%s]" % date,
+                            exc_info=1)
+                continue
+            for entry in group:
+                entry._file_size = sizes.get(self.repo.unquote(entry.path), 0)
+
     @property
     def increments_path(self):
         """Get the increment path for the current path. This path is located
@@ -938,17 +1647,21 @@ class RdiffPath:
             "get increments entries for [%s]" %
             self._decode(self.increments_path))
 
-        # Check if increment directory exists. The path may not exists if
-        # the folder always exists and never changed.
-        if not os.access(self.increments_path, os.F_OK):
+        # The increment directory may not exists if the folder always exists
+        # and never changed.
+        try:
+            entries = _listdir(self.increments_path)
+        except OSError as e:
+            if e.errno not in [errno.ENOENT, errno.ENOTDIR]:
+                raise
             return list()
 
         # List content of the increment directory.
         # Ignore sub-directories.
         increment_entries = [
-            IncrementEntry(self, x)
-            for x in os.listdir(self.increments_path)
-            if not os.path.isdir(os.path.join(self.increments_path, x))]
+            IncrementEntry(self, name)
+            for name, entry in entries.iteritems()
+            if not _isdir(self.increments_path, name, entry)]
         return increment_entries
 
     @property
@@ -956,8 +1669,87 @@ class RdiffPath:
         """return the repository path"""
         return self.repo.repo_root
 
-    def restore(self, name, restore_date, use_zip):
-        """Used to restore the given file located in this path."""
+    def get_mirror_file(self, name, restore_date):
+        """Return the location of the given file in the mirror if it's
+        identical to the revision to be restored. Otherwise return None.
+        When available, the file may be sent as-is without executing
+        rdiff-backup."""
+        assert isinstance(name, str)
+        assert isinstance(restore_date, rdw_helpers.rdwTime)
+        entry = self._get_entry(name)
+        if not entry or not entry.is_mirror_copy(restore_date):
+            return None
+        return entry.full_path
+
+    def _get_entry(self, name):
+        """Return the DirEntry of the given file located in this path or
+        None."""
+        (parent, name) = os.path.split(name.strip(b"/"))
+        if not name:
+            return None
+        path_obj = self
+        if parent:
+            path_obj = RdiffPath(self.repo, os.path.join(self.path, parent))
+        entries = [x for x in path_obj._get_dir_entries() if x.name == name]
+        if not entries:
+            return None
+        return entries[0]
+
+    def restore(self, name, restore_date, use_zip, dirpath=None,
+                patch_files=True, **kwargs):
+        """Used to restore the given file located in this path. Directories
+        are archived using zip or tar.gz. Return the location of the file.
+        The data is restored in `dirpath` or a new temporary directory.
+        Regular files are restored without rdiff-backup when `patch_files`
+        is True. Extra arguments are passed to the archive functions."""
+        output = self._restore(name, restore_date, dirpath, patch_files)
+
+        # The path restored is a directory and need to be archived using zip
+        # or tar
+        if os.path.isdir(output):
+            output_dir = output
+            try:
+                if use_zip:
+                    output = output_dir + ZIP_SUFFIX
+                    self._recursive_zip(output_dir, output, **kwargs)
+                else:
+                    output = output_dir + TARGZ_SUFFIX
+                    self._recursiveTarDir(output_dir, output, **kwargs)
+            finally:
+                shutil.rmtree(output_dir, ignore_errors=True)
+
+        # Return the location of the file to be restored
+        return output
+
+    def restore_stream(self, name, restore_date, use_zip, patch_files=True,
+                       **kwargs):
+        """Used to restore the given file located in this path without
+        creating an archive on disk.
+
+        Return a tuple (output, filename, stream). `output` is the location of
+        the restored file or directory. For a directory, `stream` is a
+        generator producing the zip or tar.gz archive on the fly and
+        `filename` is the name of the archive. Otherwise `stream` is None.
+        The caller is responsible to delete the parent directory of `output`.
+        Regular files are restored without rdiff-backup when `patch_files`
+        is True. Extra arguments are passed to the archive functions.
+        """
+        output = self._restore(name, restore_date, patch_files=patch_files)
+        if not os.path.isdir(output):
+            return (output, os.path.basename(output), None)
+        encoding = self.repo.get_encoding()
+        if use_zip:
+            return (output,
+                    os.path.basename(output) + ZIP_SUFFIX,
+                    rdw_archive.archive_zip(output, encoding, **kwargs))
+        return (output,
+                os.path.basename(output) + TARGZ_SUFFIX,
+                rdw_archive.archive_tar(output, encoding, **kwargs))
+
+    def _restore(self, name, restore_date, dirpath=None, patch_files=True):
+        """Execute rdiff-backup to restore the given file located in this
+        path into `dirpath` or a temporary location. Return the restored
+        location."""
         assert isinstance(name, str)
         assert isinstance(restore_date, rdw_helpers.rdwTime)
         name = name.lstrip(b"/")
@@ -978,7 +1770,12 @@ class RdiffPath:
         if name != b"":
             filename = name
         # Generate a temporary location used to restore data.
-        output = os.path.join(tempfile.mkdtemp(), filename)
+        output = os.path.join(dirpath or tempfile.mkdtemp(), filename)
+
+        # Regular files may be restored without executing rdiff-backup.
+        entry = self._get_entry(name) if name and patch_files else None
+        if entry and self._patch_file(entry, restore_date, output):
+            return output
 
         # Execute rdiff-backup to restore the data.
         logger.info(
@@ -1002,23 +1799,66 @@ class RdiffPath:
                         report this to a developer.'''
             raise UnknownError('unable to restore!\n' + error)
 
-        # The path restored is a directory and need to be archived using zip
-        # or tar
-        if os.path.isdir(output):
-            output_dir = output
-            try:
-                if use_zip:
-                    output = output_dir + ZIP_SUFFIX
-                    self._recursive_zip(output_dir, output)
-                else:
-                    output = output_dir + TARGZ_SUFFIX
-                    self._recursiveTarDir(output_dir, output)
-            finally:
-                shutil.rmtree(output_dir, ignore_errors=True)
-
-        # Return the location of the file to be restored
         return output
 
+    def _patch_file(self, entry, restore_date, output):
+        """Restore the revision of a regular file by applying the increments
+        on the mirror file from the newest to the restore date. Return False
+        if the file can't be restored this way."""
+        # Directories and special files are left to rdiff-backup.
+        if (entry.isdir or os.path.islink(entry.full_path) or
+                (entry.exists and not os.path.isfile(entry.full_path))):
+            return False
+        increments = [x for x in entry._increments
+                      if x.date >= restore_date and x.has_suffix]
+        if not increments:
+            return False
+
+        logger.info("restore [%s] by applying %s increments" %
+                    (self._decode(entry.full_path), len(increments)))
+        current = entry.full_path if entry.exists else None
+        tempfiles = []
+        try:
+            for increment in reversed(increments):
+                if increment.is_missing:
+                    current = None
+                    continue
+                filename = os.path.join(self.increments_path, increment.name)
+                if ((not increment.is_snapshot and not increment.is_diff) or
+                        os.path.islink(filename) or
+                        not os.path.isfile(filename)):
+                    return False
+                if increment.is_diff and current is None:
+                    return False
+                target = b"%s.%d" % (output, len(tempfiles))
+                tempfiles.append(target)
+                if increment._is_compressed:
+                    src = gzip.open(filename, "rb")
+                else:
+                    src = open(filename, "rb")
+                with src, open(target, "wb") as dst:
+                    if increment.is_snapshot:
+                        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+                    else:
+                        with open(current, "rb") as basis:
+                            rdw_delta.patch(basis, src, dst)
+                # Previous revision is not required anymore.
+                if current in tempfiles:
+                    os.remove(current)
+                current = target
+            if current is None:
+                return False
+            os.rename(current, output)
+            return True
+        except (EnvironmentError, zlib.error, rdw_delta.DeltaError):
+            logger.warn("fail to apply increments of [%s]" %
+                        self._decode(entry.full_path), exc_info=1)
+            return False
+        finally:
+            for target in tempfiles:
+                if os.path.lexists(target):
+                    os.remove(target)
+
     @property
     def restore_dates(self):
 
@@ -1037,58 +1877,35 @@ class RdiffPath:
         repo_path = RdiffPath(self.repo, parent_path)
 
         # Get entries specific to the given name
-        entries = [x for x in repo_path.dir_entries if x.name == name]
+        entries = [x for x in repo_path._get_dir_entries() if x.name == name]
         if not entries:
             raise DoesNotExistError()
         return entries[0].restore_dates
 
-    def _recursiveTarDir(self, dirpath, target):
+    def _recursiveTarDir(self, dirpath, target, **kwargs):
         """This function is used during to archive a restored directory. It will
             create a tar gz archive with the specified directory."""
         assert isinstance(dirpath, str)
         assert isinstance(target, str)
         assert os.path.isdir(dirpath)
-        import tarfile
-
-        dirpath = os.path.normpath(dirpath)
 
         # Create a tar.gz archive
         logger.info("creating a tar file [%s] from [%s]",
                     self._decode(target), self._decode(dirpath))
-        tar = tarfile.open(target, "w:gz")
+        with open(target, 'wb') as f:
+            for data in rdw_archive.archive_tar(
+                    dirpath, self.repo.get_encoding(), **kwargs):
+                f.write(data)
 
-        # Add files to the archive
-        for root, dirs, files in os.walk(dirpath, topdown=True):
-            for name in chain(dirs, files):
-                filename = os.path.join(root, name)
-                assert filename.startswith(dirpath)
-                arcname = self._decode(filename[len(dirpath) + 1:])
-                # Add the file to the archive.
-                tar.add(filename, arcname, recursive=False)
-
-        # Close the archive
-        tar.close()
-
-    def _recursive_zip(self, dirpath, target):
+    def _recursive_zip(self, dirpath, target, **kwargs):
         """This function is used during to archive a restored directory. It will
             create a zip archive with the specified directory."""
         assert isinstance(dirpath, str)
         assert isinstance(target, str)
         assert os.path.isdir(dirpath)
-        import zipfile
-
-        dirpath = os.path.normpath(dirpath)
 
         # Create the archive
-        zipobj = zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED)
-
-        # Add files to archive
-        for root, dirs, files in os.walk(dirpath, topdown=True):
-            for name in files:
-                filename = os.path.join(root, name)
-                assert filename.startswith(dirpath)
-                arcname = self._decode(filename[len(dirpath) + 1:])
-                # Add the file to the archive.
-                zipobj.write(filename, arcname)
-
-        zipobj.close()
+        with open(target, 'wb') as f:
+            for data in rdw_archive.archive_zip(
+                    dirpath, self.repo.get_encoding(), **kwargs):
+                f.write(data)
@@ -27,6 +27,7 @@ import tempfile
 
 from rdiffweb import rdw_app
 from rdiffweb import rdw_spider_repos
+from rdiffweb import rdw_status
 from rdiffweb import i18n  # @UnusedImport
 from rdiffweb import filter_authentication  # @UnusedImport
 
@@ -192,12 +193,19 @@ def start():
     # Start daemon thread to refresh users repository
     kill_event = threading.Event()
     rdw_spider_repos.start_repo_spider_thread(kill_event, app)
+    rdw_status.start_status_collector_thread(kill_event, app)
 
     # Register kill_event
     if hasattr(cherrypy.engine, 'subscribe'):  # CherryPy >= 3.1
         cherrypy.engine.subscribe('stop', lambda: kill_event.set())
+        cherrypy.engine.subscribe('stop', app.restore_queue.stop)
+        cherrypy.engine.subscribe('stop', app.root.status.stop)
+        cherrypy.engine.subscribe('stop', app.deactivate_plugins)
     else:
         cherrypy.engine.on_stop_engine_list.append(lambda: kill_event.set())  # @UndefinedVariable
+        cherrypy.engine.on_stop_engine_list.append(app.restore_queue.stop)  # @UndefinedVariable
+        cherrypy.engine.on_stop_engine_list.append(app.root.status.stop)  # @UndefinedVariable
+        cherrypy.engine.on_stop_engine_list.append(app.deactivate_plugins)  # @UndefinedVariable
 
     # Add a custom signal handler
     cherrypy.engine.signal_handler.handlers['SIGUSR2'] = debug_dump
@@ -29,6 +29,9 @@ from i18n import ugettext as _
 # Define the logger
 logger = logging.getLogger(__name__)
 
+# Number of users displayed per page.
+USERS_PER_PAGE = 50
+
 
 class AdminPage(page_main.MainPage):
     """Administration pages. Allow to manage users database."""
@@ -114,7 +117,7 @@ class AdminPage(page_main.MainPage):
 
     @cherrypy.expose
     def users(self, userfilter=u"", usersearch=u"", action=u"", username=u"",
-              email=u"", password=u"", user_root=u"", is_admin=u""):
+              email=u"", password=u"", user_root=u"", is_admin=u"", page=u"1"):
 
         # Check if user is an administrator
         if not self.app.currentuser or not self.app.currentuser.is_admin:
@@ -122,6 +125,10 @@ class AdminPage(page_main.MainPage):
 
         assert isinstance(userfilter, unicode)
         assert isinstance(usersearch, unicode)
+        try:
+            page = max(1, int(page))
+        except ValueError:
+            page = 1
 
         # If we're just showing the initial page, just do that
         params = {}
@@ -140,7 +147,7 @@ class AdminPage(page_main.MainPage):
         # Get page parameters
         try:
             params.update(
-                self._users_get_params_for_page(userfilter, usersearch))
+                self._users_get_params_for_page(userfilter, usersearch, page))
         except:
             logger.exception("fail to get user list")
             return self._compile_error_template(_("Can't get user list."))
@@ -148,29 +155,33 @@ class AdminPage(page_main.MainPage):
         # Build users page
         return self._compile_template("admin_users.html", **params)
 
-    def _users_get_params_for_page(self, userfilter, usersearch):
-        usernames = self.app.userdb.list()
-        users = [{"username": username,
-                  "email": self.app.userdb.get_email(username),
-                  "is_admin": self.app.userdb.is_admin(username),
-                  "user_root": self.app.userdb.get_user_root(username)
-                  } for username in usernames]
-
-        # Apply the filters.
-        filtered_users = users
-        if userfilter == "admins":
-            filtered_users = filter(lambda x: x["is_admin"],
-                                    filtered_users)
-        # Apply the search.
-        if usersearch:
-            filtered_users = filter(lambda x: usersearch in x["username"] or
-                                    usersearch in x["email"],
-                                    filtered_users)
+    def _users_get_params_for_page(self, userfilter, usersearch, page=1):
+        # Filtering and pagination are done by the database.
+        admin_only = userfilter == "admins"
+        filtered_count = self.app.userdb.count_users(admin_only, usersearch)
+        page_count = max(1, (filtered_count + USERS_PER_PAGE - 1) //
+                         USERS_PER_PAGE)
+        page = min(page, page_count)
+        filtered_users = self.app.userdb.get_users(
+            admin_only, usersearch, (page - 1) * USERS_PER_PAGE,
+            USERS_PER_PAGE)
+
+        search_stats = rdw_spider_repos.get_search_stats()
+        for user in filtered_users:
+            stats = search_stats.get(user["username"])
+            user["search_stats"] = stats
+            user["search_slow"] = (
+                stats is not None and
+                stats.duration > rdw_spider_repos.SLOW_SEARCH)
 
         return {"userfilter": userfilter,
                 "usersearch": usersearch,
                 "filtered_users": filtered_users,
-                "users": users}
+                "filtered_count": filtered_count,
+                "user_count": self.app.userdb.count_users(),
+                "admin_count": self.app.userdb.count_users(admin_only=True),
+                "page": page,
+                "page_count": page_count}
 
     def _users_handle_action(self, action, username, email, password,
                              user_root, is_admin):
@@ -198,7 +209,9 @@ class AdminPage(page_main.MainPage):
             # Check and update user directory
             try:
                 self._check_user_root_dir(user_root)
-                rdw_spider_repos.find_repos_for_user(username, self.app.userdb)
+                rdw_spider_repos.find_repos_for_user(
+                    username, self.app.userdb,
+                    rdw_spider_repos.get_search_depth(self.app.cfg))
             except ValueError as e:
                 success = ""
                 warning = unicode(e)
@@ -219,7 +232,9 @@ class AdminPage(page_main.MainPage):
             # Check and update user directory
             try:
                 self._check_user_root_dir(user_root)
-                rdw_spider_repos.find_repos_for_user(username, self.app.userdb)
+                rdw_spider_repos.find_repos_for_user(
+                    username, self.app.userdb,
+                    rdw_spider_repos.get_search_depth(self.app.cfg))
             except ValueError as e:
                 warning = unicode(e)
             success = "User added successfully."
@@ -18,18 +18,27 @@
 
 from __future__ import unicode_literals
 
+import calendar
 import cherrypy
 import logging
+import time
 
 import librdiff
 import page_main
 import rdw_helpers
 
+from i18n import ugettext as _
 from rdw_helpers import decode_s, unquote_url
 
 # Define the logger
 logger = logging.getLogger(__name__)
 
+# Default number of backups displayed per page.
+HISTORY_PER_PAGE = 50
+
+# Maximum number of backups displayed per page.
+HISTORY_MAX_PER_PAGE = 1000
+
 
 class HistoryPage(page_main.MainPage):
 
@@ -48,7 +57,8 @@ class HistoryPage(page_main.MainPage):
         return vpath
 
     @cherrypy.expose
-    def index(self, path_b=b""):
+    def index(self, path_b=b"", offset=u"0", limit=u"", earliest=u"",
+              latest=u""):
         assert isinstance(path_b, str)
 
         logger.debug("history [%s]" % decode_s(path_b, 'replace'))
@@ -60,19 +70,56 @@ class HistoryPage(page_main.MainPage):
             return self._compile_error_template(unicode(e))
 
         try:
-            parms = self._get_parms_for_page(repo_obj)
-        except librdiff.FileError:
+            offset = max(0, int(offset))
+            limit = int(limit) if limit else HISTORY_PER_PAGE
+            limit = max(1, min(limit, HISTORY_MAX_PER_PAGE))
+        except ValueError:
+            return self._compile_error_template(_("Invalid page."))
+
+        try:
+            earliest_date = self._parse_date(earliest)
+            latest_date = self._parse_date(latest, end_of_day=True)
+        except ValueError:
+            return self._compile_error_template(_("Invalid date."))
+
+        try:
+            parms = self._get_parms_for_page(repo_obj, offset, limit,
+                                             earliest_date, latest_date)
+            parms.update({"earliest": earliest, "latest": latest})
+        except librdiff.FileError as e:
             logger.exception("can't create page params")
             return self._compile_error_template(unicode(e))
 
         return self._compile_template("history.html", **parms)
 
-    def _get_parms_for_page(self, repo_obj):
+    def _parse_date(self, value, end_of_day=False):
+        """Parse a date (YYYY-MM-DD) into rdwTime. Return None if empty."""
+        if not value:
+            return None
+        seconds = calendar.timegm(time.strptime(value, "%Y-%m-%d"))
+        if end_of_day:
+            seconds += 24 * 60 * 60 - 1
+        return rdw_helpers.rdwTime(seconds)
+
+    def _get_parms_for_page(self, repo_obj, offset=0, limit=HISTORY_PER_PAGE,
+                            earliest_date=None, latest_date=None):
         assert isinstance(repo_obj, librdiff.RdiffRepo)
 
-        # Get history for the repo.
-        history_entries = repo_obj.get_history_entries()
+        # Get history for the repo. Entries are sorted from old to new and
+        # the page is displayed from new to old, so `offset` is counted from
+        # the most recent backup.
+        history_entries = repo_obj.get_history_entries(
+            -1, earliest_date, latest_date)
+        count = len(history_entries)
+        offset = min(offset, max(0, count - 1))
+        stop = count - offset
+        history_entries = history_entries[max(0, stop - limit):stop]
 
         return {"repo_name": repo_obj.display_name,
                 "repo_path": repo_obj.path,
-                "history_entries": history_entries}
+                "history_entries": history_entries,
+                "history_count": count,
+                "offset": offset,
+                "limit": limit,
+                "previous_offset": max(0, offset - limit) if offset > 0 else None,
+                "next_offset": offset + limit if offset + limit < count else None}
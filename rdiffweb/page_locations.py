@@ -65,7 +65,7 @@ class LocationsPage(page_main.MainPage):
         for user_repo in user_repos:
             try:
                 # Get reference to a repo object
-                repo_obj = librdiff.RdiffRepo(user_root_b, encode_s(user_repo))
+                repo_obj = self.app.repo_cache.get_repo(user_root_b, encode_s(user_repo))
                 path = repo_obj.path
                 name = repo_obj.display_name
                 in_progress = repo_obj.in_progress
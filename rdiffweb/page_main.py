@@ -81,7 +81,7 @@ class MainPage(Component):
 
         # Get reference to the repository (this ensure the repository does
         # exists and is valid.)
-        repo_obj = librdiff.RdiffRepo(user_root_b, repo_b)
+        repo_obj = self.app.repo_cache.get_repo(user_root_b, repo_b)
 
         # Get reference to the path.
         path_b = path_b[len(repo_b):]
@@ -20,6 +20,7 @@ from __future__ import unicode_literals
 
 import cherrypy
 import logging
+import multiprocessing
 import os
 import shutil
 
@@ -30,6 +31,7 @@ import librdiff
 import page_main
 import rdw_helpers
 
+from rdiffweb.core import RdiffError
 from rdw_helpers import decode_s, unquote_url
 
 # Define the logger
@@ -56,9 +58,33 @@ def autodelete():
 cherrypy.tools.autodelete = cherrypy.Tool('on_end_request', autodelete)
 
 
+def restore_job(repo_obj, path_b, file_b, restore_date, use_zip, **kwargs):
+    """Return the function executed by a restore worker. The repository is
+    kept by the function since the path objects only have a weak reference
+    to it and the repository may be evicted from the cache before the job
+    get executed."""
+    assert isinstance(repo_obj, librdiff.RdiffRepo)
+
+    def restore(dirpath):
+        path_obj = repo_obj.get_path(path_b)
+        return path_obj.restore(file_b, restore_date, use_zip, dirpath,
+                                **kwargs)
+    return restore
+
+
 class RestorePage(page_main.MainPage):
     _cp_config = {"response.stream": True, "response.timeout": 3000}
 
+    def _get_archive_options(self):
+        """Return the compression options of the archives."""
+        return {
+            'level': self.app.cfg.get_config_int("ArchiveCompressLevel", "6"),
+            'threads': self.app.cfg.get_config_int(
+                "ArchiveThreads", str(multiprocessing.cpu_count())),
+            'store': self.app.cfg.get_config_bool(
+                "ArchiveStoreCompressed", "True"),
+        }
+
     def _cp_dispatch(self, vpath):
         """Used to handle permalink URL.
         ref http://cherrypy.readthedocs.org/en/latest/advanced.html"""
@@ -110,8 +136,35 @@ class RestorePage(page_main.MainPage):
             if repo_obj.in_progress:
                 return self._compile_error_template(_("""A backup is currently in progress to this repository. Restores are disabled until this backup is complete."""))
 
-            # Restore the file
-            file_path_b = path_obj.restore(file_b, restore_date, usetar != "T")
+            # Send the file from the mirror if it didn't change since the
+            # restore date. Otherwise send it from cache if it was already
+            # restored.
+            cached_file_b = path_obj.get_mirror_file(file_b, restore_date)
+            cache_key = self.app.restore_cache.make_key(
+                repo_obj.repo_root, path_obj.path, file_b,
+                restore_date.getSeconds(), usetar == "T")
+            if not cached_file_b:
+                cached_file_b = self.app.restore_cache.get(cache_key)
+
+            archive_options = self._get_archive_options()
+            patch_files = self.app.cfg.get_config_bool(
+                "RestorePatchFiles", "True")
+            if not cached_file_b and self.app.restore_queue.enabled:
+                # Restore in background. The user is redirected to a page
+                # showing the progress.
+                job = self.app.restore_queue.submit(
+                    self.app.currentuser.username,
+                    file_b or os.path.basename(path_b),
+                    restore_job(repo_obj, path_obj.path, file_b,
+                                restore_date, usetar != "T",
+                                patch_files=patch_files, **archive_options),
+                    cache_key)
+                raise cherrypy.HTTPRedirect("/jobs/?id=%s" % job.id)
+            elif not cached_file_b:
+                # Restore the file
+                (file_path_b, filename, stream) = path_obj.restore_stream(
+                    file_b, restore_date, usetar != "T",
+                    patch_files=patch_files, **archive_options)
 
         except librdiff.FileError as e:
             logger.exception("fail to restore")
@@ -119,17 +172,119 @@ class RestorePage(page_main.MainPage):
         except ValueError:
             logger.exception("fail to restore")
             return self._compile_error_template(_("Fail to restore."))
+        except RdiffError as e:
+            logger.warn("restore refused: %s" % e.message)
+            return self._compile_error_template(e.message)
+
+        if cached_file_b:
+            logger.info("sending file [%s]" %
+                        decode_s(cached_file_b, 'replace'))
+            filename = os.path.basename(cached_file_b)
+            filename = filename.replace(b"\"", b"\\\"")
+            return serve_file(cached_file_b, None, disposition=b"attachment",
+                              name=filename)
 
         # The restored file path need to be deleted when the user is finish
-        # downloading. The auto-delete tool, will do it if we give him a file
-        # to delete.
-        cherrypy.request._autodelete_dir = file_path_b
+        # downloading. The auto-delete tool, will do it if we give him a
+        # directory to delete.
+        cherrypy.request._autodelete_dir = os.path.dirname(file_path_b)
 
         # The file name return by rdiff-backup is in bytes. We do not process
         # it. Cherrypy seams to handle it any weird encoding from this point.
         logger.info("restored file [%s]" % decode_s(file_path_b, 'replace'))
-        filename = os.path.basename(file_path_b)
         # Escape quotes in filename
         filename = filename.replace(b"\"", b"\\\"")
-        return serve_file(file_path_b, None, disposition=b"attachment",
+        if stream is None:
+            # Keep a copy of the file for the next downloads.
+            file_path_b = self.app.restore_cache.put(cache_key, file_path_b)
+            return serve_file(file_path_b, None, disposition=b"attachment",
+                              name=filename)
+
+        # Directories are archived while being sent.
+        if usetar != "T":
+            content_type = b"application/zip"
+        else:
+            content_type = b"application/x-gzip"
+        cherrypy.response.headers["Content-Type"] = content_type
+        cherrypy.response.headers["Content-Disposition"] = (
+            b'attachment; filename="%s"' % filename)
+        if self.app.restore_cache.enabled:
+            # Keep a copy of the archive for the next downloads.
+            stream = self._cache_stream(
+                stream, cache_key,
+                os.path.join(os.path.dirname(file_path_b), filename))
+        return stream
+
+    def _cache_stream(self, stream, cache_key, filename_b):
+        """Send the archive while writing a copy of it to `filename_b`. The
+        copy is added to the restore cache once the archive is completely
+        sent."""
+        cache = self.app.restore_cache
+        size = 0
+        f = open(filename_b, 'wb')
+        try:
+            for chunk in stream:
+                if f:
+                    size += len(chunk)
+                    if size > cache.max_size:
+                        # Too large to be kept in cache.
+                        f.close()
+                        f = None
+                    else:
+                        f.write(chunk)
+                yield chunk
+        finally:
+            if f:
+                f.close()
+        if size <= cache.max_size:
+            cache.put(cache_key, filename_b)
+
+
+class RestoreJobPage(page_main.MainPage):
+    """Page used to follow the progress of a restore job and to download the
+    restored data."""
+
+    _cp_config = {"response.stream": True}
+
+    def _get_job(self, job_id):
+        """Return the job of the current user or raise 404."""
+        try:
+            return self.app.restore_queue.get_job(
+                self.app.currentuser.username, job_id)
+        except KeyError:
+            logger.warn("invalid restore job [%s]" % job_id)
+            raise cherrypy.NotFound()
+
+    @cherrypy.expose
+    def index(self, id=""):
+        job = self._get_job(id)
+        # Refresh the page until the job is completed.
+        refresh = 2 if job.is_active else None
+        return self._compile_template(
+            "restore_job.html",
+            job=job,
+            name=decode_s(job.name, 'replace'),
+            refresh=refresh)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    def status(self, id=""):
+        job = self._get_job(id)
+        return {
+            "status": job.status,
+            "progress": job.progress,
+            "error": job.error,
+        }
+
+    @cherrypy.expose
+    def download(self, id=""):
+        job = self._get_job(id)
+        if job.status != job.DONE:
+            raise cherrypy.HTTPRedirect("/jobs/?id=%s" % job.id)
+        if not os.path.isfile(job.output):
+            # Removed from cache.
+            raise cherrypy.NotFound()
+        # Escape quotes in filename
+        filename = job.filename.replace(b"\"", b"\\\"")
+        return serve_file(job.output, None, disposition=b"attachment",
                           name=filename)
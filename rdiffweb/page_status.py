@@ -20,19 +20,39 @@ from __future__ import unicode_literals
 
 import cherrypy
 import logging
+import multiprocessing
+import os
+import threading
+import time
 
 import page_main
 import librdiff
 import rdw_helpers
 
+from i18n import ugettext as _
+from multiprocessing.pool import ThreadPool
 from rdw_helpers import encode_s, decode_s, unquote_url
 
 # Define the logger
 logger = logging.getLogger(__name__)
 
 
+class RepoTimeoutError(Exception):
+
+    """Reported when a repository is not read within StatusRepoTimeout."""
+
+
 class StatusPage(page_main.MainPage):
 
+    def __init__(self, app):
+        page_main.MainPage.__init__(self, app)
+        # Pool of threads reading the repositories, shared by every requests.
+        self._pool = None
+        self._pool_size = 0
+        self._pool_lock = threading.Lock()
+        # Reads submitted to the pool: {(user_root, repo): result}.
+        self._running = {}
+
     def _cp_dispatch(self, vpath):
         """Used to handle permalink URL.
         reference http://cherrypy.readthedocs.org/en/latest/advanced.html"""
@@ -145,6 +165,154 @@ class StatusPage(page_main.MainPage):
         return self._getUserMessages(user_repos, not failuresOnly, True,
                                      asOfDate, None)
 
+    def _get_repo_backups(self, user_root_b, repo_b, earliest_date,
+                          latest_date):
+        """Return the backups of the given repository. Executed by the
+        worker threads. Return a tuple (repo, backups, error) where error is
+        the raised exception. The error is translated by the request
+        thread."""
+        try:
+            repo_obj = self.app.repo_cache.get_repo(user_root_b, repo_b)
+            backups = repo_obj.get_history_entries(-1, earliest_date,
+                                                   latest_date)
+            return repo_b, [{"repo_path": repo_obj.path,
+                             "repo_name": repo_obj.display_name,
+                             "date": backup.date,
+                             "size": backup.size,
+                             "errors": backup.errors}
+                            for backup in backups], None
+        except librdiff.FileError as e:
+            return repo_b, None, e
+        except Exception as e:
+            logger.exception("fail to get backups of [%s]",
+                             decode_s(repo_b, 'replace'))
+            return repo_b, None, e
+
+    def _get_error_message(self, error):
+        """Return the translated message of the given error."""
+        if isinstance(error, librdiff.FileError):
+            return unicode(error)
+        if isinstance(error, RepoTimeoutError):
+            return _("Timeout while reading the repository.")
+        return _("Fail to read the repository.")
+
+    def _get_recorded_backups(self, user_root_b, repos_b, earliest_date,
+                              latest_date):
+        """
+        Get the backups of the repositories from the summaries recorded by
+        the status collector. The repositories are not read. Return a list of
+        tuple (repo, backups, error).
+        """
+        username = self.app.currentuser.username
+        summaries = self.app.userdb.get_backup_summaries(
+            username, earliest_date, latest_date)
+        errors = self.app.status_collector.get_repo_errors(username)
+        errors = {encode_s(k).strip(b"/"): v for k, v in errors.items()}
+        backups = {repo_b: [] for repo_b in repos_b}
+        for summary in summaries:
+            repo_b = encode_s(summary["repo_path"]).strip(b"/")
+            if repo_b not in backups:
+                continue
+            backups[repo_b].append(
+                {"repo_path": repo_b,
+                 "repo_name": decode_s(
+                     repo_b or os.path.basename(user_root_b.rstrip(b"/")),
+                     'replace'),
+                 "date": summary["date"],
+                 "size": summary["source_size"],
+                 "errors": summary["errors"]})
+        return [(repo_b, backups[repo_b], errors.get(repo_b))
+                for repo_b in repos_b]
+
+    def _collect_repo_backups(self, user_root_b, repos_b, earliest_date,
+                              latest_date):
+        """
+        Get the backups of every repositories using the StatusThreads
+        threads shared by every requests. Repositories taking more than
+        StatusRepoTimeout seconds (e.g.: hung network mount) are reported as
+        errors and are not read again until the hung thread completes.
+        """
+        pool = self._get_pool()
+        if pool is None or len(repos_b) <= 1:
+            results = [self._get_repo_backups(user_root_b, repo_b,
+                                              earliest_date, latest_date)
+                       for repo_b in repos_b]
+        else:
+            results = self._wait_repo_backups(
+                pool, user_root_b, repos_b, earliest_date, latest_date)
+        return [(repo_b, backups,
+                 self._get_error_message(error) if error is not None else None)
+                for repo_b, backups, error in results]
+
+    def _get_pool(self):
+        """Return the thread pool used to read the repositories or None if
+        the repositories should be read by the request thread."""
+        with self._pool_lock:
+            if self._pool is None:
+                threads = self.app.cfg.get_config_int(
+                    "StatusThreads", str(multiprocessing.cpu_count()))
+                if threads <= 1:
+                    return None
+                self._pool = ThreadPool(threads)
+                self._pool_size = threads
+            return self._pool
+
+    def stop(self):
+        """Terminate the threads reading the repositories."""
+        with self._pool_lock:
+            pool = self._pool
+            self._pool = None
+            self._pool_size = 0
+            self._running = {}
+        if pool:
+            pool.terminate()
+
+    def _wait_repo_backups(self, pool, user_root_b, repos_b, earliest_date,
+                           latest_date):
+        """
+        Submit the repositories to the pool and wait for the results.
+        """
+        timeout = self.app.cfg.get_config_int("StatusRepoTimeout", "30")
+        pending = []
+        with self._pool_lock:
+            for repo_b in repos_b:
+                key = (user_root_b, repo_b)
+                result = self._running.get(key)
+                if result is not None and not result.ready():
+                    # Still hung since a previous request, don't queue
+                    # another read.
+                    pending.append((repo_b, None))
+                    continue
+                result = pool.apply_async(
+                    self._get_repo_backups,
+                    (user_root_b, repo_b, earliest_date, latest_date))
+                self._running[key] = result
+                pending.append((repo_b, result))
+
+        # Repositories are processed in order. When waiting for a
+        # repository, it's either running or completed, unless every
+        # threads are hung.
+        results = []
+        hung = 0
+        for repo_b, result in pending:
+            if result is not None and hung < self._pool_size:
+                start = time.time()
+                result.wait(timeout)
+                if not result.ready():
+                    logger.warn("timeout reading backups of [%s] after %.1fs",
+                                decode_s(repo_b, 'replace'),
+                                time.time() - start)
+                    hung += 1
+            if result is not None and result.ready():
+                with self._pool_lock:
+                    key = (user_root_b, repo_b)
+                    if self._running.get(key) is result:
+                        del self._running[key]
+                results.append(result.get())
+            else:
+                results.append((repo_b, None, RepoTimeoutError()))
+        return results
+
     def _getUserMessages(self,
                          repos,
                          includeSuccess,
@@ -155,26 +323,36 @@ class StatusPage(page_main.MainPage):
         user_root = self.app.userdb.get_user_root(self.app.currentuser.username)
         user_root_b = encode_s(user_root)
 
+        # Get binary representation of the repos
+        repos_b = [
+            (encode_s(repo) if isinstance(repo, unicode) else repo).lstrip(b"/")
+            for repo in repos]
+
         repoErrors = []
         allBackups = []
-        for repo in repos:
-            # Get binary representation of the repo
-            repo_b = encode_s(repo) if isinstance(repo, unicode) else repo
-            repo_b = repo_b.lstrip(b"/")
-            try:
-                repo_obj = librdiff.RdiffRepo(user_root_b, repo_b)
-                backups = repo_obj.get_history_entries(-1, earliest_date,
-                                                       latest_date)
-                allBackups += [{"repo_path": repo_obj.path,
-                                "repo_name": repo_obj.display_name,
-                                "date": backup.date,
-                                "size": backup.size,
-                                "errors": backup.errors} for backup in backups]
-            except librdiff.FileError as e:
+        if self.app.status_collector.enabled:
+            # Repositories not collected yet (e.g.: new repository) are read.
+            collected = set(
+                encode_s(x).strip(b"/") for x in
+                self.app.status_collector.get_collected_repos(
+                    self.app.currentuser.username))
+            recorded_b = [x for x in repos_b if x.strip(b"/") in collected]
+            results = self._get_recorded_backups(
+                user_root_b, recorded_b, earliest_date, latest_date)
+            results += self._collect_repo_backups(
+                user_root_b, [x for x in repos_b if x not in recorded_b],
+                earliest_date, latest_date)
+        else:
+            results = self._collect_repo_backups(
+                user_root_b, repos_b, earliest_date, latest_date)
+        for repo_b, backups, error in results:
+            if error is None:
+                allBackups += backups
+            else:
                 repoErrors.append(
                     {"repo_path": repo_b,
                      "repo_name": decode_s(repo_b, 'replace'),
-                     "error": unicode(e)})
+                     "error": error})
 
         allBackups.sort(lambda x, y: cmp(y["date"], x["date"]))
         failedBackups = filter(lambda x: x["errors"], allBackups)
@@ -19,22 +19,40 @@
 from __future__ import unicode_literals
 
 from rdiffweb.rdw_plugin import IPasswordStore
+from rdiffweb.rdw_pool import ConnectionPool
+import logging
 import warnings
 
 """We do no length validation for incoming parameters, since truncated values will
 at worst lead to slightly confusing results, but no security risks"""
 
+# Define the logger
+logger = logging.getLogger(__name__)
+
 
 class mysqlUserDB(IPasswordStore):
 
-    def __init__(self, configFilePath=None):
+    def activate(self):
+        """
+        Called by the plugin manager to setup the plugin.
+        """
+        super(mysqlUserDB, self).activate()
         import MySQLdb
-        self.configFilePath = configFilePath
         MySQLdb.paramstyle = "pyformat"
         self.userRootCache = {}
-        self._connect()
+        self._pool = ConnectionPool(
+            self._connect,
+            self.app.cfg.get_config_int("MySQLPoolSize", "5"),
+            self.app.cfg.get_config_int("MySQLPoolIdleTimeout", "300"))
         self._updateToLatestFormat()
 
+    def deactivate(self):
+        """
+        Called by the plugin manager when the application stop.
+        """
+        self._pool.close()
+        super(mysqlUserDB, self).deactivate()
+
     def exists(self, username):
         results = self._executeQuery(
             "SELECT Username FROM users WHERE Username = %(user)s", user=username)
@@ -70,6 +88,49 @@ class mysqlUserDB(IPasswordStore):
         users = [x[0] for x in self._executeQuery(query)]
         return users
 
+    def _users_where(self, admin_only, search):
+        """Build the WHERE clause to filter users."""
+        conditions = []
+        args = {}
+        if admin_only:
+            conditions.append("IsAdmin != 0")
+        if search:
+            # Escape the wildcards of LIKE.
+            args['pattern'] = "%" + search.replace("\\", "\\\\").replace(
+                "%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(Username LIKE %(pattern)s OR "
+                              "UserEmail LIKE %(pattern)s)")
+        if not conditions:
+            return "", args
+        return " WHERE " + " AND ".join(conditions), args
+
+    def count_users(self, admin_only=False, search=None):
+        """
+        Return the number of users matching the given criteria.
+        """
+        where, args = self._users_where(admin_only, search)
+        return int(self._executeQuery(
+            "SELECT COUNT(*) FROM users" + where, **args)[0][0])
+
+    def get_users(self, admin_only=False, search=None, offset=0, limit=None):
+        """
+        Return the users matching the given criteria with a single query.
+        """
+        where, args = self._users_where(admin_only, search)
+        query = ("SELECT Username, UserEmail, IsAdmin, UserRoot FROM users" +
+                 where + " ORDER BY Username")
+        if limit is not None:
+            query += " LIMIT %(limit)s OFFSET %(offset)s"
+        elif offset:
+            # MySQL doesn't support OFFSET without LIMIT.
+            query += " LIMIT 18446744073709551615 OFFSET %(offset)s"
+        args.update({'limit': limit, 'offset': offset})
+        return [{"username": row[0],
+                 "email": row[1],
+                 "is_admin": bool(row[2]),
+                 "user_root": row[3]}
+                for row in self._executeQuery(query, **args)]
+
     def add_user(self, username):
         if self.exists(username):
             raise ValueError
@@ -107,20 +168,30 @@ class mysqlUserDB(IPasswordStore):
 
         # We don't want to just delete and recreate the repos, since that
         # would lose notification information.
-        existingRepos = self.get_repos(username)
-        reposToDelete = filter(lambda x: x not in repoPaths, existingRepos)
-        reposToAdd = filter(lambda x: x not in existingRepos, repoPaths)
-
-        # delete any obsolete repos
-        for repo in reposToDelete:
-            query = "DELETE FROM repos WHERE UserID=%(userID)s AND RepoPath= BINARY %(repo)s"
-            self._executeQuery(query, repo=repo, userID=str(userID))
-
-        # add in new repos
-        query = "INSERT INTO repos (UserID, RepoPath) values (%s, %s)"
-        repoPaths = [(str(userID), repo) for repo in reposToAdd]
-        cursor = self.sqlConnection.cursor()
-        cursor.executemany(query, repoPaths)
+        repoPaths = set(repoPaths)
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("START TRANSACTION")
+            cursor.execute(
+                "SELECT RepoPath FROM repos WHERE UserID = %s FOR UPDATE",
+                (userID,))
+            existingRepos = set(row[0] for row in cursor.fetchall())
+            reposToDelete = existingRepos - repoPaths
+            reposToAdd = repoPaths - existingRepos
+            if not reposToDelete and not reposToAdd:
+                cursor.execute("ROLLBACK")
+                return
+            logger.debug("updating repos of user [%s]: %d added, %d deleted",
+                         username, len(reposToAdd), len(reposToDelete))
+            cursor.executemany(
+                "DELETE FROM repos WHERE UserID = %s AND RepoPath = BINARY %s",
+                [(userID, repo) for repo in reposToDelete])
+            cursor.executemany(
+                "INSERT INTO repos (UserID, RepoPath) values (%s, %s)",
+                [(userID, repo) for repo in reposToAdd])
+            # The connection is discarded by the pool on error, so the
+            # transaction is rolled back.
+            cursor.execute("COMMIT")
 
     def set_password(self, username, password, old_password=None):
         assert isinstance(username, unicode)
@@ -189,28 +260,32 @@ class mysqlUserDB(IPasswordStore):
         self._executeQuery(query, value=valueStr, user=username)
 
     def _internalExecuteQuery(self, query, **kwargs):
-        cursor = self.sqlConnection.cursor()
-        cursor.execute(query, kwargs)
-        return cursor.fetchall()
+        with self._pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query, kwargs)
+            return cursor.fetchall()
 
     def _executeQuery(self, query, **kwargs):
-        # The mysql server connection times out after a while.  Catch this, and
-        # try again
+        # The mysql server may close the connection at any time. The broken
+        # connection is discarded by the pool, so try again.
         import MySQLdb
         try:
             return self._internalExecuteQuery(query, **kwargs)
         except MySQLdb.OperationalError:
-            self._connect()
             return self._internalExecuteQuery(query, **kwargs)
 
     def _connect(self):
         import MySQLdb
-        sqlHost = rdw_config.get_config("MySQLHost")
-        sqlUsername = rdw_config.get_config("MySQLUsername")
-        sqlPassword = rdw_config.get_config("MySQLPassword")
-        sqlDatabaseName = rdw_config.get_config("MySQLDatabase")
-        self.sqlConnection = MySQLdb.connect(
+        sqlHost = self.app.cfg.get_config("MySQLHost")
+        sqlUsername = self.app.cfg.get_config("MySQLUsername")
+        sqlPassword = self.app.cfg.get_config("MySQLPassword")
+        sqlDatabaseName = self.app.cfg.get_config("MySQLDatabase")
+        logger.debug("connecting to mysql database [%s]", sqlHost)
+        conn = MySQLdb.connect(
             host=sqlHost, user=sqlUsername, passwd=sqlPassword, db=sqlDatabaseName)
+        # Pooled connections must not keep a transaction open.
+        conn.autocommit(True)
+        return conn
 
     def _hashPassword(self, password):
         import sha
@@ -234,7 +309,8 @@ RepoID int(11) NOT NULL auto_increment,
 UserID int(11) NOT NULL,
 RepoPath varchar (255) NOT NULL,
 MaxAge tinyint NOT NULL DEFAULT 0,
-primary key (RepoID))"""
+primary key (RepoID),
+index UserRepo (UserID, RepoPath))"""
         ]
 
     def _updateToLatestFormat(self):
@@ -265,6 +341,13 @@ primary key (RepoID))"""
             self._executeQuery(
                 'alter table users add column RestoreFormat tinyint NOT NULL DEFAULT TRUE')
 
+        # Make sure that the repos table is indexed by user.
+        indexNames = [index[2].lower()
+                      for index in self._executeQuery("show index from repos")]
+        if "userrepo" not in indexNames:
+            self._executeQuery(
+                'alter table repos add index UserRepo (UserID, RepoPath)')
+
     def _getTables(self):
         return [table[0].lower() for table in self._executeQuery("show tables")]
 
@@ -20,8 +20,9 @@ from __future__ import unicode_literals
 
 from rdiffweb.i18n import ugettext as _
 from rdiffweb.rdw_plugin import IPasswordStore, IDatabase
-from rdiffweb.rdw_helpers import encode_s, decode_s
-from threading import RLock
+from rdiffweb.rdw_helpers import encode_s, decode_s, rdwTime
+from contextlib import contextmanager
+from threading import RLock, current_thread, local
 from rdiffweb.core import InvalidUserError
 import logging
 
@@ -49,9 +50,34 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
         # Get database location.
         self._db_file = self.app.cfg.get_config("SQLiteDBFile",
                                                 "/etc/rdiffweb/rdw.db")
+        # Time to wait (in seconds) for a lock to be released.
+        self._timeout = self.app.cfg.get_config_int("SQLiteBusyTimeout", "10")
+
+        # Connections are kept open and used by a single thread.
+        self._local = local()
+        self._connections = {}
+        self._connections_lock = RLock()
         self._user_root_cache = {}
         self._create_or_update()
 
+    def deactivate(self):
+        """
+        Called by the plugin manager when the application stop.
+        """
+        self.close()
+        super(SQLiteUserDB, self).deactivate()
+
+    def close(self):
+        """
+        Close every connections to the database. Threads will reconnect on
+        their next query.
+        """
+        with self._connections_lock:
+            connections = self._connections.values()
+            self._connections = {}
+        for conn in connections:
+            conn.close()
+
     def exists(self, username):
         """
         Check if `username` exists.
@@ -83,12 +109,13 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
         Get list of repos for the given `username`.
         """
         assert isinstance(username, unicode)
-        if not self.exists(username):
+        query = ("SELECT repos.RepoPath FROM users LEFT JOIN repos "
+                 "ON repos.UserID = users.UserID WHERE users.Username = ?")
+        results = self._execute_query(query, (username,))
+        if not results:
             raise InvalidUserError(username)
-        query = ("SELECT RepoPath FROM repos WHERE UserID = %d" %
-                 self._get_user_id(username))
         repos = [
-            self._encode_path(row[0]) for row in self._execute_query(query)
+            self._encode_path(row[0]) for row in results if row[0] is not None
         ]
         repos.sort(lambda x, y: cmp(x.upper(), y.upper()))
         return repos
@@ -96,9 +123,10 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
     def get_repo_maxage(self, username, repoPath):
         assert isinstance(username, unicode)
 
-        query = "SELECT MaxAge FROM repos WHERE RepoPath=? AND UserID = " + \
-            str(self._get_user_id(username))
-        results = self._execute_query(query, (repoPath,))
+        query = ("SELECT repos.MaxAge FROM repos JOIN users "
+                 "ON repos.UserID = users.UserID "
+                 "WHERE users.Username = ? AND repos.RepoPath = ?")
+        results = self._execute_query(query, (username, repoPath))
         assert len(results) == 1
         return int(results[0][0])
 
@@ -135,6 +163,46 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
         users = [x[0] for x in self._execute_query(query)]
         return users
 
+    def _users_where(self, admin_only, search):
+        """Build the WHERE clause to filter users."""
+        conditions = []
+        args = []
+        if admin_only:
+            # Same as _bool(), the value may be stored as a string.
+            conditions.append("LOWER(CAST(IsAdmin AS TEXT)) IN ('true', '1')")
+        if search:
+            # Escape the wildcards of LIKE.
+            pattern = "%" + search.replace("\\", "\\\\").replace(
+                "%", "\\%").replace("_", "\\_") + "%"
+            conditions.append("(Username LIKE ? ESCAPE '\\' OR "
+                              "UserEmail LIKE ? ESCAPE '\\')")
+            args.extend([pattern, pattern])
+        if not conditions:
+            return "", args
+        return " WHERE " + " AND ".join(conditions), args
+
+    def count_users(self, admin_only=False, search=None):
+        """
+        Return the number of users matching the given criteria.
+        """
+        where, args = self._users_where(admin_only, search)
+        return self._execute_query(
+            "SELECT COUNT(*) FROM users" + where, args)[0][0]
+
+    def get_users(self, admin_only=False, search=None, offset=0, limit=None):
+        """
+        Return the users matching the given criteria with a single query.
+        """
+        where, args = self._users_where(admin_only, search)
+        query = ("SELECT Username, UserEmail, IsAdmin, UserRoot FROM users" +
+                 where + " ORDER BY Username LIMIT ? OFFSET ?")
+        args.extend([-1 if limit is None else limit, offset])
+        return [{"username": row[0],
+                 "email": row[1],
+                 "is_admin": self._bool(row[2]),
+                 "user_root": self._encode_path(row[3])}
+                for row in self._execute_query(query, args)]
+
     def add_user(self, username):
         """
         Add a new username to this userdb.
@@ -154,10 +222,14 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
             return False
         # Delete user
         logger.info("deleting user [%s]", username)
-        self._execute_query("DELETE FROM repos WHERE UserID=%d" %
-                            self._get_user_id(username))
-        self._execute_query("DELETE FROM users WHERE Username = ?",
-                            (username,))
+        with self._transaction() as cursor:
+            for table in ['repos', 'backups']:
+                cursor.execute(
+                    "DELETE FROM %s WHERE UserID IN "
+                    "(SELECT UserID FROM users WHERE Username = ?)" % table,
+                    (username,))
+            cursor.execute("DELETE FROM users WHERE Username = ?",
+                           (username,))
         return True
 
     def set_is_admin(self, username, is_admin):
@@ -179,30 +251,91 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
 
     def set_repos(self, username, repoPaths):
         assert isinstance(username, unicode)
-        if not self.exists(username):
-            raise InvalidUserError(username)
-        userID = self._get_user_id(username)
-
         # We don't want to just delete and recreate the repos, since that
         # would lose notification information.
-        existingRepos = self.get_repos(username)
-        reposToDelete = filter(lambda x: x not in repoPaths, existingRepos)
-        reposToAdd = filter(lambda x: x not in existingRepos, repoPaths)
-
-        # delete any obsolete repos
-        for repo in reposToDelete:
-            query = "DELETE FROM repos WHERE UserID=? AND RepoPath=?"
-            self._execute_query(query, (str(userID), repo))
-
-        # add in new repos
-        query = "INSERT INTO repos (UserID, RepoPath) values (?, ?)"
-        repoPaths = [[str(userID), repo] for repo in reposToAdd]
-        conn = self._connect()
-        try:
-            cursor = conn.cursor()
-            cursor.executemany(query, repoPaths)
-        finally:
-            conn.close()
+        repoPaths = set(self._encode_path(x) for x in repoPaths)
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT UserID FROM users WHERE Username = ?", (username,))
+            row = cursor.fetchone()
+            if row is None:
+                raise InvalidUserError(username)
+            userID = row[0]
+            cursor.execute(
+                "SELECT RepoPath FROM repos WHERE UserID = ?", (userID,))
+            existingRepos = set(self._encode_path(x[0]) for x in cursor)
+            reposToDelete = existingRepos - repoPaths
+            reposToAdd = repoPaths - existingRepos
+            if not reposToDelete and not reposToAdd:
+                # Nothing changed, the database is not locked for writing.
+                return
+            logger.debug("updating repos of user [%s]: %d added, %d deleted",
+                         username, len(reposToAdd), len(reposToDelete))
+            for table in ['repos', 'backups']:
+                cursor.executemany(
+                    "DELETE FROM %s WHERE UserID = ? AND RepoPath = ?" % table,
+                    [(userID, repo) for repo in reposToDelete])
+            cursor.executemany(
+                "INSERT INTO repos (UserID, RepoPath) values (?, ?)",
+                [(userID, repo) for repo in reposToAdd])
+
+    def add_backup_summaries(self, username, repoPath, summaries):
+        assert isinstance(username, unicode)
+        repoPath = self._encode_path(repoPath)
+        with self._transaction() as cursor:
+            cursor.execute(
+                "SELECT UserID FROM users WHERE Username = ?", (username,))
+            row = cursor.fetchone()
+            if row is None:
+                raise InvalidUserError(username)
+            cursor.executemany(
+                "INSERT OR REPLACE INTO backups (UserID, RepoPath, Date, "
+                "TzOffset, SourceSize, IncrementSize, ErrorCount, Errors) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(row[0], repoPath, x['date'].getSeconds(),
+                  x['date'].tzOffset, x['source_size'], x['increment_size'],
+                  x['error_count'], x['errors']) for x in summaries])
+
+    def get_backup_summaries(self, username, earliest_date=None,
+                             latest_date=None):
+        assert isinstance(username, unicode)
+        query = ("SELECT backups.RepoPath, Date, TzOffset, SourceSize, "
+                 "IncrementSize, ErrorCount, Errors FROM backups "
+                 "JOIN users ON backups.UserID = users.UserID "
+                 "JOIN repos ON repos.UserID = backups.UserID "
+                 "AND repos.RepoPath = backups.RepoPath "
+                 "WHERE users.Username = ?")
+        args = [username]
+        if earliest_date:
+            query += " AND Date >= ?"
+            args.append(int(earliest_date.getSeconds()))
+        if latest_date:
+            query += " AND Date <= ?"
+            args.append(int(latest_date.getSeconds()))
+        query += " ORDER BY Date DESC"
+        summaries = []
+        for row in self._execute_query(query, args):
+            date = rdwTime(row[1] + row[2])
+            date.tzOffset = row[2]
+            summaries.append({"repo_path": self._encode_path(row[0]),
+                              "date": date,
+                              "source_size": row[3],
+                              "increment_size": row[4],
+                              "error_count": row[5],
+                              "errors": row[6]})
+        return summaries
+
+    def get_last_backup_dates(self, username):
+        assert isinstance(username, unicode)
+        query = ("SELECT RepoPath, MAX(Date), TzOffset FROM backups "
+                 "JOIN users ON backups.UserID = users.UserID "
+                 "WHERE users.Username = ? GROUP BY RepoPath")
+        dates = {}
+        for row in self._execute_query(query, (username,)):
+            date = rdwTime(row[1] + row[2])
+            date.tzOffset = row[2]
+            dates[self._encode_path(row[0])] = date
+        return dates
 
     def set_password(self, username, password, old_password=None):
         assert isinstance(username, unicode)
@@ -222,9 +355,9 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
         assert isinstance(username, unicode)
         if repoPath not in self.get_repos(username):
             raise ValueError
-        query = "UPDATE repos SET MaxAge=? WHERE RepoPath=? AND UserID = " + \
-            str(self._get_user_id(username))
-        self._execute_query(query, (maxAge, repoPath))
+        query = ("UPDATE repos SET MaxAge=? WHERE RepoPath=? AND UserID = "
+                 "(SELECT UserID FROM users WHERE Username = ?)")
+        self._execute_query(query, (maxAge, repoPath, username))
 
     def set_user_root(self, username, user_root):
         assert isinstance(username, unicode)
@@ -245,16 +378,11 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
             return path.decode('utf-8')
         return path
 
-    def _get_user_id(self, username):
-        assert self.exists(username)
-        return self._get_user_field(username, 'UserID')
-
     def _get_user_field(self, username, fieldName):
-        if not self.exists(username):
-            raise InvalidUserError(username)
         query = "SELECT " + fieldName + " FROM users WHERE Username = ?"
         results = self._execute_query(query, (username,))
-        assert len(results) == 1
+        if not results:
+            raise InvalidUserError(username)
         return results[0][0]
 
     def _set_user_field(self, username, fieldName, value):
@@ -283,14 +411,48 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
 
     def _execute_query(self, query, args=()):
         assert isinstance(query, unicode)
-        conn = self._connect()
+        cursor = self._get_connection().cursor()
         try:
-            cursor = conn.cursor()
             cursor.execute(query, args)
-            results = cursor.fetchall()
+            return cursor.fetchall()
         finally:
-            conn.close()
-        return results
+            cursor.close()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Execute the statements in a transaction. Yield a cursor. The
+        transaction is rolled back if an exception is raised.
+        """
+        conn = self._get_connection()
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN TRANSACTION")
+            yield cursor
+            cursor.execute("COMMIT TRANSACTION")
+        except:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    def _get_connection(self):
+        """
+        Return the connection of the current thread. The connection is kept
+        open, so sqlite3 may reuse the prepared statements.
+        """
+        conn = getattr(self._local, 'conn', None)
+        with self._connections_lock:
+            if conn is not None and self._connections.get(current_thread()) is conn:
+                return conn
+            # Close connections of terminated threads.
+            for thread in self._connections.keys():
+                if not thread.is_alive():
+                    self._connections.pop(thread).close()
+            conn = self._connect()
+            self._connections[current_thread()] = conn
+        self._local.conn = conn
+        return conn
 
     def _connect(self):
         """
@@ -304,8 +466,12 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
         connect_path = self._db_file
         if not connect_path:
             connect_path = ":memory:"
-        conn = sqlite3.connect(connect_path)
+        # The connection may be closed by another thread.
+        conn = sqlite3.connect(connect_path, timeout=self._timeout,
+                               check_same_thread=False)
         conn.isolation_level = None
+        # Let readers access the database while it's written.
+        conn.execute("PRAGMA journal_mode=WAL")
         return conn
 
     def _create_or_update(self):
@@ -318,18 +484,15 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
 
             # Check if tables exists, if not created them.
             if self._get_tables():
+                self._update()
                 return
 
             # Create the tables.
-            conn = self._connect()
-            try:
-                cursor = conn.cursor()
-                cursor.execute("BEGIN TRANSACTION")
+            with self._transaction() as cursor:
                 for statement in self._get_create_statements():
                     cursor.execute(statement)
-                cursor.execute("COMMIT TRANSACTION")
-            finally:
-                conn.close()
+                for statement in self._get_update_statements():
+                    cursor.execute(statement)
 
             # Create admin user
             self.add_user('admin')
@@ -337,6 +500,14 @@ class SQLiteUserDB(IPasswordStore, IDatabase):
             self.set_user_root('admin', '/backups/')
             self.set_is_admin('admin', True)
 
+    def _update(self):
+        """
+        Update the schema of an existing database.
+        """
+        with self._transaction() as cursor:
+            for statement in self._get_update_statements():
+                cursor.execute(statement)
+
     def _get_tables(self):
         return [
             column[0] for column in
@@ -359,5 +530,27 @@ RepoPath varchar (255) NOT NULL,
 MaxAge tinyint NOT NULL DEFAULT 0)"""
         ]
 
+    def _get_update_statements(self):
+        """
+        Statements executed on every start to migrate the schema. They must
+        be idempotent.
+        """
+        return [
+            """create index if not exists repos_userid_repopath
+on repos (UserID, RepoPath)""",
+            """create table if not exists backups (
+UserID int(11) NOT NULL,
+RepoPath varchar (255) NOT NULL,
+Date integer NOT NULL,
+TzOffset integer NOT NULL DEFAULT 0,
+SourceSize integer NOT NULL DEFAULT 0,
+IncrementSize integer NOT NULL DEFAULT 0,
+ErrorCount integer NOT NULL DEFAULT 0,
+Errors text NOT NULL DEFAULT "",
+primary key (UserID, RepoPath, Date))""",
+            """create index if not exists backups_userid_date
+on backups (UserID, Date)""",
+        ]
+
     def supports(self, operation):
         return hasattr(self, operation)
@@ -18,6 +18,7 @@
 
 from __future__ import unicode_literals
 
+import threading
 import unittest
 from rdiffweb.plugins.db_sqlite import SQLiteUserDB
 from rdiffweb.test import MockRdiffwebApp
@@ -164,6 +165,116 @@ class SQLiteUserDBTest(unittest.TestCase):
         self.db.set_repos("kim", [])
         self.assertEquals([], self.db.get_repos('kim'))
 
+    def test_set_repos(self):
+        self.db.add_user('kim')
+        self.db.set_repos("kim", ['repo1', 'repo2'])
+        self.db.set_repo_maxage('kim', 'repo2', 5)
+        self.db.set_repos("kim", ['repo2', 'repo3'])
+        self.assertEquals(['repo2', 'repo3'], self.db.get_repos('kim'))
+        # Existing repos are kept.
+        self.assertEquals(5, self.db.get_repo_maxage('kim', 'repo2'))
+        self.assertEquals(0, self.db.get_repo_maxage('kim', 'repo3'))
+
+    def test_set_repos_unchanged(self):
+        self.db.add_user('kim')
+        self.db.set_repos("kim", [b'repo1', 'repo2'])
+        self.db.set_repos("kim", ['repo1', b'repo2', 'repo2'])
+        self.assertEquals(['repo1', 'repo2'], self.db.get_repos('kim'))
+
+    def test_set_repos_invalid_user(self):
+        with self.assertRaises(InvalidUserError):
+            self.db.set_repos("invalid", ['repo1'])
+        with self.assertRaises(InvalidUserError):
+            self.db.get_repos("invalid")
+
+    def test_repos_index(self):
+        indexes = [x[0] for x in self.db._execute_query(
+            "select name from sqlite_master where type='index'")]
+        self.assertIn('repos_userid_repopath', indexes)
+
+    def test_get_users(self):
+        for name in ['kim', 'bob', 'anna_b']:
+            self.db.add_user(name)
+        self.db.set_email('bob', 'bob@example.com')
+        self.db.set_is_admin('kim', True)
+        users = self.db.get_users()
+        self.assertEquals(['admin', 'anna_b', 'bob', 'kim'],
+                          [x['username'] for x in users])
+        self.assertEquals({'username': 'bob', 'email': 'bob@example.com',
+                           'is_admin': False, 'user_root': ''}, users[2])
+        self.assertEquals(4, self.db.count_users())
+
+    def test_get_users_with_criteria(self):
+        for name in ['kim', 'bob', 'anna_b']:
+            self.db.add_user(name)
+        self.db.set_email('bob', 'bob@example.com')
+        self.db.set_is_admin('kim', True)
+        self.assertEquals(
+            ['kim'],
+            [x['username'] for x in self.db.get_users(admin_only=True)])
+        self.assertEquals(
+            ['bob'],
+            [x['username'] for x in self.db.get_users(search='EXAMPLE')])
+        # Wildcards are escaped.
+        self.assertEquals(
+            ['anna_b'],
+            [x['username'] for x in self.db.get_users(search='_')])
+        self.assertEquals(1, self.db.count_users(admin_only=True))
+        self.assertEquals(1, self.db.count_users(search='_'))
+
+    def test_get_users_with_admin_as_string(self):
+        for name in ['kim', 'bob']:
+            self.db.add_user(name)
+        self.db._execute_query(
+            "UPDATE users SET IsAdmin = 'True' WHERE Username = 'kim'")
+        self.db._execute_query(
+            "UPDATE users SET IsAdmin = 'False' WHERE Username = 'bob'")
+        self.assertTrue(self.db.is_admin('kim'))
+        self.assertFalse(self.db.is_admin('bob'))
+        self.assertEquals(
+            ['kim'],
+            [x['username'] for x in self.db.get_users(admin_only=True)])
+        self.assertEquals(1, self.db.count_users(admin_only=True))
+
+    def test_get_users_with_pagination(self):
+        for name in ['kim', 'bob', 'anna']:
+            self.db.add_user(name)
+        self.assertEquals(
+            ['anna', 'bob'],
+            [x['username'] for x in self.db.get_users(offset=1, limit=2)])
+        self.assertEquals(
+            ['bob', 'kim'],
+            [x['username'] for x in self.db.get_users(offset=2)])
+
+    def test_connection_per_thread(self):
+        conn = self.db._get_connection()
+        self.assertIs(conn, self.db._get_connection())
+        others = []
+        thread = threading.Thread(
+            target=lambda: others.append(self.db._get_connection()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(conn, others[0])
+
+    def test_close(self):
+        conn = self.db._get_connection()
+        self.db.close()
+        # A new connection is created on next query.
+        self.assertTrue(self.db.exists('admin'))
+        self.assertIsNot(conn, self.db._get_connection())
+
+    def test_wal_mode(self):
+        self.assertEquals(
+            'wal', self.db._execute_query("PRAGMA journal_mode")[0][0])
+
+    def test_transaction_rollback(self):
+        self.db.add_user('kim')
+        with self.assertRaises(ValueError):
+            with self.db._transaction() as cursor:
+                cursor.execute("DELETE FROM users WHERE Username = ?", ('kim',))
+                raise ValueError()
+        self.assertTrue(self.db.exists('kim'))
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
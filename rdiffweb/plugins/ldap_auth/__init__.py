@@ -20,10 +20,14 @@ from __future__ import unicode_literals
 
 import ldap
 import logging
+import threading
+import time
 
+from collections import OrderedDict
 from rdiffweb.i18n import ugettext as _
 from rdiffweb.rdw_helpers import encode_s, decode_s
 from rdiffweb.rdw_plugin import IPasswordStore
+from rdiffweb.rdw_pool import ConnectionPool
 from rdiffweb.core import RdiffError
 
 # Define the logger
@@ -86,22 +90,43 @@ class LdapPasswordStore(IPasswordStore):
         # Check if password change are allowed.
         self.allow_password_change = self.app.cfg.get_config_bool(
             "LdapAllowPasswordChange", "false")
+        # Pool of connections bound with the service account.
+        self._pool = ConnectionPool(
+            self._connect,
+            self.app.cfg.get_config_int("LdapPoolSize", "5"),
+            self.app.cfg.get_config_int("LdapPoolIdleTimeout", "300"),
+            ping=lambda l: l.whoami_s(),
+            close=lambda l: l.unbind_s())
+        # Cache of search results by username: {username: (expire, r)} from
+        # least to most recently used.
+        self._cache_ttl = self.app.cfg.get_config_int("LdapCacheTTL", "60")
+        self._cache_size = self.app.cfg.get_config_int("LdapCacheSize", "1000")
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def deactivate(self):
+        """Called by the plugin manager when the application stop."""
+        self._pool.close()
+        super(LdapPasswordStore, self).deactivate()
 
     def are_valid_credentials(self, username, password):
         """Check if the given credential as valid according to LDAP."""
         assert isinstance(username, unicode)
         assert isinstance(password, unicode)
 
-        def check_crendential(l, r):
+        def check_crendential(r):
             # Check results
             if len(r) != 1:
                 logger.debug("user [%s] not found in LDAP" % username)
                 return None
 
-            # Bind using the user credentials. Throws an exception in case of
-            # error.
-            l.simple_bind_s(r[0][0], encode_s(password))
-            l.unbind_s()
+            # Bind using the user credentials on a new connection. Throws an
+            # exception in case of error.
+            l = self._initialize()
+            try:
+                l.simple_bind_s(r[0][0], encode_s(password))
+            finally:
+                l.unbind_s()
             logger.info("user [%s] found in LDAP" % username)
             # Return the username
             return decode_s(r[0][1][self.attribute][0])
@@ -113,16 +138,13 @@ class LdapPasswordStore(IPasswordStore):
             logger.exception("can't validate credentials")
             return False
 
-    def _execute(self, username, function):
-        assert isinstance(username, unicode)
-
-        """Reusable method to run LDAP operation."""
-
+    def _initialize(self):
+        """Create a new connection to the LDAP server. The connection is
+        established on the first operation."""
         # try STARTLS if configured
         if self.tls:
             ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER)
 
-        # Check LDAP credential only.
         l = ldap.initialize(self.uri)
 
         # Set v2 or v3
@@ -130,26 +152,62 @@ class LdapPasswordStore(IPasswordStore):
             l.protocol_version = ldap.VERSION2
         else:
             l.protocol_version = ldap.VERSION3
-
-        try:
-            # Bind to the LDAP server
-            logger.debug("binding to ldap server {}".format(self.uri))
-            l.simple_bind_s(self.bind_dn, self.bind_password)
-
-            # Search the LDAP server
-            search_filter = "(&{}({}={}))".format(
-                self.filter, self.attribute, username)
-            logger.debug("search ldap server: {}/{}?{}?{}?{}".format(
-                self.uri, self.base_dn, self.attribute, self.scope,
-                search_filter))
+        return l
+
+    def _connect(self):
+        """Create a new connection bound with the service account. Used by
+        the pool."""
+        l = self._initialize()
+        # Bind to the LDAP server
+        logger.debug("binding to ldap server {}".format(self.uri))
+        l.simple_bind_s(self.bind_dn, self.bind_password)
+        return l
+
+    def _search(self, username):
+        """Search the given user using a pooled connection. The results are
+        kept in cache for LdapCacheTTL seconds."""
+        now = time.time()
+        with self._cache_lock:
+            expire, r = self._cache.pop(username, (0, None))
+            if expire > now:
+                # Mark as recently used.
+                self._cache[username] = (expire, r)
+                return r
+
+        search_filter = "(&{}({}={}))".format(
+            self.filter, self.attribute, username)
+        logger.debug("search ldap server: {}/{}?{}?{}?{}".format(
+            self.uri, self.base_dn, self.attribute, self.scope,
+            search_filter))
+        with self._pool.connection() as l:
             r = l.search_s(encode_s(self.base_dn),
                            self.scope,
                            encode_s(search_filter))
+        # Don't keep unknown users, any username may be submitted to login.
+        if r and self._cache_ttl > 0 and self._cache_size > 0:
+            with self._cache_lock:
+                # Remove expired entries and the least recently used.
+                for key in [k for k, v in self._cache.iteritems()
+                            if v[0] <= now]:
+                    del self._cache[key]
+                while len(self._cache) >= self._cache_size:
+                    self._cache.popitem(last=False)
+                self._cache[username] = (now + self._cache_ttl, r)
+        return r
+
+    def _execute(self, username, function):
+        assert isinstance(username, unicode)
+
+        """Reusable method to run LDAP operation. `function` is called with
+        the search results."""
+
+        try:
+            # Search the LDAP server
+            r = self._search(username)
 
             # Execute operation
-            return function(l, r)
+            return function(r)
         except ldap.LDAPError as e:
-            l.unbind_s()
             logger.warn('ldap error', exc_info=1)
             if isinstance(e.message, dict) and 'desc' in e.message:
                 raise RdiffError(decode_s(e.message['desc']))
@@ -158,7 +216,7 @@ class LdapPasswordStore(IPasswordStore):
     def has_password(self, username):
         """Check if the user exists in LDAP"""
 
-        def check_user_exists(l, r):  # @UnusedVariable
+        def check_user_exists(r):
             # Check the results
             if len(r) != 1:
                 logger.debug("user [%s] not found" % username)
@@ -190,7 +248,7 @@ class LdapPasswordStore(IPasswordStore):
         """Get user attributes."""
         assert isinstance(username, unicode)
 
-        def fetch_user_email(l, r):  # @UnusedVariable
+        def fetch_user_email(r):
             if len(r) != 1:
                 logger.warn("user [%s] not found" % username)
                 return ""
@@ -235,22 +293,35 @@ class LdapPasswordStore(IPasswordStore):
 
     def _set_password_in_ldap(self, username, old_password, password):
 
-        def change_passwd(l, r):
+        def change_passwd(r):
             if len(r) != 1:
                 raise ValueError(_("user %s not found)" % (username,)))
-            # Bind using the user credentials. Throws an exception in case of
-            # error.
-            if old_password is not None:
-                l.simple_bind_s(r[0][0], encode_s(old_password))
-            l.passwd_s(r[0][0], encode_s(old_password), encode_s(password))
-            l.unbind_s()
+            if old_password is None:
+                # Password reset by an administrator, use the service
+                # account.
+                with self._pool.connection() as l:
+                    l.passwd_s(r[0][0], None, encode_s(password))
+            else:
+                # Bind using the user credentials. Throws an exception in
+                # case of error.
+                l = self._initialize()
+                try:
+                    l.simple_bind_s(r[0][0], encode_s(old_password))
+                    l.passwd_s(r[0][0], encode_s(old_password),
+                               encode_s(password))
+                finally:
+                    l.unbind_s()
             logger.info("password for user [%s] is updated in LDAP" % username)
             # User updated, return False
             return False
 
         # Execute the LDAP operation
         logger.debug("updating password for [%s] in LDAP" % username)
-        return self._execute(username, change_passwd)
+        try:
+            return self._execute(username, change_passwd)
+        finally:
+            with self._cache_lock:
+                self._cache.pop(username, None)
 
     def supports(self, operation):
         if operation == 'set_password':
@@ -126,6 +126,27 @@ class UserManagerLdapTest(unittest.TestCase):
     def test_has_password_with_invalid_user(self):
         self.assertFalse(self.ldapstore.has_password('invalid'))
 
+    def test_search_cached(self):
+        self.assertTrue(self.ldapstore.has_password('bob'))
+        self.assertEquals(['bob'], self.ldapstore.get_user_attr('bob', 'uid'))
+        self.assertEquals('bob', self.ldapstore.are_valid_credentials('bob', 'password'))
+        # Only the first search and the user bind reach the server.
+        methods = self.ldapobj.methods_called()
+        self.assertEquals(1, methods.count('search_s'))
+        self.assertEquals(2, methods.count('simple_bind_s'))
+
+    def test_search_cached_without_unknown_user(self):
+        self.assertFalse(self.ldapstore.has_password('invalid'))
+        self.assertFalse(self.ldapstore.has_password('invalid'))
+        self.assertEquals(2, self.ldapobj.methods_called().count('search_s'))
+        self.assertNotIn('invalid', self.ldapstore._cache)
+
+    def test_search_cached_with_max_size(self):
+        self.ldapstore._cache_size = 2
+        for username in ['bob', 'jeff', 'john']:
+            self.assertTrue(self.ldapstore.has_password(username))
+        self.assertEquals(['jeff', 'john'], list(self.ldapstore._cache))
+
     def test_set_password_not_found(self):
         with self.assertRaises(ValueError):
             self.assertTrue(self.ldapstore.set_password('joe', 'password'))
@@ -133,6 +154,18 @@ class UserManagerLdapTest(unittest.TestCase):
     def test_set_password_update(self):
         self.assertFalse(self.ldapstore.set_password('annik', 'new_password'))
 
+    def test_set_password_update_with_service_account(self):
+        self.assertFalse(self.ldapstore.set_password('annik', 'new_password'))
+        # The password is reset using the connection bound with the service
+        # account.
+        calls = [(name, args)
+                 for name, args, unused in self.ldapobj.methods_called(with_args=True)
+                 if name in ['simple_bind_s', 'passwd_s']]
+        self.assertEquals(
+            [('simple_bind_s', ('', '')),
+             ('passwd_s', (b'uid=annik,ou=People,dc=nodomain', None, b'new_password'))],
+            calls)
+
     def test_set_password_with_old_password(self):
         self.assertFalse(self.ldapstore.set_password('john', 'new_password', old_password='password'))
 
@@ -19,11 +19,15 @@
 from __future__ import unicode_literals
 
 import cherrypy
+import librdiff
 import logging
 import os
 import pkg_resources
 import rdw_config
+import tempfile
 import rdw_plugin
+import rdw_restore
+import rdw_status
 import rdw_templating
 
 from user import UserManager
@@ -34,7 +38,7 @@ from page_locations import LocationsPage
 from page_login import LoginPage
 from page_logout import LogoutPage
 from page_prefs import PreferencesPage
-from page_restore import RestorePage
+from page_restore import RestorePage, RestoreJobPage
 from page_settings import SettingsPage
 from page_status import StatusPage
 from cherrypy import Application, tools
@@ -51,6 +55,7 @@ class Root(LocationsPage):
         self.logout = LogoutPage(app)
         self.browse = BrowsePage(app)
         self.restore = RestorePage(app)
+        self.jobs = RestoreJobPage(app)
         self.history = HistoryPage(app)
         self.status = StatusPage(app)
         self.admin = AdminPage(app)
@@ -69,6 +74,23 @@ class RdiffwebApp(Application):
         # Initialise the template enginge.
         self.templates = rdw_templating.TemplateManager()
 
+        # Initialise the repositories cache.
+        self.repo_cache = librdiff.RdiffRepoCache(
+            self.cfg.get_config_int("RepoCacheSize", "100"),
+            self.cfg.get_config_str("IndexDir") or None)
+
+        # Initialise the restore cache and queue.
+        self.restore_cache = rdw_restore.RestoreCache(
+            self.cfg.get_config_str("RestoreCacheDir") or
+            os.path.join(tempfile.gettempdir(), b"rdiffweb-cache"),
+            self.cfg.get_config_int("RestoreCacheSize", "1024") * 1024 * 1024)
+        self.restore_queue = rdw_restore.RestoreQueue(
+            self.cfg.get_config_int("RestoreWorkers", "0"),
+            self.cfg.get_config_int("RestoreMaxJobsPerUser", "2"),
+            self.cfg.get_config_int("RestoreMinFreeSpace", "0") * 1024 * 1024,
+            self.cfg.get_config_int("RestoreJobExpiry", "3600"),
+            self.restore_cache)
+
         # Initialise the plugins
         self.plugins = rdw_plugin.PluginManager(self.cfg)
 
@@ -109,6 +131,10 @@ class RdiffwebApp(Application):
         # create user manager
         self.userdb = UserManager(self)
 
+        # Initialise the backup status collector.
+        self.status_collector = rdw_status.StatusCollector(
+            self, self.cfg.get_config_int("StatusCollectorInterval", "60"))
+
     def activate_plugin(self, plugin_obj):
         """Activate the given plugin object."""
         plugin_obj.app = self
@@ -117,6 +143,10 @@ class RdiffwebApp(Application):
         if plugin_obj.get_templatesdir():
             self.templates.add_templatesdir(plugin_obj.get_templatesdir())
 
+    def deactivate_plugins(self):
+        """Deactivate every loaded plugin. Called when the server stop."""
+        self.plugins.run(lambda x: x.deactivate())
+
     def __get_currentuser(self):
         """
         Get the current user.
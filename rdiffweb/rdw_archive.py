@@ -0,0 +1,362 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import logging
+import os
+import struct
+import tarfile
+import threading
+import time
+import zipfile
+import zlib
+
+from collections import deque
+from itertools import chain
+from multiprocessing.pool import ThreadPool
+
+"""
+Module used to create archives on the fly. Instead of writing the archive to
+disk, the archive is generated by small chunks, so it can be sent to the user
+while being created with a bounded memory usage.
+"""
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Size of the blocks compressed independently by the compression threads.
+BLOCK_SIZE = 256 * 1024
+
+# Signature of zip data descriptor.
+ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+
+# Files larger than ZIP64_LIMIT minus this margin get a zip64 local header,
+# since the compressed data may be larger than the file or the file may grow
+# while being read.
+ZIP64_MARGIN = 1024 * 1024
+
+# Extensions of files already compressed. Those files are stored in zip
+# archives without compression when requested.
+STORE_EXTENSIONS = [
+    b".7z", b".avi", b".bz2", b".docx", b".gif", b".gz", b".jpeg", b".jpg",
+    b".mkv", b".mov", b".mp3", b".mp4", b".odt", b".ods", b".ogg", b".png",
+    b".rar", b".tgz", b".xlsx", b".xz", b".zip"]
+
+
+class _Buffer(object):
+    """
+    Write-only file-like object used to collect the archive data until it
+    get sent.
+    """
+
+    def __init__(self):
+        self._data = []
+        self._pos = 0
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        """Return the data written since the last call."""
+        data = b"".join(self._data)
+        self._data = []
+        return data
+
+    def tell(self):
+        return self._pos
+
+    def write(self, data):
+        self._data.append(data)
+        self._pos += len(data)
+
+
+def _stream(buf, steps):
+    """
+    Yield the data written into `buf` each time the `steps` generator
+    yield.
+    """
+    for unused in steps:
+        data = buf.pop()
+        if data:
+            yield data
+    data = buf.pop()
+    if data:
+        yield data
+
+
+def _deflate(data, level, final):
+    """Compress a block of data into a raw deflate stream. Blocks compressed
+    separately may be concatenated as long as only the last one is final."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(data)
+    return data + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+# Pools of compression threads shared by every archives, by size.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(threads):
+    """Return the pool of `threads` threads shared by every archives, so
+    concurrent downloads don't multiply the number of threads."""
+    with _pools_lock:
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPool(threads)
+        return pool
+
+
+class _Compressor(object):
+    """
+    Compress blocks of data using a pool of threads in the same way as pigz.
+    zlib release the GIL while compressing, so threads use multiple cores.
+    """
+
+    def __init__(self, level, threads):
+        self.level = level
+        self._pool = _get_pool(threads) if threads > 1 else None
+        # Limit the number of blocks kept in memory.
+        self._max_pending = threads * 2
+
+    def close(self):
+        # The pool is shared, blocks already submitted simply get discarded.
+        self._pool = None
+
+    def compress(self, blocks):
+        """Compress the given iterable of (data, final). Yield the
+        compressed data in order."""
+        if not self._pool:
+            for data, final in blocks:
+                yield _deflate(data, self.level, final)
+            return
+        pending = deque()
+        for data, final in blocks:
+            pending.append(self._pool.apply_async(
+                _deflate, (data, self.level, final)))
+            while len(pending) >= self._max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+class _Checksum(object):
+    """Compute the CRC32 and size of the data being compressed."""
+
+    def __init__(self):
+        self.crc = 0
+        self.size = 0
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc) & 0xffffffff
+        self.size += len(data)
+        return data
+
+
+def _walk(dirpath, encoding, include_dirs):
+    """
+    Iterate over the content of the given directory. Yield tuples of
+    (filename, arcname).
+    """
+    dirpath = os.path.normpath(dirpath)
+    for root, dirs, files in os.walk(dirpath, topdown=True):
+        for name in chain(dirs if include_dirs else [], files):
+            filename = os.path.join(root, name)
+            assert filename.startswith(dirpath)
+            arcname = filename[len(dirpath) + 1:].decode(encoding, 'replace')
+            yield filename, arcname
+
+
+def archive_tar(dirpath, encoding='utf-8',
+                level=zlib.Z_DEFAULT_COMPRESSION, threads=1, store=False):
+    """
+    Generate a tar.gz archive of the given directory. Return a generator
+    of bytes.
+
+    The tar stream is split in blocks compressed by `threads` threads with
+    the given compression `level`. The result is a single gzip member.
+    `store` is ignored since the tar stream is compressed as a whole.
+    """
+    assert isinstance(dirpath, str)
+    assert os.path.isdir(dirpath)
+    buf = _Buffer()
+    return _stream(buf, _write_targz(buf, dirpath, encoding, level, threads))
+
+
+def _write_targz(buf, dirpath, encoding, level, threads):
+    # Write gzip header: magic, deflate, no flags, no mtime, unix.
+    buf.write(b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\x03")
+    checksum = _Checksum()
+    compressor = _Compressor(level, threads)
+    try:
+        blocks = _tar_blocks(dirpath, encoding, checksum)
+        for data in compressor.compress(blocks):
+            buf.write(data)
+            yield
+    finally:
+        compressor.close()
+    buf.write(struct.pack(b"<LL", checksum.crc, checksum.size & 0xffffffff))
+
+
+def _tar_blocks(dirpath, encoding, checksum):
+    """Generate the tar stream by blocks of BLOCK_SIZE. Yield tuples of
+    (data, final)."""
+    tarbuf = _Buffer()
+    pending = b""
+    for unused in _write_tar(tarbuf, dirpath, encoding):
+        pending += tarbuf.pop()
+        while len(pending) >= BLOCK_SIZE:
+            yield checksum.update(pending[:BLOCK_SIZE]), False
+            pending = pending[BLOCK_SIZE:]
+    pending += tarbuf.pop()
+    yield checksum.update(pending), True
+
+
+def _write_tar(buf, dirpath, encoding):
+    logger.info("creating a tar stream from [%s]",
+                dirpath.decode(encoding, 'replace'))
+    tar = tarfile.open(mode="w|", fileobj=buf, encoding=encoding)
+    for filename, arcname in _walk(dirpath, encoding, include_dirs=True):
+        tarinfo = tar.gettarinfo(filename, arcname)
+        if tarinfo is None:
+            # Unsupported file type (e.g.: socket).
+            continue
+        # Write the header.
+        tar.addfile(tarinfo)
+        if not tarinfo.isreg():
+            yield
+            continue
+        # Write the file content by chunk.
+        remaining = tarinfo.size
+        with open(filename, 'rb') as f:
+            while remaining > 0:
+                data = f.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    raise IOError("end of file reached [%s]" % arcname)
+                tar.fileobj.write(data)
+                remaining -= len(data)
+                yield
+        # Pad the content to a complete block.
+        blocks, remainder = divmod(tarinfo.size, tarfile.BLOCKSIZE)
+        if remainder > 0:
+            tar.fileobj.write(tarfile.NUL * (tarfile.BLOCKSIZE - remainder))
+            blocks += 1
+        tar.offset += blocks * tarfile.BLOCKSIZE
+        yield
+    tar.close()
+
+
+def archive_zip(dirpath, encoding='utf-8',
+                level=zlib.Z_DEFAULT_COMPRESSION, threads=1, store=False):
+    """
+    Generate a zip archive of the given directory. Return a generator of
+    bytes.
+
+    Since the size of the compressed data is not known in advance, each file
+    is followed by a data descriptor. Zip64 extensions are used for large
+    archives. Files are split in blocks compressed by `threads` threads
+    with the given compression `level`. When `store` is True, files
+    already compressed (see STORE_EXTENSIONS) are stored as-is.
+    """
+    assert isinstance(dirpath, str)
+    assert os.path.isdir(dirpath)
+    buf = _Buffer()
+    return _stream(
+        buf, _write_zip(buf, dirpath, encoding, level, threads, store))
+
+
+def _file_blocks(filename, checksum):
+    """Read the given file by blocks of BLOCK_SIZE. Yield tuples of
+    (data, final)."""
+    with open(filename, 'rb') as f:
+        data = f.read(BLOCK_SIZE)
+        while True:
+            next_data = f.read(BLOCK_SIZE)
+            yield checksum.update(data), not next_data
+            if not next_data:
+                return
+            data = next_data
+
+
+def _write_zip(buf, dirpath, encoding, level, threads, store):
+    logger.info("creating a zip stream from [%s]",
+                dirpath.decode(encoding, 'replace'))
+    # ZipFile only call write() and tell() to create the central directory.
+    zipobj = zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED, allowZip64=True)
+    compressor = _Compressor(level, threads)
+    try:
+        for filename, arcname in _walk(dirpath, encoding, include_dirs=False):
+            stored = (store and os.path.splitext(filename)[1].lower()
+                      in STORE_EXTENSIONS)
+            for unused in _write_zip_entry(buf, zipobj, compressor, filename,
+                                           arcname, stored):
+                yield
+    finally:
+        compressor.close()
+    # Write the central directory.
+    zipobj.close()
+
+
+def _write_zip_entry(buf, zipobj, compressor, filename, arcname, stored):
+    st = os.stat(filename)
+    zinfo = zipfile.ZipInfo(arcname, time.localtime(st.st_mtime)[0:6])
+    zinfo.external_attr = (st.st_mode & 0xFFFF) << 16
+    if stored:
+        zinfo.compress_type = zipfile.ZIP_STORED
+    else:
+        zinfo.compress_type = zipfile.ZIP_DEFLATED
+    # Sizes and CRC are written after the data.
+    zinfo.flag_bits |= 0x08
+    zinfo.header_offset = buf.tell()
+    zip64 = st.st_size > zipfile.ZIP64_LIMIT - ZIP64_MARGIN
+    if zip64:
+        zinfo.extract_version = max(45, zinfo.extract_version)
+        zinfo.create_version = max(45, zinfo.create_version)
+    buf.write(zinfo.FileHeader(zip64))
+
+    # Write the data by blocks.
+    checksum = _Checksum()
+    compress_size = 0
+    blocks = _file_blocks(filename, checksum)
+    if not stored:
+        blocks = compressor.compress(blocks)
+    for data in blocks:
+        if stored:
+            data = data[0]
+        compress_size += len(data)
+        buf.write(data)
+        yield
+
+    # Write the data descriptor.
+    zinfo.CRC = checksum.crc
+    zinfo.file_size = checksum.size
+    zinfo.compress_size = compress_size
+    # The real sizes decide, the central directory get zip64 fields the same
+    # way when written by zipobj.
+    if (checksum.size > zipfile.ZIP64_LIMIT or
+            compress_size > zipfile.ZIP64_LIMIT):
+        zip64 = True
+        zinfo.extract_version = max(45, zinfo.extract_version)
+        zinfo.create_version = max(45, zinfo.create_version)
+    fmt = b"<4sLQQ" if zip64 else b"<4sLLL"
+    buf.write(struct.pack(fmt, ZIP_DATA_DESCRIPTOR, checksum.crc,
+                          compress_size, checksum.size))
+    zipobj.filelist.append(zinfo)
+    zipobj.NameToInfo[zinfo.filename] = zinfo
+    yield
@@ -0,0 +1,102 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import logging
+import struct
+
+"""
+Module used to apply librsync deltas (the content of rdiff-backup `.diff`
+increments) without executing rdiff-backup.
+
+A delta start with a magic number followed by a list of commands. Each
+command either insert literal data or copy a range of the basis file.
+"""
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Size of the chunks copied at once.
+CHUNK_SIZE = 1024 * 1024
+
+# Magic number of librsync deltas.
+RS_DELTA_MAGIC = 0x72730236
+
+# Commands of a librsync delta.
+RS_OP_END = 0x00
+RS_OP_LITERAL_N1 = 0x41
+RS_OP_LITERAL_N8 = 0x44
+RS_OP_COPY_N1_N1 = 0x45
+RS_OP_COPY_N8_N8 = 0x54
+
+# Struct format by integer size.
+_FORMATS = {1: b">B", 2: b">H", 4: b">I", 8: b">Q"}
+
+
+class DeltaError(Exception):
+
+    """Raised when the delta is invalid or doesn't match the basis file."""
+    pass
+
+
+def _read_int(f, size):
+    """Read a big-endian integer of the given size."""
+    data = f.read(size)
+    if len(data) != size:
+        raise DeltaError("unexpected end of delta")
+    return struct.unpack(_FORMATS[size], data)[0]
+
+
+def _copy(src, dst, length):
+    """Copy `length` bytes from `src` to `dst`."""
+    while length > 0:
+        data = src.read(min(CHUNK_SIZE, length))
+        if not data:
+            raise DeltaError("unexpected end of file")
+        dst.write(data)
+        length -= len(data)
+
+
+def patch(basis, delta, out):
+    """
+    Apply the delta read from `delta` on the `basis` file and write the
+    result into `out`. The `basis` file must support seek().
+    """
+    if _read_int(delta, 4) != RS_DELTA_MAGIC:
+        raise DeltaError("invalid delta magic number")
+    while True:
+        op = _read_int(delta, 1)
+        if op == RS_OP_END:
+            return
+        elif op < RS_OP_LITERAL_N1:
+            # The length of the literal is the command itself.
+            _copy(delta, out, op)
+        elif op <= RS_OP_LITERAL_N8:
+            length = _read_int(delta, 1 << (op - RS_OP_LITERAL_N1))
+            _copy(delta, out, length)
+        elif op <= RS_OP_COPY_N8_N8:
+            # Size of the start position and length are encoded in the
+            # command.
+            n = op - RS_OP_COPY_N1_N1
+            start = _read_int(delta, 1 << (n // 4))
+            length = _read_int(delta, 1 << (n % 4))
+            basis.seek(start)
+            _copy(basis, out, length)
+        else:
+            raise DeltaError("unknown delta command %#x" % op)
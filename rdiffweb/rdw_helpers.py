@@ -20,7 +20,9 @@ from __future__ import unicode_literals
 
 import sys
 import calendar
+import errno
 import os
+import stat
 import time
 import urllib
 
@@ -45,6 +47,25 @@ def encode_s(value):
     return value.encode(system_charset)
 
 
+def makedirs_private(path):
+    """
+    Create the given directory only accessible by the current user. An
+    existing directory is accepted only if it's owned by the current user.
+    Raise OSError otherwise.
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise OSError(errno.EPERM, "not a directory owned by current user",
+                      path)
+    if stat.S_IMODE(st.st_mode) & 0o077:
+        os.chmod(path, 0o700)
+
+
 def quote_url(url, safe=None):
     """encode URL but try to keep encoding (unicode vs str)"""
     # If URL is None, return None
@@ -82,7 +103,7 @@ def unquote_url(encodedUrl):
     return urllib.unquote(encodedUrl)
 
 
-class rdwTime:
+class rdwTime(object):
 
     """Time information has two components: the local time, stored in GMT as
     seconds since Epoch, and the timezone, stored as a seconds offset. Since
@@ -92,6 +113,9 @@ class rdwTime:
     "local" time, but pass the timezone information on to rdiff-backup, so
     it can restore to the correct state"""
 
+    # Avoid a __dict__ per instance, many dates are created when browsing.
+    __slots__ = ('timeInSeconds', 'tzOffset')
+
     def __init__(self, seconds=0):
         assert isinstance(seconds, int)
         self.timeInSeconds = seconds
@@ -109,10 +133,18 @@ class rdwTime:
         self.tzOffset = 0
 
     def initFromString(self, timeString):
+        """Parse rdiff-backup time string (YYYY-MM-DDTHH:MM:SS+HH:MM)."""
         try:
-            date, daytime = timeString[:19].split("T")
-            year, month, day = map(int, date.split("-"))
-            hour, minute, second = map(int, daytime.split(":"))
+            # The format is fixed, read the fields by position.
+            assert (timeString[4] == "-" and timeString[7] == "-" and
+                    timeString[10] == "T" and timeString[13] == ":" and
+                    timeString[16] == ":")
+            year = int(timeString[0:4])
+            month = int(timeString[5:7])
+            day = int(timeString[8:10])
+            hour = int(timeString[11:13])
+            minute = int(timeString[14:16])
+            second = int(timeString[17:19])
             assert 1900 < year < 2100, year
             assert 1 <= month <= 12
             assert 1 <= day <= 31
@@ -123,9 +155,9 @@ class rdwTime:
             timetuple = (year, month, day, hour, minute, second, -1, -1, 0)
             self.timeInSeconds = calendar.timegm(timetuple)
             self.tzOffset = self._tzdtoseconds(timeString[19:])
-            self.getTimeZoneString()  # to get assertions there
+            assert abs(self.tzOffset) < 24 * 60 * 60
 
-        except (TypeError, ValueError, AssertionError):
+        except (TypeError, ValueError, AssertionError, IndexError):
             raise ValueError(timeString)
 
     def getLocalDaysSinceEpoch(self):
@@ -182,16 +214,44 @@ class rdwTime:
 
         return plusMinus * 60 * (60 * int(tzd[1:3]) + int(tzd[4:]))
 
+    # Comparisons are called a lot when sorting and searching dates, compute
+    # the seconds inline instead of calling getSeconds().
+
     def __cmp__(self, other):
         assert isinstance(other, rdwTime)
-        return cmp(self.getSeconds(), other.getSeconds())
+        return cmp(self.timeInSeconds - self.tzOffset,
+                   other.timeInSeconds - other.tzOffset)
 
     def __eq__(self, other):
         return (isinstance(other, rdwTime) and
-                self.getSeconds() == other.getSeconds())
+                self.timeInSeconds - self.tzOffset ==
+                other.timeInSeconds - other.tzOffset)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __lt__(self, other):
+        assert isinstance(other, rdwTime)
+        return (self.timeInSeconds - self.tzOffset <
+                other.timeInSeconds - other.tzOffset)
+
+    def __le__(self, other):
+        assert isinstance(other, rdwTime)
+        return (self.timeInSeconds - self.tzOffset <=
+                other.timeInSeconds - other.tzOffset)
+
+    def __gt__(self, other):
+        assert isinstance(other, rdwTime)
+        return (self.timeInSeconds - self.tzOffset >
+                other.timeInSeconds - other.tzOffset)
+
+    def __ge__(self, other):
+        assert isinstance(other, rdwTime)
+        return (self.timeInSeconds - self.tzOffset >=
+                other.timeInSeconds - other.tzOffset)
 
     def __hash__(self):
-        return hash(self.getSeconds())
+        return hash(self.timeInSeconds - self.tzOffset)
 
     def __str__(self):
         """return utf-8 string"""
@@ -204,6 +264,31 @@ class rdwTime:
         """return second since epoch"""
         return str(self.getSeconds())
 
+
+# Maximum number of time strings kept by parse_time().
+TIME_CACHE_SIZE = 10000
+
+# Parsed time strings {string: rdwTime}.
+_time_cache = {}
+
+
+def parse_time(value):
+    """
+    Return the rdwTime of the given rdiff-backup time string. Raise
+    ValueError if the value is not valid.
+
+    The same timestamps are found in many increment names, so the parsed
+    values are kept and shared. The returned object must not be modified.
+    """
+    t = _time_cache.get(value)
+    if t is None:
+        t = rdwTime()
+        t.initFromString(value)
+        if len(_time_cache) >= TIME_CACHE_SIZE:
+            _time_cache.clear()
+        _time_cache[value] = t
+    return t
+
 # Taken from ASPN:
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/259173
 
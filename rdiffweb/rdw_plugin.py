@@ -264,6 +264,67 @@ class IDatabase(IRdiffwebPlugin):
     def is_admin(self, user):
         """Return True if the user is Admin."""
 
+    def add_backup_summaries(self, user, repoPath, summaries):
+        """
+        Record the summaries of the backups of the given repository. Each
+        summary is a dict with keys: date, source_size, increment_size,
+        error_count and errors (first lines of the error log).
+        """
+
+    def get_backup_summaries(self, user, earliest_date=None,
+                             latest_date=None):
+        """
+        Return the recorded backup summaries of the user repositories between
+        the given dates (inclusive) from new to old. Each summary contains
+        the key `repo_path`.
+        """
+
+    def get_last_backup_dates(self, user):
+        """
+        Return the date of the last recorded backup summary of each
+        repository as a dict {repoPath: date}.
+        """
+
+    def _match_users(self, admin_only, search):
+        """Return the records of every users matching the criteria."""
+        records = [{"username": user,
+                    "email": self.get_email(user),
+                    "is_admin": self.is_admin(user),
+                    "user_root": self.get_user_root(user)}
+                   for user in self.list()]
+        if admin_only:
+            records = [x for x in records if x["is_admin"]]
+        if search:
+            search = search.lower()
+            records = [x for x in records
+                       if search in x["username"].lower() or
+                       search in (x["email"] or "").lower()]
+        return records
+
+    def count_users(self, admin_only=False, search=None):
+        """
+        Return the number of users matching the given criteria. See
+        `get_users()`.
+        """
+        return len(self._match_users(admin_only, search))
+
+    def get_users(self, admin_only=False, search=None, offset=0, limit=None):
+        """
+        Return the users sorted by username as a list of dict with keys:
+        username, email, is_admin and user_root. If `admin_only` is True,
+        only administrators are returned. If `search` is defined, only users
+        with a username or email containing the search (case insensitive)
+        are returned.
+
+        Default implementation query every users one by one. Database should
+        provide a more efficient implementation.
+        """
+        records = sorted(self._match_users(admin_only, search),
+                         key=lambda x: x["username"])
+        if limit is None:
+            return records[offset:]
+        return records[offset:offset + limit]
+
 
 class IDeamonPlugin(IRdiffwebPlugin):
     """
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+from collections import deque
+from contextlib import contextmanager
+
+"""
+Module providing a generic pool of connections used by the plugins to reuse
+the connections to external servers (database, directory) between requests.
+"""
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Connections idle for more than this delay (in seconds) are pinged before
+# being used.
+PING_DELAY = 10
+
+
+class ConnectionPool(object):
+
+    """Bounded pool of connections. A thread checks out a single
+    connection at a time and gives it back once done. Connections idle for
+    too long are closed."""
+
+    def __init__(self, connect, max_size=5, idle_timeout=300,
+                 ping=lambda c: c.ping(), close=lambda c: c.close()):
+        assert max_size > 0
+        # Functions called to create, check and close a connection.
+        self._connect = connect
+        self._ping = ping
+        self._close_func = close
+        self.idle_timeout = idle_timeout
+        # Idle connections: (connection, last used) from old to recent.
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(max_size)
+        self._local = threading.local()
+
+    def close(self):
+        """Close the idle connections."""
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, unused in idle:
+            self._close(conn)
+
+    def _close(self, conn):
+        try:
+            self._close_func(conn)
+        except Exception:
+            logger.debug("fail to close connection", exc_info=1)
+
+    def _checkout(self):
+        """Return an healthy connection. Block if every connections are in
+        use."""
+        self._semaphore.acquire()
+        try:
+            now = time.time()
+            while True:
+                with self._lock:
+                    # Evict connections idle for too long.
+                    expired = []
+                    while (self._idle and
+                           self._idle[0][1] + self.idle_timeout < now):
+                        expired.append(self._idle.popleft()[0])
+                    conn, last_used = self._idle.pop() if self._idle else (None, None)
+                for c in expired:
+                    self._close(c)
+                if conn is None:
+                    return self._connect()
+                if last_used + PING_DELAY > now:
+                    return conn
+                try:
+                    self._ping(conn)
+                    return conn
+                except Exception:
+                    logger.debug("discard broken connection", exc_info=1)
+                    self._close(conn)
+        except:
+            self._semaphore.release()
+            raise
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._idle.append((conn, time.time()))
+        self._semaphore.release()
+
+    @contextmanager
+    def connection(self):
+        """Check out a connection for the current thread. The connection is
+        discarded if an exception is raised."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            # Already checked out by this thread.
+            yield conn
+            return
+        conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        except:
+            self._local.conn = None
+            self._close(conn)
+            self._semaphore.release()
+            raise
+        self._local.conn = None
+        self._checkin(conn)
@@ -0,0 +1,354 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import os
+import Queue
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from rdiffweb.core import RdiffError
+from rdiffweb.i18n import ugettext as _
+from rdiffweb.librdiff import FileError
+from rdiffweb.rdw_helpers import decode_s, makedirs_private
+
+"""
+Module used to execute the restores in background. Restore jobs are queued
+and executed by a limited number of worker threads. Web threads only submit
+the job and poll its status until the restored file can be downloaded.
+"""
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+
+class RestoreJob(object):
+
+    """Represent one restore submitted by a user."""
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, username, name, func, cache=None, key=None):
+        assert isinstance(name, str)
+        self.id = uuid.uuid4().hex
+        self.username = username
+        # Name of the restored item. Used for display.
+        self.name = name
+        # Function called with a directory to restore the data.
+        self._func = func
+        # Cache where to keep the restored file.
+        self._cache = cache
+        self._key = key
+        self.status = RestoreJob.QUEUED
+        self.error = None
+        self.output = None
+        self.tempdir = None
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def is_active(self):
+        return self.status in [RestoreJob.QUEUED, RestoreJob.RUNNING]
+
+    @property
+    def filename(self):
+        """Return the filename to be downloaded."""
+        if not self.output:
+            return None
+        return os.path.basename(self.output)
+
+    @property
+    def progress(self):
+        """Return the number of bytes restored so far."""
+        if self.output:
+            return self._output_size
+        if not self.tempdir:
+            return 0
+        size = 0
+        for root, unused, files in os.walk(self.tempdir):
+            for name in files:
+                try:
+                    size += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    # File deleted while walking.
+                    pass
+        return size
+
+    def delete(self):
+        """Delete the restored data."""
+        if self.tempdir:
+            shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def run(self):
+        """Execute the restore."""
+        self.status = RestoreJob.RUNNING
+        self.tempdir = tempfile.mkdtemp()
+        try:
+            output = self._func(self.tempdir)
+            self._output_size = os.path.getsize(output)
+            if self._cache and self._key:
+                output = self._cache.put(self._key, output)
+            self.output = output
+            self.status = RestoreJob.DONE
+        except (Exception, FileError):
+            # FileError is not a subclass of Exception.
+            logger.exception("fail to restore [%s]",
+                             self.name.decode('utf-8', 'replace'))
+            e = sys.exc_info()[1]
+            self.error = unicode(e) if isinstance(e, FileError) else None
+            self.status = RestoreJob.FAILED
+            self.delete()
+        finally:
+            self.finished = time.time()
+
+
+class RestoreQueue(object):
+
+    """Queue of restore jobs executed by a pool of worker threads. Workers are
+    started on the first submitted job."""
+
+    def __init__(self, max_workers=0, max_user_jobs=2, min_free_space=0,
+                 expiry=3600, cache=None):
+        assert isinstance(max_workers, int)
+        assert isinstance(max_user_jobs, int)
+        self.max_workers = max_workers
+        # Maximum number of queued or running jobs per user (0: unlimited).
+        self.max_user_jobs = max_user_jobs
+        # Minimum free space (in bytes) required in TempDir to submit a job.
+        self.min_free_space = min_free_space
+        # Delay (in seconds) to keep the restored data once completed.
+        self.expiry = expiry
+        # Cache used to keep the restored files.
+        self.cache = cache
+        self._jobs = {}
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        """True if restores should be executed in background."""
+        return self.max_workers > 0
+
+    def _free_space(self):
+        """Return the free space available in TempDir."""
+        st = os.statvfs(tempfile.gettempdir())
+        return st.f_bavail * st.f_frsize
+
+    def get_job(self, username, job_id):
+        """Return the job matching the given identifier. Raise KeyError if
+        the job doesn't exists or belong to another user."""
+        self._expire()
+        with self._lock:
+            job = self._jobs[job_id]
+        if job.username != username:
+            raise KeyError(job_id)
+        return job
+
+    def _expire(self):
+        """Delete the completed jobs older than the expiry delay."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job for job in self._jobs.values()
+                if job.finished and job.finished + self.expiry < now]
+            for job in expired:
+                del self._jobs[job.id]
+        for job in expired:
+            logger.debug("delete expired restore job [%s]", job.id)
+            job.delete()
+
+    def _run(self):
+        """Loop executed by the worker threads."""
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            logger.info("running restore job [%s]", job.id)
+            job.run()
+
+    def stop(self):
+        """Stop the worker threads and delete the restored data."""
+        with self._lock:
+            for unused in self._workers:
+                self._queue.put(None)
+            self._workers = []
+            jobs = self._jobs.values()
+            self._jobs = {}
+        for job in jobs:
+            job.delete()
+
+    def submit(self, username, name, func, key=None):
+        """Queue a new restore job. `func` is called by a worker with a
+        temporary directory where to restore the data and must return the
+        restored location. When `key` is defined, the restored file is kept
+        in cache. Raise RdiffError if the job is refused."""
+        self._expire()
+        if (self.min_free_space and
+                self._free_space() < self.min_free_space):
+            raise RdiffError(_("Not enough disk space to restore. Try again later."))
+        job = RestoreJob(username, name, func, self.cache, key)
+        with self._lock:
+            active = [
+                x for x in self._jobs.values()
+                if x.username == username and x.is_active]
+            if self.max_user_jobs and len(active) >= self.max_user_jobs:
+                raise RdiffError(_("Too many restores in progress. Wait for them to complete."))
+            self._jobs[job.id] = job
+            # Start the worker threads.
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._run,
+                                          name="RestoreWorker")
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        logger.info("queue restore job [%s] for [%s]", job.id, username)
+        self._queue.put(job)
+        return job
+
+
+class RestoreCache(object):
+
+    """Size-bounded cache of restored files. Files are stored on disk in
+    `cachedir` and the least recently used are deleted when the cache size
+    exceed `max_size` bytes."""
+
+    def __init__(self, cachedir, max_size):
+        assert isinstance(cachedir, str)
+        assert isinstance(max_size, (int, long))
+        self.cachedir = cachedir
+        self.max_size = max_size
+        self._size = 0
+        # Cached files (key: (location, size)) from old to recently used.
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        if self.enabled:
+            try:
+                self._load()
+            except OSError:
+                logger.error("restore cache disabled, can't use [%s]",
+                             decode_s(cachedir, 'replace'), exc_info=1)
+                self.max_size = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    @staticmethod
+    def make_key(*args):
+        """Compute a cache key from the given values."""
+        values = [x.encode('utf-8') if isinstance(x, unicode) else str(x)
+                  for x in args]
+        return hashlib.sha1(b"\0".join(values)).hexdigest()
+
+    def _load(self):
+        """Load the files already in cache. The modification time is used
+        to keep track of recently used files. Only the entries owned by the
+        current user are loaded, others are deleted."""
+        makedirs_private(self.cachedir)
+        uid = os.getuid()
+        entries = []
+        for key in os.listdir(self.cachedir):
+            dirpath = os.path.join(self.cachedir, key)
+            st = os.lstat(dirpath)
+            names = (os.listdir(dirpath)
+                     if stat.S_ISDIR(st.st_mode) and st.st_uid == uid else [])
+            if len(names) == 1:
+                location = os.path.join(dirpath, names[0])
+                st = os.lstat(location)
+                if stat.S_ISREG(st.st_mode) and st.st_uid == uid:
+                    entries.append((st.st_mtime, key, location, st.st_size))
+                    continue
+            # Incomplete or invalid entry.
+            logger.warn("delete invalid entry [%s] from restore cache", key)
+            self._delete(dirpath)
+        for unused, key, location, size in sorted(entries):
+            self._entries[key] = (location, size)
+            self._size += size
+        self._evict()
+
+    def _delete(self, path):
+        """Delete the given entry of the cache."""
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                logger.warn("fail to delete [%s]", decode_s(path, 'replace'))
+
+    def _evict(self):
+        """Delete the least recently used files until the cache fit in the
+        maximum size."""
+        while self._size > self.max_size and self._entries:
+            key, (location, size) = self._entries.popitem(last=False)
+            logger.debug("evict [%s] from restore cache", key)
+            shutil.rmtree(os.path.dirname(location), ignore_errors=True)
+            self._size -= size
+
+    def get(self, key):
+        """Return the location of the cached file or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if not value:
+                return None
+            if not os.path.isfile(value[0]):
+                self._size -= value[1]
+                return None
+            # Mark the file as recently used.
+            self._entries[key] = value
+            os.utime(value[0], None)
+        return value[0]
+
+    def put(self, key, filename):
+        """Move the given file into the cache. Return the new location of
+        the file. The file is not moved if it's larger than the cache."""
+        size = os.path.getsize(filename)
+        if not self.enabled or size > self.max_size:
+            return filename
+        with self._lock:
+            dirpath = os.path.join(self.cachedir, key)
+            location = os.path.join(dirpath, os.path.basename(filename))
+            value = self._entries.pop(key, None)
+            if value:
+                self._size -= value[1]
+            if os.path.lexists(dirpath):
+                # Replace the previous file.
+                self._delete(dirpath)
+            os.mkdir(dirpath, 0o700)
+            shutil.move(filename, location)
+            os.chmod(location, 0o600)
+            self._entries[key] = (location, size)
+            self._size += size
+            self._evict()
+        logger.debug("add [%s] to restore cache", key)
+        return location
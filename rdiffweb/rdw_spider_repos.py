@@ -18,29 +18,87 @@
 
 from __future__ import unicode_literals
 
+import abc
+import ctypes
+import ctypes.util
+import errno
 import os
 import librdiff
 import logging
+import select
+import stat
+import struct
 import threading
+import time
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
 from rdiffweb.rdw_helpers import encode_s
 
+try:
+    from os import scandir  # @UnresolvedImport
+except ImportError:
+    try:
+        from scandir import scandir  # @UnresolvedImport @Reimport
+    except ImportError:
+        scandir = None
+
 # Define the logger
 logger = logging.getLogger(__name__)
 
+# Default depth of the repositories search.
+DEFAULT_DEPTH = 3
+
+# Default number of threads used to search the repositories.
+DEFAULT_THREADS = 4
+
+# Duration (in seconds) of a search considered slow.
+SLOW_SEARCH = 10
+
+# Statistics of the last search of a user.
+SearchStats = namedtuple('SearchStats', ['duration', 'repos', 'dirs', 'date'])
+
+# Statistics of the last search of every user.
+_search_stats = {}
+
 
 # Returns pid of started process, or 0 if no process was started
 def start_repo_spider_thread(killEvent, app):
     # Get refresh interval from app config.
-    spiderInterval = app.cfg.get_config_bool("autoUpdateRepos", "False")
+    value = app.cfg.get_config("autoUpdateRepos", "0")
+    if value.isdigit():
+        spiderInterval = int(value)
+    else:
+        spiderInterval = app.cfg.get_config_bool("autoUpdateRepos", "False")
+    method = app.cfg.get_config_str("autoUpdateReposMethod", "inotify")
 
     # Start the thread.
-    newThread = SpiderReposThread(killEvent, app, spiderInterval)
+    newThread = SpiderReposThread(killEvent, app, spiderInterval, method,
+                                  get_search_depth(app.cfg),
+                                  get_search_threads(app.cfg))
     newThread.start()
 
 
+def get_search_depth(cfg):
+    """Return the depth of the repositories search."""
+    return cfg.get_config_int("RepoSearchDepth", str(DEFAULT_DEPTH))
+
+
+def get_search_threads(cfg):
+    """Return the number of threads used to search the repositories."""
+    return cfg.get_config_int("RepoSearchThreads", str(DEFAULT_THREADS))
+
+
+def get_search_stats():
+    """Return the statistics of the last search of every user as a
+    dictionary of SearchStats."""
+    return dict(_search_stats)
+
+
 class SpiderReposThread(threading.Thread):
 
-    def __init__(self, killEvent, app, spiderInterval=False):
+    def __init__(self, killEvent, app, spiderInterval=False,
+                 method="inotify", depth=DEFAULT_DEPTH,
+                 threads=DEFAULT_THREADS):
         """Create a new SpiderRepo to refresh the users repositories."""
         self.killEvent = killEvent
         self.app = app
@@ -48,50 +106,464 @@ class SpiderReposThread(threading.Thread):
         if spiderInterval:
             assert isinstance(spiderInterval, int)
         self.spiderInterval = spiderInterval
+        self.method = method
+        self.depth = depth
+        self.threads = threads
         threading.Thread.__init__(self)
 
+    def _create_watcher(self):
+        """Create the watcher used to detect changes. Fall back to polling if
+        inotify is not available."""
+        if self.method == "inotify":
+            try:
+                return InotifyWatcher(self.app, self.depth, self.threads)
+            except (OSError, AttributeError):
+                logger.warn("inotify is not available, fall back to polling",
+                            exc_info=1)
+        return PollWatcher(self.app, self.depth, self.threads)
+
     def run(self):
-        if self.spiderInterval:
-            while True:
-                find_repos_for_all_users(self.app)
-                self.killEvent.wait(60 * self.spiderInterval)
-                if self.killEvent.isSet():
-                    return
+        if not self.spiderInterval:
+            return
+        if not self.app.userdb.supports('set_repos'):
+            return
+        watcher = self._create_watcher()
+        try:
+            self._run(watcher)
+        finally:
+            watcher.close()
 
+    def _run(self, watcher):
+        interval = 60 * self.spiderInterval
+        # Search every user repositories once.
+        watcher.refresh_users()
+        next_refresh = time.time() + interval
+        while not self.killEvent.isSet():
+            dirty = watcher.wait(
+                self.killEvent, max(0, next_refresh - time.time()))
+            if dirty is None:
+                # Some events were lost.
+                logger.warn("watcher overflow, searching all repositories")
+                watcher.refresh_users(force=True)
+            elif dirty:
+                watcher.update_users(dirty)
+            # Periodically check for new or deleted users.
+            if time.time() >= next_refresh:
+                watcher.refresh_users()
+                next_refresh = time.time() + interval
 
-def _find_repos(dirToSearch, depth=3):
-    # TODO Should be a configuration
-    # Limit the depthness
-    if depth <= 0:
-        return
 
+class RepoWatcher(object):
+
+    """Base class of the watchers. Keep track of the directories searched
+    for repositories of every user. Subclasses must watch those directories
+    and report which users need to be updated."""
+
+    __metaclass__ = abc.ABCMeta
+
+    def __init__(self, app, depth=DEFAULT_DEPTH, threads=DEFAULT_THREADS):
+        self.app = app
+        self.depth = depth
+        self.threads = threads
+        # The user root of every watched user.
+        self._roots = {}
+
+    def close(self):
+        for user in self._roots.keys():
+            self._unwatch_user(user)
+
+    def refresh_users(self, force=False):
+        """Search the repositories of new users or users with a different
+        root directory. If `force` is True, search every users."""
+        userdb = self.app.userdb
+        users = userdb.list()
+        for user in set(self._roots) - set(users):
+            self._unwatch_user(user)
+            del self._roots[user]
+        self.update_users([
+            user for user in users
+            if force or self._roots.get(user) !=
+            encode_s(userdb.get_user_root(user) or "")])
+
+    def update_user(self, user):
+        """Search the repositories of the given user and watch his
+        directories."""
+        self.update_users([user])
+
+    def update_users(self, users):
+        """Search the repositories of the given users and watch their
+        directories. The content of the repositories is not watched."""
+        userdb = self.app.userdb
+        for user in users:
+            self._unwatch_user(user)
+            self._roots[user] = encode_s(userdb.get_user_root(user) or "")
+        try:
+            searched = find_repos_for_users(users, userdb, self.depth,
+                                            self.threads)
+        except:
+            logger.warn("fail to search repositories", exc_info=1)
+            return
+        for user, (dirs, repos) in searched.items():
+            for dirpath in dirs:
+                self._watch(user, dirpath, dirpath in repos)
+
+    @abc.abstractmethod
+    def wait(self, event, timeout):
+        """Wait for changes. Return the users to be updated or None if all
+        users must be updated. Return early if `event` is set."""
+
+    @abc.abstractmethod
+    def _watch(self, user, dirpath, is_repo=False):
+        """Watch the given directory of the user. For a repository, only the
+        creation or deletion of rdiff-backup-data is relevant."""
+
+    @abc.abstractmethod
+    def _unwatch_user(self, user):
+        """Stop watching the directories of the user."""
+
+
+class PollWatcher(RepoWatcher):
+
+    """Watcher comparing the modification time of the directories at every
+    interval. A directory modification time change when an entry is created
+    or removed. It's cheaper than listing every directory. Repositories are
+    only checked for the existence of rdiff-backup-data, since their
+    modification time change during a backup."""
+
+    def __init__(self, app, depth=DEFAULT_DEPTH, threads=DEFAULT_THREADS):
+        RepoWatcher.__init__(self, app, depth, threads)
+        self._mtimes = {}
+
+    def _state(self, dirpath, is_repo):
+        if is_repo:
+            return os.path.isdir(
+                os.path.join(dirpath, librdiff.RDIFF_BACKUP_DATA))
+        try:
+            return os.stat(dirpath).st_mtime
+        except OSError:
+            return None
+
+    def wait(self, event, timeout):
+        event.wait(timeout)
+        if event.isSet():
+            return set()
+        return self._poll()
+
+    def _poll(self):
+        """Return the users having a directory modified."""
+        return set(
+            user
+            for user, states in self._mtimes.items()
+            if any(self._state(d, is_repo) != state
+                   for d, is_repo, state in states))
+
+    def _watch(self, user, dirpath, is_repo=False):
+        self._mtimes.setdefault(user, []).append(
+            (dirpath, is_repo, self._state(dirpath, is_repo)))
+
+    def _unwatch_user(self, user):
+        self._mtimes.pop(user, None)
+
+
+class _Inotify(object):
+
+    """Minimal binding of inotify using ctypes."""
+
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_DONT_FOLLOW = 0x02000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+
+    _EVENT = struct.Struct(b"iIII")
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library(b"c"),
+                                 use_errno=True)
+        self.fd = self._libc.inotify_init1(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch", path)
+        return wd
+
+    def close(self):
+        os.close(self.fd)
+
+    def read(self, timeout):
+        """Read the events. Return a list of (wd, mask, name)."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, unused, length = self._EVENT.unpack_from(data, pos)
+            pos += self._EVENT.size
+            name = data[pos:pos + length].rstrip(b"\0")
+            pos += length
+            events.append((wd, mask, name))
+        return events
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+
+class InotifyWatcher(PollWatcher):
+
+    """Watcher using inotify to be notified when a directory is created or
+    removed. Raise OSError if inotify is not available. Directories which
+    can't be watched (e.g.: max_user_watches reached) are polled. Files
+    created or deleted are ignored, so running backups don't trigger a
+    search."""
+
+    MASK = (_Inotify.IN_CREATE | _Inotify.IN_DELETE | _Inotify.IN_MOVED_FROM |
+            _Inotify.IN_MOVED_TO | _Inotify.IN_DELETE_SELF |
+            _Inotify.IN_MOVE_SELF | _Inotify.IN_ONLYDIR |
+            _Inotify.IN_DONT_FOLLOW)
+
+    # Delay to wait for more events before updating the users.
+    DELAY = 1
+
+    # Maximum delay to collect the events before updating the users. Events
+    # keep coming while a backup is running.
+    MAX_DELAY = 30
+
+    # Interval (in seconds) to poll the directories which can't be watched.
+    POLL_INTERVAL = 60
+
+    def __init__(self, app, depth=DEFAULT_DEPTH, threads=DEFAULT_THREADS):
+        PollWatcher.__init__(self, app, depth, threads)
+        self._inotify = _Inotify()
+        # Users watching a watch descriptor.
+        self._users = {}
+        # Watch descriptors of a user.
+        self._wds = {}
+        # Watch descriptors of repositories.
+        self._repo_wds = set()
+
+    def close(self):
+        PollWatcher.close(self)
+        self._inotify.close()
+
+    def wait(self, event, timeout):
+        end = time.time() + timeout
+        if self._mtimes:
+            # Some directories are polled.
+            end = min(end, time.time() + self.POLL_INTERVAL)
+        dirty = set()
+        deadline = None
+        while not event.isSet():
+            # Wake up every second to check the event. Once an event is
+            # received, wait for more events until nothing happens during
+            # DELAY or MAX_DELAY is reached.
+            if dirty:
+                remaining = min(self.DELAY, deadline - time.time())
+            else:
+                remaining = end - time.time()
+            if remaining <= 0:
+                break
+            events = self._inotify.read(min(1, remaining))
+            if not events and dirty:
+                break
+            for wd, mask, name in events:
+                if mask & _Inotify.IN_Q_OVERFLOW:
+                    return None
+                if self._is_relevant(wd, mask, name):
+                    dirty.update(self._users.get(wd, []))
+            if dirty and deadline is None:
+                deadline = time.time() + self.MAX_DELAY
+        if not event.isSet():
+            dirty.update(self._poll())
+        return dirty
+
+    def _is_relevant(self, wd, mask, name):
+        """Check if the event may add or remove a repository."""
+        if mask & (_Inotify.IN_DELETE_SELF | _Inotify.IN_MOVE_SELF):
+            return True
+        if wd in self._repo_wds:
+            return name == librdiff.RDIFF_BACKUP_DATA
+        return bool(mask & _Inotify.IN_ISDIR)
+
+    def _watch(self, user, dirpath, is_repo=False):
+        try:
+            wd = self._inotify.add_watch(dirpath, self.MASK)
+        except OSError:
+            logger.warn("fail to watch [%s], polling instead" %
+                        dirpath.decode('utf-8', 'replace'), exc_info=1)
+            PollWatcher._watch(self, user, dirpath, is_repo)
+            return
+        self._users.setdefault(wd, set()).add(user)
+        self._wds.setdefault(user, []).append(wd)
+        if is_repo:
+            self._repo_wds.add(wd)
+        else:
+            self._repo_wds.discard(wd)
+
+    def _unwatch_user(self, user):
+        PollWatcher._unwatch_user(self, user)
+        for wd in self._wds.pop(user, []):
+            users = self._users.get(wd, set())
+            users.discard(user)
+            if not users:
+                self._users.pop(wd, None)
+                self._repo_wds.discard(wd)
+                self._inotify.rm_watch(wd)
+
+
+def _scan_dir(dirpath):
+    """List the given directory. Return a tuple (is_repo, subdirs) or None
+    if the directory can't be read. Symlinks are excluded from the
+    subdirectories. When available, scandir is used to avoid a stat() of
+    every entry."""
     try:
-        dirEntries = os.listdir(dirToSearch)
+        if scandir:
+            names = []
+            subdirs = []
+            for entry in scandir(dirpath):
+                names.append(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+        else:
+            names = os.listdir(dirpath)
+            subdirs = []
+            for name in names:
+                path = os.path.join(dirpath, name)
+                try:
+                    if stat.S_ISDIR(os.lstat(path).st_mode):
+                        subdirs.append(path)
+                except OSError:
+                    pass
     except:
         # Ignore error.
+        return None
+    return (librdiff.RDIFF_BACKUP_DATA in names, subdirs)
+
+
+def _find_repos(dirToSearch, depth=DEFAULT_DEPTH, dirs=None):
+    # Limit the depthness
+    if depth <= 0:
+        return
+
+    result = _scan_dir(dirToSearch)
+    if result is None:
         return
-    if librdiff.RDIFF_BACKUP_DATA in dirEntries:
+    # Keep track of the searched directories.
+    if dirs is not None:
+        dirs.append(dirToSearch)
+    is_repo, subdirs = result
+    if is_repo:
+        # Don't search the content of the repository.
         yield dirToSearch
+        return
 
-    for entry in dirEntries:
-        entryPath = os.path.join(dirToSearch, entry)
-        if os.path.isdir(entryPath) and not os.path.islink(entryPath):
-            for x in _find_repos(entryPath, depth - 1):
-                yield x
+    for entryPath in subdirs:
+        for x in _find_repos(entryPath, depth - 1, dirs):
+            yield x
 
 
-def find_repos_for_user(user, userdb):
-    logger.debug("find repos for [%s]" % user)
-    user_root = encode_s(userdb.get_user_root(user))
-    repo_paths = list(_find_repos(user_root))
+def _search(dirpath, depth):
+    """Search the repositories in the given directory. Return a tuple
+    (repos, dirs, duration)."""
+    start = time.time()
+    dirs = []
+    repos = list(_find_repos(dirpath, depth, dirs))
+    return (repos, dirs, time.time() - start)
+
+
+def _search_all(roots, depth, threads):
+    """Search the repositories of every root directory using a pool of
+    threads. The subdirectories of the roots are searched in parallel.
+    Return a dictionary {key: (repos, dirs, duration)} for the given `roots`
+    dictionary {key: root}."""
+    results = dict((key, ([], [], 0)) for key in roots)
+    if depth <= 0 or not roots:
+        return results
 
-    def striproot(path):
-        if not path[len(user_root):]:
-            return "/"
-        return path[len(user_root):]
-    repo_paths = map(striproot, repo_paths)
-    logger.debug("set user [%s] repos: %s " % (user, repo_paths))
-    userdb.set_repos(user, repo_paths)
+    def merge(key, result):
+        repos, dirs, duration = results[key]
+        results[key] = (repos + result[0], dirs + result[1],
+                        duration + result[2])
+
+    pool = ThreadPool(max(1, threads))
+    try:
+        # First, list the root directories.
+        def scan_root(key):
+            start = time.time()
+            return key, _scan_dir(roots[key]), time.time() - start
+        tasks = []
+        for key, result, duration in pool.imap_unordered(scan_root, roots):
+            if result is None:
+                continue
+            is_repo, subdirs = result
+            merge(key, ([roots[key]] if is_repo else [], [roots[key]],
+                        duration))
+            if depth > 1 and not is_repo:
+                tasks.extend((key, x) for x in subdirs)
+
+        # Then search every subdirectory.
+        def search(task):
+            return task[0], _search(task[1], depth - 1)
+        for key, result in pool.imap_unordered(search, tasks):
+            merge(key, result)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def find_repos_for_users(users, userdb, depth=DEFAULT_DEPTH,
+                         threads=DEFAULT_THREADS):
+    """Search and update the repositories of the given users. Return a
+    dictionary {user: (dirs, repos)} of the directories searched and the
+    repositories found for every user."""
+    roots = dict(
+        (user, encode_s(userdb.get_user_root(user) or "")) for user in users)
+    results = _search_all(roots, depth, threads)
+    searched = {}
+    for user, (repos, dirs, duration) in results.items():
+        user_root = roots[user]
+
+        def striproot(path):
+            if not path[len(user_root):]:
+                return "/"
+            return path[len(user_root):]
+        repo_paths = sorted(map(striproot, repos))
+        logger.debug("set user [%s] repos: %s " % (user, repo_paths))
+        userdb.set_repos(user, repo_paths)
+        searched[user] = (dirs, set(repos))
+
+        # Keep track of the search duration.
+        _search_stats[user] = SearchStats(duration, len(repo_paths),
+                                          len(dirs), time.time())
+        if duration > SLOW_SEARCH:
+            logger.warn("searching repositories of [%s] took %.1fs "
+                        "(%d directories)" % (user, duration, len(dirs)))
+    return searched
+
+
+def find_repos_for_user(user, userdb, depth=DEFAULT_DEPTH,
+                        threads=DEFAULT_THREADS):
+    """Search and update the repositories of the given user. Return a tuple
+    (dirs, repos) of the directories searched and the repositories found."""
+    logger.debug("find repos for [%s]" % user)
+    return find_repos_for_users([user], userdb, depth, threads)[user]
 
 
 def find_repos_for_all_users(app):
@@ -101,5 +573,5 @@ def find_repos_for_all_users(app):
         return
 
     users = user_db.list()
-    for user in users:
-        find_repos_for_user(user, user_db)
+    find_repos_for_users(users, user_db, get_search_depth(app.cfg),
+                         get_search_threads(app.cfg))
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import unicode_literals
+
+import librdiff
+import logging
+import os
+import threading
+
+from rdiffweb.rdw_helpers import encode_s
+
+"""
+Module used to collect the status of the backups in background. When a new
+session_statistics file appears in a repository, a summary of the backup is
+recorded into the user database, so the status pages don't have to read the
+repositories.
+"""
+
+# Define the logger
+logger = logging.getLogger(__name__)
+
+# Number of lines of the error log kept in the summary.
+MAX_ERROR_LINES = 10
+
+
+def start_status_collector_thread(killEvent, app):
+    """Start the thread collecting the backup summaries."""
+    thread = StatusCollectorThread(killEvent, app.status_collector)
+    thread.start()
+
+
+def get_summary(repo, date):
+    """Return the summary of the backup made on the given date."""
+    entry = librdiff.HistoryEntry(repo, date)
+    errors = [x for x in entry.errors.splitlines() if x.strip()]
+    return {"date": date,
+            "source_size": entry.size,
+            "increment_size": entry.increment_size,
+            "error_count": len(errors),
+            "errors": "\n".join(errors[:MAX_ERROR_LINES])}
+
+
+class StatusCollector(object):
+
+    """Record the summaries of new backups into the user database."""
+
+    def __init__(self, app, interval=0):
+        self.app = app
+        # Interval in seconds between checks. 0 to disable.
+        self.interval = interval
+        # Modification time of rdiff-backup-data when last collected by
+        # (user, repo).
+        self._mtimes = {}
+        # Errors reading the repositories {user: {repo: error}}.
+        self._errors = {}
+        # Repositories collected at least once {user: set(repo)}.
+        self._collected = {}
+
+    @property
+    def enabled(self):
+        """True if the status pages should read the recorded summaries."""
+        return (self.interval > 0 and
+                self.app.userdb.supports('add_backup_summaries'))
+
+    def collect(self):
+        """Collect the new backups of every user."""
+        for user in self.app.userdb.list():
+            try:
+                self.collect_user(user)
+            except:
+                logger.exception("fail to collect backups of [%s]", user)
+
+    def collect_user(self, user):
+        """Collect the new backups of the given user repositories."""
+        userdb = self.app.userdb
+        user_root_b = encode_s(userdb.get_user_root(user))
+        repos = userdb.get_repos(user)
+        errors = {k: v for k, v in self._errors.get(user, {}).items()
+                  if k in repos}
+        last_dates = None
+        collected = set()
+        for repo in repos:
+            repo_b = encode_s(repo).strip(b"/")
+            data_path = os.path.join(
+                user_root_b, repo_b, librdiff.RDIFF_BACKUP_DATA)
+            try:
+                mtime = os.stat(data_path).st_mtime
+            except OSError:
+                mtime = None
+            key = (user, repo)
+            if mtime is not None and self._mtimes.get(key) == mtime:
+                collected.add(repo)
+                continue
+            try:
+                repo_obj = self.app.repo_cache.get_repo(user_root_b, repo_b)
+                if last_dates is None:
+                    last_dates = userdb.get_last_backup_dates(user)
+                last_date = last_dates.get(repo)
+                # Only the backups with session statistics are completed.
+                dates = sorted(
+                    date for date in repo_obj._session_statistics
+                    if last_date is None or date > last_date)
+                if dates:
+                    logger.debug("recording %d backups of [%s]",
+                                 len(dates), repo_obj.display_name)
+                    userdb.add_backup_summaries(
+                        user, repo, [get_summary(repo_obj, x) for x in dates])
+                self._mtimes[key] = mtime
+                errors.pop(repo, None)
+            except librdiff.FileError as e:
+                # Keep the error to be translated by the request thread.
+                errors[repo] = e
+            collected.add(repo)
+        self._errors[user] = errors
+        self._collected[user] = collected
+
+    def get_collected_repos(self, user):
+        """Return the repositories of the user already collected. The status
+        of the other repositories is not recorded yet."""
+        return set(self._collected.get(user, ()))
+
+    def get_repo_errors(self, user):
+        """Return the errors of the last collect as a dict {repo: error}."""
+        return {k: unicode(v) for k, v in self._errors.get(user, {}).items()}
+
+
+class StatusCollectorThread(threading.Thread):
+
+    def __init__(self, killEvent, collector):
+        """Create a new thread to collect the backup summaries."""
+        self.killEvent = killEvent
+        self.collector = collector
+        threading.Thread.__init__(self, name="StatusCollector")
+        self.daemon = True
+
+    def run(self):
+        if not self.collector.enabled:
+            return
+        while not self.killEvent.isSet():
+            self.collector.collect()
+            self.killEvent.wait(self.collector.interval)
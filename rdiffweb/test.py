@@ -17,6 +17,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
+import os
+import stat
+
 from rdiffweb.rdw_app import RdiffwebApp
 
 """
@@ -69,3 +72,33 @@ class MockRdiffwebApp(RdiffwebApp):
         # Create new user admin
         if self.userdb.supports('add_user'):
             self.userdb.add_user('admin', 'admin123')
+
+
+class MockDirEntry(object):
+
+    """Entry returned by `mock_scandir`, same interface as scandir."""
+
+    def __init__(self, dirpath, name):
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+
+    def is_dir(self, follow_symlinks=True):
+        return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+
+    def is_file(self, follow_symlinks=True):
+        return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.stat(self.path)
+        return os.lstat(self.path)
+
+
+def mock_scandir(dirpath):
+    """
+    Used to test the scandir code paths when scandir is not installed.
+    """
+    return iter([MockDirEntry(dirpath, x) for x in os.listdir(dirpath)])
@@ -17,13 +17,24 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import unicode_literals
 
+from distutils.spawn import find_executable
+import gzip
 import pkg_resources
+import tarfile
 import unittest
 
 from rdiffweb.librdiff import RdiffPath, FileStatisticsEntry, RdiffRepo, \
-    DirEntry, IncrementEntry
+    DirEntry, IncrementEntry, RdiffRepoIndex, RdiffRepoCache, DoesNotExistError, \
+    SessionStatistics
 import os
+import shutil
+import sqlite3
+import stat
+import tempfile
+import time
+from rdiffweb import librdiff
 from rdiffweb.rdw_helpers import rdwTime
+from rdiffweb.test import MockDirEntry, mock_scandir
 
 """
 Created on Oct 3, 2015
@@ -36,11 +47,12 @@ Module used to test the librdiff.
 
 class MockRdiffRepo(RdiffRepo):
 
-    def __init__(self):
+    def __init__(self, repo_root=None):
         self.encoding = 'utf8'
-        self.repo_root = pkg_resources.resource_filename(b'rdiffweb', b'tests')  # @UndefinedVariable
+        self.repo_root = repo_root or pkg_resources.resource_filename(b'rdiffweb', b'tests')  # @UndefinedVariable
         self.data_path = os.path.join(self.repo_root, b'rdiff-backup-data')
         self.root_path = MockRdiffPath(self)
+        self._index = RdiffRepoIndex(self.data_path)
 
 
 class MockRdiffPath(RdiffPath):
@@ -114,6 +126,46 @@ class DirEntryTest(unittest.TestCase):
              ],
             entry.restore_dates)
 
+    def test_is_mirror_copy(self):
+        increments = [
+            IncrementEntry(self.root_path, b'__init__.py.2014-11-05T16:04:30-05:00.diff.gz')]
+        entry = DirEntry(self.root_path, b'__init__.py', True, increments)
+        self.assertFalse(entry.is_mirror_copy(rdwTime(1415221470)))
+        self.assertTrue(entry.is_mirror_copy(rdwTime(1415221495)))
+        self.assertTrue(entry.is_mirror_copy(rdwTime(1415221507)))
+
+    def test_is_mirror_copy_with_deleted_file(self):
+        increments = [
+            IncrementEntry(self.root_path, b'__init__.py.2014-11-05T16:04:30-05:00.snapshot.gz')]
+        entry = DirEntry(self.root_path, b'__init__.py', False, increments)
+        self.assertFalse(entry.is_mirror_copy(rdwTime(1415221470)))
+
+    def test_is_mirror_copy_with_dir(self):
+        entry = DirEntry(self.root_path, b'rdiff-backup-data', True, [])
+        self.assertFalse(entry.is_mirror_copy(rdwTime(1415221507)))
+
+
+class IncrementEntryTest(unittest.TestCase):
+
+    def test_extract_date(self):
+        self.assertEqual(
+            rdwTime(1415221470),
+            IncrementEntry.extract_date(b'my.file.2014-11-05T16:04:30-05:00.diff.gz'))
+        self.assertEqual(
+            rdwTime(1415221470),
+            IncrementEntry.extract_date(b'session_statistics.2014-11-05T16:04:30-05:00.data'))
+        self.assertIsNone(IncrementEntry.extract_date(b'rdiffweb.index'))
+        self.assertIsNone(IncrementEntry.extract_date(b'increments'))
+
+    def test_filename(self):
+        root_path = MockRdiffRepo().root_path
+        entry = IncrementEntry(root_path, b'my.file.2014-11-05T16:04:30-05:00.diff.gz')
+        self.assertEqual(b'my.file', entry.filename)
+        entry = IncrementEntry(root_path, b'my_dir.2014-11-05T16:04:30Z.dir')
+        self.assertEqual(b'my_dir', entry.filename)
+        self.assertEqual(rdwTime(1415203470), entry.date)
+        self.assertTrue(entry.isdir)
+
 
 class FileStatisticsEntryTest(unittest.TestCase):
     """
@@ -121,9 +173,17 @@ class FileStatisticsEntryTest(unittest.TestCase):
     """
 
     def setUp(self):
-        self.repo = MockRdiffRepo()
+        # Work on a copy since the file statistics get indexed.
+        self.repo_root = tempfile.mkdtemp()
+        shutil.copytree(
+            pkg_resources.resource_filename(b'rdiffweb', b'tests/rdiff-backup-data'),  # @UndefinedVariable
+            os.path.join(self.repo_root, b'rdiff-backup-data'))
+        self.repo = MockRdiffRepo(self.repo_root)
         self.root_path = self.repo.root_path
 
+    def tearDown(self):
+        shutil.rmtree(self.repo_root, ignore_errors=True)
+
     def test_get_mirror_size(self):
         entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data')
         size = entry.get_mirror_size(b'<F!chïer> (@vec) {càraçt#èrë} $épêcial')
@@ -144,6 +204,523 @@ class FileStatisticsEntryTest(unittest.TestCase):
         size = entry.get_source_size(b'<F!chïer> (@vec) {càraçt#èrë} $épêcial')
         self.assertEqual(286, size)
 
+    def test_get_source_sizes(self):
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+        sizes = entry.get_source_sizes([b'<F!chïer> (@vec) {càraçt#èrë} $épêcial', b'.', b'invalid'])
+        self.assertEqual({b'<F!chïer> (@vec) {càraçt#èrë} $épêcial': 286, b'.': 0}, sizes)
+
+    def test_get_source_sizes_without_index(self):
+        self.repo._index.get_file_statistics = lambda *args: None
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data')
+        sizes = entry.get_source_sizes([b'<F!chïer> (@vec) {càraçt#èrë} $épêcial', b'.', b'invalid'])
+        self.assertEqual({b'<F!chïer> (@vec) {càraçt#èrë} $épêcial': 286, b'.': 0}, sizes)
+
+    def test_get_source_size_with_invalid_path(self):
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+        self.assertEqual(0, entry.get_source_size(b'invalid'))
+
+    def test_get_source_size_without_index(self):
+        # Make the index unusable to fallback to a linear search.
+        self.repo._index.get_file_statistics = lambda *args: None
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+        self.assertEqual(286, entry.get_source_size(b'<F!chïer> (@vec) {càraçt#èrë} $épêcial'))
+        self.assertEqual(0, entry.get_source_size(b'invalid'))
+
+    def test_get_source_size_with_index(self):
+        entry = FileStatisticsEntry(self.root_path, b'file_statistics.2014-11-05T16:05:07-05:00.data.gz')
+        entry.get_source_size(b'.')
+        # Once indexed, the file is not read anymore.
+        entry._iter_entries = None
+        self.assertEqual(286, entry.get_source_size(b'<F!chïer> (@vec) {càraçt#èrë} $épêcial'))
+
+
+class RdiffPathRestoreTest(unittest.TestCase):
+    """
+    Test restore of regular files by applying the increments.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        repo_root = os.path.join(self.user_root, b'repo')
+        data_path = os.path.join(repo_root, b'rdiff-backup-data')
+        increments = os.path.join(data_path, b'increments')
+        os.makedirs(increments)
+        for date in [b'2014-11-01T12:00:00-05:00', b'2014-11-02T12:00:00-05:00', b'2014-11-03T12:00:00-05:00']:
+            self._write(data_path, b'mirror_metadata.' + date + b'.snapshot.gz', b'', True)
+        self._write(repo_root, b'file.txt', b'version three\n')
+        self._write(increments, b'file.txt.2014-11-02T12:00:00-05:00.diff.gz',
+                    b'rs\x026' + b'\x45\x00\x08' + b'\x04two\n' + b'\x00', True)
+        self._write(increments, b'file.txt.2014-11-01T12:00:00-05:00.snapshot.gz', b'version one\n', True)
+        self._write(repo_root, b'new.txt', b'new\n')
+        self._write(increments, b'new.txt.2014-11-02T12:00:00-05:00.missing', b'')
+        self.repo = RdiffRepo(self.user_root, b'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _write(self, dirpath, name, data, compress=False):
+        f = (gzip.open if compress else open)(os.path.join(dirpath, name), 'wb')
+        with f:
+            f.write(data)
+
+    def _date(self, value):
+        date = rdwTime()
+        date.initFromString(value)
+        return date
+
+    def _restore(self, name, date):
+        output = self.repo.root_path.restore(name, self._date(date), True)
+        try:
+            with open(output, 'rb') as f:
+                return f.read()
+        finally:
+            shutil.rmtree(os.path.dirname(output))
+
+    def test_restore_diff(self):
+        self.assertEqual(b'version two\n', self._restore(b'file.txt', '2014-11-02T12:00:00-05:00'))
+
+    def test_restore_snapshot(self):
+        self.assertEqual(b'version one\n', self._restore(b'file.txt', '2014-11-01T12:00:00-05:00'))
+
+    def test_restore_missing(self):
+        # Missing revision must be handled by rdiff-backup.
+        entry = self.repo.root_path._get_entry(b'new.txt')
+        output = os.path.join(self.user_root, b'output')
+        self.assertFalse(self.repo.root_path._patch_file(entry, self._date('2014-11-02T12:00:00-05:00'), output))
+        self.assertFalse(os.path.exists(output))
+
+
+class RdiffPathRestoreTestcasesTest(unittest.TestCase):
+    """
+    Test restore of regular files by applying the increments of a repository
+    created by rdiff-backup. testcases.tar.gz contains the repository and the
+    files restored by `rdiff-backup --restore-as-of` for every backups in
+    restored/<epoch>/.
+    """
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        filename = pkg_resources.resource_filename(b'rdiffweb', b'tests/testcases.tar.gz')  # @UndefinedVariable
+        with tarfile.open(filename) as tar:
+            tar.extractall(self.tempdir)
+        self.repo = RdiffRepo(self.tempdir, b'testcases')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _expected(self):
+        """Yield (date, name, data) of the files restored by rdiff-backup."""
+        restored = os.path.join(self.tempdir, b'restored')
+        for epoch in sorted(os.listdir(restored)):
+            date = rdwTime()
+            date.initFromInt(int(epoch))
+            for dirpath, unused, filenames in os.walk(os.path.join(restored, epoch)):
+                for filename in filenames:
+                    fullpath = os.path.join(dirpath, filename)
+                    with open(fullpath, 'rb') as f:
+                        data = f.read()
+                    name = os.path.relpath(fullpath, os.path.join(restored, epoch))
+                    yield (date, name, data)
+
+    def _restore(self, name, date, patch_files=True):
+        (parent, filename) = os.path.split(name)
+        path = self.repo.get_path(parent) if parent else self.repo.root_path
+        output = path.restore(filename, date, True, patch_files=patch_files)
+        try:
+            with open(output, 'rb') as f:
+                return f.read()
+        finally:
+            shutil.rmtree(os.path.dirname(output))
+
+    def test_patch_file(self):
+        count = 0
+        output = os.path.join(self.tempdir, b'output')
+        for date, name, data in self._expected():
+            (parent, filename) = os.path.split(name)
+            path = self.repo.get_path(parent) if parent else self.repo.root_path
+            entry = path._get_entry(filename)
+            if entry.is_mirror_copy(date):
+                continue
+            self.assertTrue(path._patch_file(entry, date, output), name)
+            with open(output, 'rb') as f:
+                self.assertEqual(data, f.read(), '%r at %s' % (name, date))
+            os.remove(output)
+            count += 1
+        self.assertEqual(19, count)
+
+    @unittest.skipIf(not find_executable('rdiff-backup'), "requires rdiff-backup")
+    def test_restore_with_rdiff_backup(self):
+        for date, name, data in self._expected():
+            self.assertEqual(data, self._restore(name, date, patch_files=False), '%r at %s' % (name, date))
+            self.assertEqual(data, self._restore(name, date), '%r at %s' % (name, date))
+
+
+class RdiffPathDirEntriesTest(unittest.TestCase):
+    """
+    Test the listing of a directory merging the mirror and the increments.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        repo_root = os.path.join(self.user_root, b'repo')
+        data_path = os.path.join(repo_root, b'rdiff-backup-data')
+        increments = os.path.join(data_path, b'increments')
+        os.makedirs(os.path.join(increments, b'subdir'))
+        os.makedirs(os.path.join(repo_root, b'subdir'))
+        for date in [b'2014-11-01T12:00:00-05:00', b'2014-11-02T12:00:00-05:00']:
+            self._write(data_path, b'mirror_metadata.' + date + b'.snapshot.gz')
+        self._write(repo_root, b'file.txt', b'content')
+        self._write(increments, b'file.txt.2014-11-01T12:00:00-05:00.diff.gz')
+        self._write(increments, b'subdir.2014-11-01T12:00:00-05:00.dir')
+        self._write(increments, b'deleted.txt.2014-11-02T12:00:00-05:00.snapshot.gz')
+        self.repo = RdiffRepo(self.user_root, b'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _write(self, dirpath, name, data=b''):
+        with open(os.path.join(dirpath, name), 'wb') as f:
+            f.write(data)
+
+    def test_dir_entries(self):
+        entries = {x.name: x for x in self.repo.root_path._get_dir_entries()}
+        self.assertEqual([b'deleted.txt', b'file.txt', b'subdir'], sorted(entries))
+        self.assertTrue(entries[b'file.txt'].exists)
+        self.assertFalse(entries[b'file.txt'].isdir)
+        self.assertEqual(7, entries[b'file.txt'].file_size)
+        self.assertEqual(1, len(entries[b'file.txt']._increments))
+        self.assertTrue(entries[b'subdir'].exists)
+        self.assertTrue(entries[b'subdir'].isdir)
+        self.assertFalse(entries[b'deleted.txt'].exists)
+        self.assertFalse(entries[b'deleted.txt'].isdir)
+
+    def test_dir_entries_with_deleted_dir(self):
+        increments = os.path.join(self.repo.data_path, b'increments')
+        os.makedirs(os.path.join(increments, b'deleted_dir'))
+        self._write(increments, b'deleted_dir.2014-11-02T12:00:00-05:00.dir')
+        self._write(os.path.join(increments, b'deleted_dir'), b'a.txt.2014-11-02T12:00:00-05:00.snapshot.gz')
+        path = self.repo.get_path(b'deleted_dir')
+        self.assertEqual({}, path.existing_entries)
+        self.assertEqual([b'a.txt'], [x.name for x in path._get_dir_entries()])
+
+
+class RdiffPathDirEntriesWithScandirTest(RdiffPathDirEntriesTest):
+    """
+    Test the listing of a directory using scandir entries.
+    """
+
+    def setUp(self):
+        self._scandir = librdiff.scandir
+        librdiff.scandir = mock_scandir
+        RdiffPathDirEntriesTest.setUp(self)
+
+    def tearDown(self):
+        librdiff.scandir = self._scandir
+        RdiffPathDirEntriesTest.tearDown(self)
+
+    def test_dir_entries_with_dirent(self):
+        entries = {x.name: x for x in self.repo.root_path._get_dir_entries()}
+        self.assertIsInstance(entries[b'file.txt']._dirent, MockDirEntry)
+        self.assertIsInstance(entries[b'subdir']._dirent, MockDirEntry)
+        self.assertIsNone(entries[b'deleted.txt']._dirent)
+        self.assertTrue(entries[b'file.txt'].is_mirror_copy(rdwTime(1414947600)))
+
+
+class RdiffRepoIndexTest(unittest.TestCase):
+    """
+    Test the persistent index of rdiff-backup-data.
+    """
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        self._touch(b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz')
+        self._touch(b'session_statistics.2014-11-05T16:04:30-05:00.data')
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path, ignore_errors=True)
+        shutil.rmtree(self.index_dir, ignore_errors=True)
+
+    def _index(self):
+        return RdiffRepoIndex(self.data_path, self.index_dir)
+
+    def _touch(self, name):
+        open(os.path.join(self.data_path, name), 'w').close()
+
+    def test_entries(self):
+        index = self._index()
+        entries = index.entries
+        self.assertEqual(
+            rdwTime(1415221470),
+            entries[b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz'])
+        self.assertEqual(
+            '-05:00',
+            entries[b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz'].getTimeZoneString())
+        # Index should not be written in rdiff-backup-data.
+        self.assertEqual(2, len(entries))
+        self.assertEqual(2, len(os.listdir(self.data_path)))
+
+    def test_entries_with_new_entry(self):
+        self._index().entries
+        # Add a new session and make sure the modification time changed.
+        self._touch(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz')
+        os.utime(self.data_path, (0, 0))
+        entries = self._index().entries
+        self.assertIn(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz', entries)
+        self.assertEqual(
+            rdwTime(1415221495),
+            entries[b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz'])
+
+    def test_entries_with_removed_entry(self):
+        self._index().entries
+        os.remove(os.path.join(self.data_path, b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz'))
+        os.utime(self.data_path, (0, 0))
+        entries = self._index().entries
+        self.assertNotIn(b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz', entries)
+
+    def test_entries_without_modification(self):
+        # Index doesn't list the folder if the modification time didn't change.
+        os.utime(self.data_path, (1000, 1000))
+        self._index().entries
+        self._touch(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz')
+        os.utime(self.data_path, (1000, 1000))
+        entries = self._index().entries
+        self.assertNotIn(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz', entries)
+
+    def test_entries_with_recent_modification(self):
+        # Index should not trust a modification time too recent. A second
+        # modification may not change it on some file systems.
+        now = int(time.time())
+        os.utime(self.data_path, (now, now))
+        self._index().entries
+        self._touch(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz')
+        os.utime(self.data_path, (now, now))
+        entries = self._index().entries
+        self.assertIn(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz', entries)
+
+    def test_index_dir_private(self):
+        index_dir = os.path.join(self.index_dir, b'index')
+        RdiffRepoIndex(self.data_path, index_dir).entries
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(index_dir).st_mode))
+
+    @unittest.skipIf(os.getuid() != 0, "requires root to change the owner")
+    def test_index_dir_with_other_owner(self):
+        os.chown(self.index_dir, 12345, 12345)
+        index = self._index()
+        self.assertIn(b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz', index.entries)
+        self.assertEqual([], os.listdir(self.index_dir))
+
+    def test_session_statistics(self):
+        name = b'session_statistics.2014-11-05T16:04:30-05:00.data'
+        index = self._index()
+        self.assertIsNone(index.get_session_statistics(name))
+        index.set_session_statistics(name, {b'SourceFileSize': b'1024'})
+        # Statistics should be persisted.
+        index = self._index()
+        self.assertEqual({b'SourceFileSize': b'1024'}, index.get_session_statistics(name))
+
+    def test_file_statistics(self):
+        index = RdiffRepoIndex(self.data_path, self.index_dir, max_file_statistics=1)
+        entries = [(b'a', b'1', b'10', b'10', b'NA'), (b'b', b'0', b'20', b'20', b'NA')]
+        data = index.get_file_statistics(b'file1', [b'b', b'c'], lambda: iter(entries))
+        self.assertEqual({b'b': entries[1]}, data)
+        # Once indexed, the file is not read anymore.
+        self.assertEqual({b'a': entries[0]}, index.get_file_statistics(b'file1', [b'a'], None))
+        # Least recently used files are removed from the index.
+        index.get_file_statistics(b'file2', [b'a'], lambda: iter(entries))
+        conn = sqlite3.connect(index.filename)
+        try:
+            self.assertEqual(
+                [(b'file2',)],
+                conn.execute("SELECT DISTINCT Name FROM file_statistics").fetchall())
+        finally:
+            conn.close()
+
+    def test_entries_with_corrupted_index(self):
+        index = self._index()
+        with open(index.filename, 'wb') as f:
+            f.write(b'corrupted' * 1024)
+        entries = index.entries
+        self.assertIn(b'mirror_metadata.2014-11-05T16:04:30-05:00.snapshot.gz', entries)
+        # Index should be created again.
+        os.utime(self.data_path, (1000, 1000))
+        self._index().entries
+        self._touch(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz')
+        os.utime(self.data_path, (1000, 1000))
+        entries = self._index().entries
+        self.assertNotIn(b'mirror_metadata.2014-11-05T16:04:55-05:00.snapshot.gz', entries)
+
+
+class RdiffRepoCacheTest(unittest.TestCase):
+    """
+    Test the repositories cache.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        for name in [b'repo1', b'repo2']:
+            data_path = os.path.join(self.user_root, name, b'rdiff-backup-data')
+            os.makedirs(data_path)
+            os.utime(data_path, (1000, 1000))
+        self.cache = RdiffRepoCache(max_size=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def test_get_repo(self):
+        repo = self.cache.get_repo(self.user_root, b'repo1')
+        self.assertEqual(b'repo1', repo.path)
+        self.assertIs(repo, self.cache.get_repo(self.user_root, b'/repo1/'))
+
+    def test_get_repo_with_invalid_repo(self):
+        with self.assertRaises(DoesNotExistError):
+            self.cache.get_repo(self.user_root, b'invalid')
+
+    def test_get_repo_with_modification(self):
+        repo = self.cache.get_repo(self.user_root, b'repo1')
+        os.utime(os.path.join(self.user_root, b'repo1', b'rdiff-backup-data'), (2000, 2000))
+        self.assertIsNot(repo, self.cache.get_repo(self.user_root, b'repo1'))
+
+    def test_get_repo_with_eviction(self):
+        repo = self.cache.get_repo(self.user_root, b'repo1')
+        self.cache.get_repo(self.user_root, b'repo2')
+        self.assertIsNot(repo, self.cache.get_repo(self.user_root, b'repo1'))
+
+
+class SessionStatisticsTest(unittest.TestCase):
+    """
+    Test the bulk loading of session statistics.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        self.data_path = os.path.join(self.user_root, b'repo', b'rdiff-backup-data')
+        os.makedirs(self.data_path)
+        self._write(b'session_statistics.2014-11-01T10:00:00-05:00.data', 100, 10)
+        self._write(b'session_statistics.2014-11-02T10:00:00-05:00.data.gz', 200, 20)
+        os.utime(self.data_path, (1000, 1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _write(self, name, source_size, increment_size):
+        data = (b"# Comment\nSourceFiles 3\nSourceFileSize %d (1 KB)\n"
+                b"IncrementFileSize %d (1 KB)\n" % (source_size, increment_size))
+        filename = os.path.join(self.data_path, name)
+        f = gzip.open(filename, 'wb') if name.endswith(b'.gz') else open(filename, 'wb')
+        with f:
+            f.write(data)
+
+    def test_session_statistics(self):
+        repo = RdiffRepo(self.user_root, b'repo')
+        stats = repo.session_statistics
+        self.assertEqual(2, len(stats.dates))
+        self.assertEqual(100, stats.get_source_file_size(rdwTime(1414854000)))
+        self.assertEqual(20, stats.get_increment_file_size(rdwTime(1414940400)))
+        self.assertEqual(0, stats.get_source_file_size(rdwTime(0)))
+
+    def test_session_statistics_with_index(self):
+        RdiffRepo(self.user_root, b'repo').session_statistics
+        # Statistics should be read from the index.
+        os.remove(os.path.join(self.data_path, b'session_statistics.2014-11-01T10:00:00-05:00.data'))
+        self._touch_empty(b'session_statistics.2014-11-01T10:00:00-05:00.data')
+        stats = RdiffRepo(self.user_root, b'repo').session_statistics
+        self.assertEqual(100, stats.get_source_file_size(rdwTime(1414854000)))
+
+    def _touch_empty(self, name):
+        open(os.path.join(self.data_path, name), 'w').close()
+        os.utime(self.data_path, (1000, 1000))
+
+    def test_history_entries(self):
+        for date in [b'2014-11-01T10:00:00-05:00', b'2014-11-02T10:00:00-05:00']:
+            self._touch_empty(b'mirror_metadata.' + date + b'.snapshot.gz')
+        repo = RdiffRepo(self.user_root, b'repo')
+        entries = repo.get_history_entries()
+        self.assertEqual([100, 200], [x.size for x in entries])
+        self.assertEqual([10, 20], [x.increment_size for x in entries])
+
+    def test_update_with_new_session(self):
+        cache = RdiffRepoCache()
+        stats = cache.get_repo(self.user_root, b'repo').session_statistics
+        self._write(b'session_statistics.2014-11-03T10:00:00-05:00.data', 300, 30)
+        os.utime(self.data_path, (2000, 2000))
+        repo = cache.get_repo(self.user_root, b'repo')
+        # Statistics are kept and extended with the new session.
+        self.assertIs(stats, repo.session_statistics)
+        self.assertEqual(3, len(stats.dates))
+        self.assertEqual(300, stats.get_source_file_size(rdwTime(1415026800)))
+
+    def test_update_with_unreadable_session(self):
+        name = b'session_statistics.2014-11-03T10:00:00-05:00.data.gz'
+        with open(os.path.join(self.data_path, name), 'wb') as f:
+            f.write(b'invalid')
+        stats = SessionStatistics()
+        stats.update(RdiffRepo(self.user_root, b'repo'))
+        self.assertEqual(2, len(stats.dates))
+        self.assertEqual(0, stats.get_source_file_size(rdwTime(1415026800)))
+        # The session is loaded once readable.
+        os.remove(os.path.join(self.data_path, name))
+        self._write(name, 300, 30)
+        stats.update(RdiffRepo(self.user_root, b'repo'))
+        self.assertEqual(3, len(stats.dates))
+        self.assertEqual(300, stats.get_source_file_size(rdwTime(1415026800)))
+
+    def test_update_with_removed_session(self):
+        stats = SessionStatistics()
+        stats.update(RdiffRepo(self.user_root, b'repo'))
+        os.remove(os.path.join(self.data_path, b'session_statistics.2014-11-01T10:00:00-05:00.data'))
+        os.utime(self.data_path, (2000, 2000))
+        stats.update(RdiffRepo(self.user_root, b'repo'))
+        self.assertEqual(1, len(stats.dates))
+        self.assertEqual(0, stats.get_source_file_size(rdwTime(1414854000)))
+        self.assertEqual(200, stats.get_source_file_size(rdwTime(1414940400)))
+
+
+class HistoryEntriesTest(unittest.TestCase):
+    """
+    Test the lookup of history entries.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        data_path = os.path.join(self.user_root, b'repo', b'rdiff-backup-data')
+        os.makedirs(data_path)
+        for day in range(1, 11):
+            name = b'mirror_metadata.2014-11-%02dT10:00:00Z.snapshot.gz' % day
+            open(os.path.join(data_path, name), 'w').close()
+        self.repo = RdiffRepo(self.user_root, b'repo')
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _days(self, entries):
+        return [x.date.getSeconds() // 86400 - 16374 for x in entries]
+
+    def test_get_history_entries(self):
+        entries = self.repo.get_history_entries()
+        self.assertEqual(10, len(entries))
+        self.assertEqual(list(range(1, 11)), self._days(entries))
+
+    def test_get_history_entries_with_dates(self):
+        entries = self.repo.get_history_entries(
+            earliestDate=rdwTime(1414836000 + 2 * 86400),
+            latestDate=rdwTime(1414836000 + 5 * 86400))
+        self.assertEqual([3, 4, 5, 6], self._days(entries))
+
+    def test_get_history_entries_with_num(self):
+        entries = self.repo.get_history_entries(
+            2, earliestDate=rdwTime(1414836000 + 2 * 86400))
+        self.assertEqual([3, 4], self._days(entries))
+
+    def test_get_history_entries_slice(self):
+        entries = self.repo.get_history_entries()
+        self.assertEqual([8, 9, 10], self._days(entries[-3:]))
+        self.assertEqual([5], self._days(entries[2:6][2:3]))
+        self.assertEqual([10, 9], self._days(list(reversed(entries))[0:2]))
+        self.assertEqual(10, self._days([entries[-1]])[0])
+        with self.assertRaises(IndexError):
+            entries[10]
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
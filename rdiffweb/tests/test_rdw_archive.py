@@ -0,0 +1,172 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import os
+import shutil
+import struct
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from rdiffweb import rdw_archive
+from rdiffweb.rdw_archive import archive_tar, archive_zip
+
+"""
+Module used to test the rdw_archive.
+"""
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.dirpath = os.path.join(self.tempdir, b'data')
+        os.makedirs(os.path.join(self.dirpath, b'subdir'))
+        os.makedirs(os.path.join(self.dirpath, b'empty'))
+        self._write(b'file.txt', b'content')
+        self._write(b'subdir/fichi\xc3\xa9r.txt', b'x' * 3000)
+        self._write(b'empty.txt', b'')
+        self.target = os.path.join(self.tempdir, b'archive')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _write(self, name, data):
+        with open(os.path.join(self.dirpath, name), 'wb') as f:
+            f.write(data)
+
+    def _archive(self, stream):
+        with open(self.target, 'wb') as f:
+            for data in stream:
+                f.write(data)
+
+    def test_archive_tar(self):
+        self._archive(archive_tar(self.dirpath))
+        with tarfile.open(self.target, 'r:gz') as tar:
+            self.assertEqual(
+                sorted([b'subdir', b'empty', b'file.txt', b'empty.txt', b'subdir/fichi\xc3\xa9r.txt']),
+                sorted(tar.getnames()))
+            self.assertEqual(b'content', tar.extractfile(b'file.txt').read())
+            self.assertEqual(b'x' * 3000, tar.extractfile(b'subdir/fichi\xc3\xa9r.txt').read())
+            self.assertEqual(b'', tar.extractfile(b'empty.txt').read())
+
+    def test_archive_zip(self):
+        self._archive(archive_zip(self.dirpath))
+        with zipfile.ZipFile(self.target) as zipobj:
+            self.assertIsNone(zipobj.testzip())
+            self.assertEqual(
+                sorted(['file.txt', 'empty.txt', 'subdir/fichiér.txt']),
+                sorted(zipobj.namelist()))
+            self.assertEqual(b'content', zipobj.read('file.txt'))
+            self.assertEqual(b'x' * 3000, zipobj.read('subdir/fichiér.txt'))
+            self.assertEqual(b'', zipobj.read('empty.txt'))
+
+    def test_archive_tar_with_threads(self):
+        self._write(b'large.txt', b'abcdef' * 200000)
+        self._archive(archive_tar(self.dirpath, level=1, threads=3))
+        with tarfile.open(self.target, 'r:gz') as tar:
+            self.assertEqual(b'abcdef' * 200000, tar.extractfile(b'large.txt').read())
+            self.assertEqual(b'content', tar.extractfile(b'file.txt').read())
+
+    def test_archive_zip_with_threads(self):
+        self._write(b'large.txt', b'abcdef' * 200000)
+        self._archive(archive_zip(self.dirpath, level=1, threads=3))
+        with zipfile.ZipFile(self.target) as zipobj:
+            self.assertIsNone(zipobj.testzip())
+            self.assertEqual(b'abcdef' * 200000, zipobj.read('large.txt'))
+
+    def test_archive_with_threads_shared(self):
+        # Concurrent archives use the same pool of threads.
+        stream1 = archive_zip(self.dirpath, level=1, threads=3)
+        stream2 = archive_tar(self.dirpath, level=1, threads=3)
+        next(stream1)
+        next(stream2)
+        count = threading.active_count()
+        stream3 = archive_zip(self.dirpath, level=1, threads=3)
+        next(stream3)
+        self.assertEqual(count, threading.active_count())
+        self.assertIs(rdw_archive._get_pool(3), rdw_archive._get_pool(3))
+        for stream in [stream1, stream2, stream3]:
+            stream.close()
+
+    def _set_zip64_limit(self, limit, margin):
+        self.addCleanup(setattr, zipfile, 'ZIP64_LIMIT', zipfile.ZIP64_LIMIT)
+        self.addCleanup(setattr, rdw_archive, 'ZIP64_MARGIN', rdw_archive.ZIP64_MARGIN)
+        zipfile.ZIP64_LIMIT = limit
+        rdw_archive.ZIP64_MARGIN = margin
+
+    def _read_zip_entry(self, zinfo):
+        """Return the local extra field and the zip64 data descriptor."""
+        with open(self.target, 'rb') as f:
+            data = f.read()
+        offset = zinfo.header_offset
+        fnlen, extralen = struct.unpack(b'<HH', data[offset + 26:offset + 30])
+        extra = data[offset + 30 + fnlen:offset + 30 + fnlen + extralen]
+        offset += 30 + fnlen + extralen + zinfo.compress_size
+        return extra, struct.unpack(b'<4sLQQ', data[offset:offset + 24])
+
+    def test_archive_zip_with_zip64_compressed_size(self):
+        # Compressed data larger than the file go over the limit.
+        self._set_zip64_limit(2000, 0)
+        data = os.urandom(2000)
+        self._write(b'random.bin', data)
+        self._archive(archive_zip(self.dirpath))
+        with zipfile.ZipFile(self.target) as zipobj:
+            self.assertIsNone(zipobj.testzip())
+            zinfo = zipobj.getinfo('random.bin')
+            self.assertGreater(zinfo.compress_size, 2000)
+            self.assertEqual(1, struct.unpack(b'<H', zinfo.extra[:2])[0])
+            self.assertEqual(data, zipobj.read('random.bin'))
+            self.assertEqual(b'content', zipobj.read('file.txt'))
+        extra, descriptor = self._read_zip_entry(zinfo)
+        self.assertEqual(b'', extra)
+        self.assertEqual(
+            (rdw_archive.ZIP_DATA_DESCRIPTOR, zinfo.CRC, zinfo.compress_size, 2000),
+            descriptor)
+
+    def test_archive_zip_with_zip64_margin(self):
+        # Header of file close to the limit get zip64 fields.
+        self._set_zip64_limit(2000, 1000)
+        self._write(b'image.jpg', b'abcdef' * 200)
+        self._archive(archive_zip(self.dirpath, store=True))
+        with zipfile.ZipFile(self.target) as zipobj:
+            self.assertIsNone(zipobj.testzip())
+            zinfo = zipobj.getinfo('image.jpg')
+            self.assertEqual(b'abcdef' * 200, zipobj.read('image.jpg'))
+        extra, descriptor = self._read_zip_entry(zinfo)
+        self.assertEqual(1, struct.unpack(b'<H', extra[:2])[0])
+        self.assertEqual(
+            (rdw_archive.ZIP_DATA_DESCRIPTOR, zinfo.CRC, 1200, 1200),
+            descriptor)
+
+    def test_archive_zip_with_store(self):
+        self._write(b'image.jpg', b'abcdef' * 1000)
+        self._archive(archive_zip(self.dirpath, store=True))
+        with zipfile.ZipFile(self.target) as zipobj:
+            self.assertIsNone(zipobj.testzip())
+            self.assertEqual(zipfile.ZIP_STORED, zipobj.getinfo('image.jpg').compress_type)
+            self.assertEqual(zipfile.ZIP_DEFLATED, zipobj.getinfo('file.txt').compress_type)
+            self.assertEqual(b'abcdef' * 1000, zipobj.read('image.jpg'))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,64 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+from io import BytesIO
+import unittest
+
+from rdiffweb.rdw_delta import patch, DeltaError
+
+"""
+Module used to test the rdw_delta.
+"""
+
+MAGIC = b'rs\x026'
+
+
+class PatchTest(unittest.TestCase):
+
+    def _patch(self, basis, delta):
+        out = BytesIO()
+        patch(BytesIO(basis), BytesIO(delta), out)
+        return out.getvalue()
+
+    def test_patch_literal(self):
+        delta = MAGIC + b'\x05hello' + b'\x41\x06 world' + b'\x00'
+        self.assertEqual(b'hello world', self._patch(b'', delta))
+
+    def test_patch_copy(self):
+        # Copy 8 bytes from 0 then 3 bytes from 256 (2 bytes position).
+        delta = MAGIC + b'\x45\x00\x08' + b'\x49\x01\x00\x03' + b'\x00'
+        basis = b'version ' + b'x' * 248 + b'two'
+        self.assertEqual(b'version two', self._patch(basis, delta))
+
+    def test_patch_with_invalid_magic(self):
+        with self.assertRaises(DeltaError):
+            self._patch(b'', b'invalid')
+
+    def test_patch_with_truncated_delta(self):
+        with self.assertRaises(DeltaError):
+            self._patch(b'', MAGIC + b'\x05he')
+
+    def test_patch_with_invalid_copy(self):
+        with self.assertRaises(DeltaError):
+            self._patch(b'abc', MAGIC + b'\x45\x00\x08\x00')
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import unittest
+
+from rdiffweb.rdw_helpers import rdwTime, parse_time
+
+"""
+Module used to test the rdw_helpers.
+"""
+
+
+class RdwTimeTest(unittest.TestCase):
+
+    def _parse(self, value):
+        t = rdwTime()
+        t.initFromString(value)
+        return t
+
+    def test_init_from_string(self):
+        t = self._parse('2014-11-05T16:04:30-05:00')
+        self.assertEqual(1415221470, t.getSeconds())
+        self.assertEqual(-5 * 3600, t.tzOffset)
+        self.assertEqual('-05:00', t.getTimeZoneString())
+        self.assertEqual(1415203470, self._parse('2014-11-05T16:04:30Z').getSeconds())
+
+    def test_init_from_string_invalid(self):
+        for value in ['', '2014-11-05', '2014-11-05 16:04:30Z',
+                      '2014-13-05T16:04:30Z', '2014-11-05T16:04:30+25:00',
+                      '2014-11-05T16:04:30', 'abcd-11-05T16:04:30Z']:
+            with self.assertRaises(ValueError):
+                self._parse(value)
+
+    def test_compare(self):
+        t1 = self._parse('2014-11-05T16:04:30-05:00')
+        t2 = self._parse('2014-11-05T21:04:30Z')
+        t3 = rdwTime(1415221471)
+        self.assertEqual(t1, t2)
+        self.assertEqual(hash(t1), hash(t2))
+        self.assertFalse(t1 != t2)
+        self.assertTrue(t1 < t3 and t1 <= t3 and t3 > t1 and t3 >= t1)
+        self.assertEqual(-1, cmp(t1, t3))
+        self.assertEqual([t1, t3], sorted([t3, t1]))
+        self.assertNotEqual(t1, None)
+
+    def test_parse_time(self):
+        t = parse_time('2014-11-05T16:04:30-05:00')
+        self.assertEqual(1415221470, t.getSeconds())
+        # Parsed values are shared.
+        self.assertIs(t, parse_time('2014-11-05T16:04:30-05:00'))
+        with self.assertRaises(ValueError):
+            parse_time('invalid')
+
+    def test_slots(self):
+        t = rdwTime(1415221470)
+        with self.assertRaises(AttributeError):
+            t.other = 1
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import threading
+import unittest
+
+from rdiffweb import rdw_pool
+from rdiffweb.rdw_pool import ConnectionPool
+
+"""
+Module used to test the rdw_pool.
+"""
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.healthy = True
+
+    def close(self):
+        self.closed = True
+
+    def ping(self):
+        if not self.healthy:
+            raise IOError("connection lost")
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(Connection, max_size=2)
+
+    def test_connection_reused(self):
+        with self.pool.connection() as conn1:
+            # Same connection is used within the same thread.
+            with self.pool.connection() as conn2:
+                self.assertIs(conn1, conn2)
+        with self.pool.connection() as conn3:
+            self.assertIs(conn1, conn3)
+
+    def test_connection_per_thread(self):
+        others = []
+
+        def run():
+            with self.pool.connection() as conn:
+                others.append(conn)
+
+        with self.pool.connection() as conn:
+            thread = threading.Thread(target=run)
+            thread.start()
+            thread.join()
+        self.assertIsNot(conn, others[0])
+
+    def test_connection_discarded_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection() as conn1:
+                raise ValueError()
+        self.assertTrue(conn1.closed)
+        with self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+
+    def test_broken_connection(self):
+        self.patch_ping_delay()
+        with self.pool.connection() as conn1:
+            pass
+        conn1.healthy = False
+        with self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+        self.assertTrue(conn1.closed)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = -1
+        with self.pool.connection() as conn1:
+            pass
+        with self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+        self.assertTrue(conn1.closed)
+
+    def test_close(self):
+        with self.pool.connection() as conn:
+            pass
+        self.pool.close()
+        self.assertTrue(conn.closed)
+
+    def patch_ping_delay(self):
+        delay = rdw_pool.PING_DELAY
+        rdw_pool.PING_DELAY = -1
+
+        def restore():
+            rdw_pool.PING_DELAY = delay
+        self.addCleanup(restore)
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
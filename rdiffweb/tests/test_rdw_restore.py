@@ -0,0 +1,250 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import gc
+import gzip
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+from rdiffweb.core import RdiffError
+from rdiffweb.librdiff import DoesNotExistError, RdiffRepoCache
+from rdiffweb.page_restore import restore_job
+from rdiffweb.rdw_helpers import rdwTime
+from rdiffweb.rdw_restore import RestoreCache, RestoreJob, RestoreQueue
+
+"""
+Module used to test the rdw_restore.
+"""
+
+
+def _restore(dirpath):
+    output = os.path.join(dirpath, b'file.txt')
+    with open(output, 'wb') as f:
+        f.write(b'content')
+    return output
+
+
+class RestoreQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.queue = RestoreQueue(max_workers=1, max_user_jobs=1)
+        self.event = threading.Event()
+
+    def tearDown(self):
+        self.event.set()
+        self.queue.stop()
+
+    def _wait(self, job):
+        for unused in range(100):
+            if not job.is_active:
+                return
+            time.sleep(0.05)
+        self.fail("job not completed")
+
+    def _blocking_restore(self, dirpath):
+        self.event.wait()
+        return _restore(dirpath)
+
+    def test_submit(self):
+        job = self.queue.submit('bob', b'file.txt', _restore)
+        self._wait(job)
+        self.assertEqual(RestoreJob.DONE, job.status)
+        self.assertEqual(b'file.txt', job.filename)
+        self.assertEqual(7, job.progress)
+        self.assertIs(job, self.queue.get_job('bob', job.id))
+
+    def test_submit_with_error(self):
+        def fail(dirpath):
+            raise DoesNotExistError()
+        job = self.queue.submit('bob', b'file.txt', fail)
+        self._wait(job)
+        self.assertEqual(RestoreJob.FAILED, job.status)
+        self.assertIsNotNone(job.error)
+        self.assertFalse(os.path.exists(job.tempdir))
+
+    def test_submit_with_user_limit(self):
+        self.queue.submit('bob', b'file.txt', self._blocking_restore)
+        with self.assertRaises(RdiffError):
+            self.queue.submit('bob', b'file.txt', _restore)
+        # Other users are not limited.
+        self.queue.submit('alice', b'file.txt', _restore)
+
+    def test_submit_without_free_space(self):
+        self.queue.min_free_space = 1
+        self.queue._free_space = lambda: 0
+        with self.assertRaises(RdiffError):
+            self.queue.submit('bob', b'file.txt', _restore)
+
+    def test_get_job_with_other_user(self):
+        job = self.queue.submit('bob', b'file.txt', _restore)
+        with self.assertRaises(KeyError):
+            self.queue.get_job('alice', job.id)
+
+    def test_get_job_expired(self):
+        self.queue.expiry = 0
+        job = self.queue.submit('bob', b'file.txt', _restore)
+        self._wait(job)
+        time.sleep(0.01)
+        with self.assertRaises(KeyError):
+            self.queue.get_job('bob', job.id)
+        self.assertFalse(os.path.exists(job.tempdir))
+
+
+class RestoreJobRepoTest(unittest.TestCase):
+    """
+    Test restore jobs of a repository.
+    """
+
+    def setUp(self):
+        self.user_root = tempfile.mkdtemp()
+        repo_root = os.path.join(self.user_root, b'repo')
+        data_path = os.path.join(repo_root, b'rdiff-backup-data')
+        increments = os.path.join(data_path, b'increments')
+        os.makedirs(increments)
+        for date in [b'2014-11-01T12:00:00-05:00', b'2014-11-02T12:00:00-05:00']:
+            self._write(data_path, b'mirror_metadata.' + date + b'.snapshot.gz', b'')
+        self._write(repo_root, b'file.txt', b'version two\n', False)
+        self._write(increments, b'file.txt.2014-11-01T12:00:00-05:00.snapshot.gz', b'version one\n')
+        self.cache = RdiffRepoCache()
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _write(self, dirpath, name, data, compress=True):
+        f = (gzip.open if compress else open)(os.path.join(dirpath, name), 'wb')
+        with f:
+            f.write(data)
+
+    def test_run_with_evicted_repo(self):
+        repo = self.cache.get_repo(self.user_root, b'repo')
+        date = rdwTime()
+        date.initFromString('2014-11-01T12:00:00-05:00')
+        job = RestoreJob('bob', b'file.txt',
+                         restore_job(repo, repo.root_path.path, b'file.txt', date, True))
+        # Evict the repository before the job get executed.
+        del repo
+        self.cache.clear()
+        gc.collect()
+        job.run()
+        try:
+            self.assertEqual(RestoreJob.DONE, job.status)
+            with open(job.output, 'rb') as f:
+                self.assertEqual(b'version one\n', f.read())
+        finally:
+            job.delete()
+
+
+class RestoreCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tempdir, b'cache')
+        self.cache = RestoreCache(self.cachedir, 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _file(self, name, size):
+        filename = os.path.join(self.tempdir, name)
+        with open(filename, 'wb') as f:
+            f.write(b'x' * size)
+        return filename
+
+    def test_make_key(self):
+        key = RestoreCache.make_key(b'/backups/repo', b'dir', 'name', 1234, True)
+        self.assertEqual(key, RestoreCache.make_key(b'/backups/repo', b'dir', 'name', 1234, True))
+        self.assertNotEqual(key, RestoreCache.make_key(b'/backups/repo', b'dir', 'name', 1234, False))
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get('key1'))
+        location = self.cache.put('key1', self._file(b'file.txt', 4))
+        self.assertEqual(b'file.txt', os.path.basename(location))
+        self.assertTrue(location.startswith(self.cachedir))
+        self.assertEqual(location, self.cache.get('key1'))
+
+    def test_put_too_large(self):
+        filename = self._file(b'file.txt', 11)
+        self.assertEqual(filename, self.cache.put('key1', filename))
+        self.assertIsNone(self.cache.get('key1'))
+
+    def test_eviction(self):
+        location1 = self.cache.put('key1', self._file(b'file1.txt', 4))
+        self.cache.put('key2', self._file(b'file2.txt', 4))
+        # Mark key1 as recently used.
+        self.cache.get('key1')
+        self.cache.put('key3', self._file(b'file3.txt', 4))
+        self.assertEqual(location1, self.cache.get('key1'))
+        self.assertIsNone(self.cache.get('key2'))
+        self.assertIsNotNone(self.cache.get('key3'))
+
+    def test_load(self):
+        location = self.cache.put('key1', self._file(b'file.txt', 4))
+        cache = RestoreCache(self.cachedir, 10)
+        self.assertEqual(location, cache.get('key1'))
+
+    def test_load_with_invalid_entries(self):
+        location = self.cache.put('key1', self._file(b'file.txt', 4))
+        os.mkdir(os.path.join(self.cachedir, b'key2'))
+        os.symlink(b'/invalid', os.path.join(self.cachedir, b'key2', b'file.txt'))
+        os.symlink(b'/invalid', os.path.join(self.cachedir, b'key3'))
+        os.makedirs(os.path.join(self.cachedir, b'key4', b'dir'))
+        cache = RestoreCache(self.cachedir, 10)
+        self.assertEqual(location, cache.get('key1'))
+        self.assertEqual([b'key1'], os.listdir(self.cachedir))
+
+    def test_private(self):
+        location = self.cache.put('key1', self._file(b'file.txt', 4))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(self.cachedir).st_mode))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(location)).st_mode))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(location).st_mode))
+
+    @unittest.skipIf(os.getuid() != 0, "requires root to change the owner")
+    def test_load_with_other_owner(self):
+        cachedir = os.path.join(self.tempdir, b'other')
+        os.mkdir(cachedir)
+        os.chown(cachedir, 12345, 12345)
+        cache = RestoreCache(cachedir, 10)
+        self.assertFalse(cache.enabled)
+        filename = self._file(b'file.txt', 4)
+        self.assertEqual(filename, cache.put('key1', filename))
+
+    def test_submit_with_cache(self):
+        queue = RestoreQueue(max_workers=1, cache=self.cache)
+        try:
+            job = queue.submit('bob', b'file.txt', _restore, 'key1')
+            for unused in range(100):
+                if not job.is_active:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(RestoreJob.DONE, job.status)
+            self.assertEqual(job.output, self.cache.get('key1'))
+            queue.stop()
+            self.assertTrue(os.path.isfile(job.output))
+        finally:
+            queue.stop()
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import errno
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from rdiffweb import rdw_spider_repos
+from rdiffweb.rdw_spider_repos import InotifyWatcher, PollWatcher, \
+    RepoWatcher, find_repos_for_user, get_search_stats
+from rdiffweb.test import mock_scandir
+
+"""
+Module used to test the repositories spider.
+"""
+
+
+class MockUserDB(object):
+
+    def __init__(self, roots):
+        self.roots = roots
+        self.repos = {}
+
+    def get_user_root(self, user):
+        return self.roots[user]
+
+    def list(self):
+        return self.roots.keys()
+
+    def set_repos(self, user, repo_paths):
+        self.repos[user] = sorted(repo_paths)
+
+    def supports(self, operation):
+        return True
+
+
+class MockApp(object):
+
+    def __init__(self, userdb):
+        self.userdb = userdb
+
+
+class FindReposTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for path in [b'repo1', b'dir/repo2', b'dir/dir/repo3', b'dir/dir/dir/repo4']:
+            os.makedirs(os.path.join(self.tempdir, path, b'rdiff-backup-data'))
+        os.symlink(os.path.join(self.tempdir, b'dir'), os.path.join(self.tempdir, b'link'))
+        self.userdb = MockUserDB({'bob': self.tempdir.decode('utf-8')})
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_find_repos_for_user(self):
+        find_repos_for_user('bob', self.userdb)
+        self.assertEqual(['/dir/repo2', '/repo1'], self.userdb.repos['bob'])
+        stats = get_search_stats()['bob']
+        self.assertEqual(2, stats.repos)
+
+    def test_find_repos_for_user_with_depth(self):
+        find_repos_for_user('bob', self.userdb, depth=5, threads=2)
+        self.assertEqual(['/dir/dir/dir/repo4', '/dir/dir/repo3', '/dir/repo2', '/repo1'], self.userdb.repos['bob'])
+
+    def test_find_repos_for_user_with_nested_repo(self):
+        # Content of the repositories should not be searched.
+        os.makedirs(os.path.join(self.tempdir, b'repo1', b'repo5', b'rdiff-backup-data'))
+        dirs, repos = find_repos_for_user('bob', self.userdb)
+        self.assertEqual(['/dir/repo2', '/repo1'], self.userdb.repos['bob'])
+        self.assertNotIn(os.path.join(self.tempdir, b'repo1', b'repo5'), dirs)
+        self.assertIn(os.path.join(self.tempdir, b'repo1'), repos)
+
+    def test_find_repos_for_user_with_root_repo(self):
+        os.makedirs(os.path.join(self.tempdir, b'rdiff-backup-data'))
+        find_repos_for_user('bob', self.userdb, depth=1)
+        self.assertEqual(['/'], self.userdb.repos['bob'])
+
+
+class FindReposWithScandirTest(FindReposTest):
+    """
+    Test the search of repositories using scandir entries.
+    """
+
+    def setUp(self):
+        self._scandir = rdw_spider_repos.scandir
+        rdw_spider_repos.scandir = mock_scandir
+        FindReposTest.setUp(self)
+
+    def tearDown(self):
+        rdw_spider_repos.scandir = self._scandir
+        FindReposTest.tearDown(self)
+
+
+class PollWatcherTest(unittest.TestCase):
+
+    watcher_class = PollWatcher
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        for user in ['bob', 'alice']:
+            os.makedirs(os.path.join(self.tempdir, user, b'repo1', b'rdiff-backup-data'))
+        self.userdb = MockUserDB({
+            'bob': os.path.join(self.tempdir, b'bob').decode('utf-8'),
+            'alice': os.path.join(self.tempdir, b'alice').decode('utf-8')})
+        self.watcher = self.watcher_class(MockApp(self.userdb))
+        self.watcher.refresh_users()
+        self.event = threading.Event()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def _wait(self):
+        return self.watcher.wait(self.event, 0.01)
+
+    def _touch_repo(self, user, name):
+        path = os.path.join(self.tempdir, user, name)
+        os.makedirs(os.path.join(path, b'rdiff-backup-data'))
+        # Change the modification time in case the filesystem is too fast.
+        os.utime(path, (1000, 1000))
+        os.utime(os.path.dirname(path), (1000, 1000))
+
+    def test_refresh_users(self):
+        self.assertEqual(['/repo1'], self.userdb.repos['bob'])
+        self.assertEqual(['/repo1'], self.userdb.repos['alice'])
+
+    def test_wait_without_changes(self):
+        self.assertEqual(set(), self._wait())
+
+    def test_wait_with_new_repo(self):
+        self._touch_repo(b'bob', b'repo2')
+        self.assertEqual(set(['bob']), self._wait())
+        self.watcher.update_user('bob')
+        self.assertEqual(['/repo1', '/repo2'], self.userdb.repos['bob'])
+        self.assertEqual(set(), self._wait())
+
+    def test_wait_with_backup(self):
+        # Files and directories created by a backup should be ignored.
+        repo = os.path.join(self.tempdir, b'bob', b'repo1')
+        os.mkdir(os.path.join(repo, b'dir'))
+        open(os.path.join(repo, b'file.txt'), 'w').close()
+        open(os.path.join(repo, b'rdiff-backup-data', b'session_statistics.data'), 'w').close()
+        os.utime(repo, (1000, 1000))
+        self.assertEqual(set(), self._wait())
+
+    def test_wait_with_deleted_repo(self):
+        shutil.rmtree(os.path.join(self.tempdir, b'alice', b'repo1', b'rdiff-backup-data'))
+        os.utime(os.path.join(self.tempdir, b'alice', b'repo1'), (1000, 1000))
+        self.assertEqual(set(['alice']), self._wait())
+        self.watcher.update_user('alice')
+        self.assertEqual([], self.userdb.repos['alice'])
+
+
+class InotifyWatcherTest(PollWatcherTest):
+
+    watcher_class = InotifyWatcher
+
+    def test_abstract_watcher(self):
+        with self.assertRaises(TypeError):
+            RepoWatcher(MockApp(self.userdb))
+
+    def test_wait_without_inotify_watch(self):
+        def add_watch(path, mask):
+            raise OSError(errno.ENOSPC, "inotify_add_watch", path)
+        self.watcher._inotify.add_watch = add_watch
+        self.watcher.update_user('bob')
+        # Directories are polled instead.
+        self._touch_repo(b'bob', b'repo2')
+        self.assertEqual(set(['bob']), self._wait())
+
+    def test_wait_with_continuous_events(self):
+        self.watcher.MAX_DELAY = 0.5
+        stop = threading.Event()
+
+        def create_dirs():
+            i = 0
+            while not stop.isSet():
+                os.mkdir(os.path.join(self.tempdir, b'bob', b'dir%d' % i))
+                i += 1
+                time.sleep(0.1)
+        thread = threading.Thread(target=create_dirs)
+        thread.start()
+        try:
+            start = time.time()
+            self.assertEqual(set(['bob']), self.watcher.wait(self.event, 10))
+            self.assertLess(time.time() - start, 3)
+        finally:
+            stop.set()
+            thread.join()
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+# rdiffweb, A web interface to rdiff-backup repositories
+# Copyright (C) 2014 rdiffweb contributors
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from rdiffweb.rdw_helpers import rdwTime
+from rdiffweb.rdw_status import StatusCollector
+from rdiffweb.test import MockRdiffwebApp
+
+"""
+Module used to test the rdw_status.
+"""
+
+
+def _date(value):
+    date = rdwTime()
+    date.initFromString(value)
+    return date
+
+
+class StatusCollectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = MockRdiffwebApp(enabled_plugins=['SQLite'])
+        self.app.reset()
+        self.user_root = tempfile.mkdtemp()
+        self.data_path = os.path.join(
+            self.user_root, b'repo', b'rdiff-backup-data')
+        os.makedirs(self.data_path)
+        self._add_backup(b'2015-11-02T10:00:00-05:00', 1024)
+        self.app.userdb.add_user('bob')
+        self.app.userdb.set_user_root('bob', self.user_root.decode('utf-8'))
+        self.app.userdb.set_repos('bob', ['repo'])
+        self.collector = StatusCollector(self.app, interval=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.user_root, ignore_errors=True)
+
+    def _add_backup(self, date, size, errors=None):
+        self._write(b'mirror_metadata.%s.snapshot' % date, b'')
+        self._write(b'session_statistics.%s.data' % date,
+                    b'SourceFileSize %d (1 KB)\nIncrementFileSize 10 (10 bytes)\n' % size)
+        if errors:
+            self._write(b'error_log.%s.data' % date, errors)
+        # Make sure the modification time changes.
+        st = os.stat(self.data_path)
+        os.utime(self.data_path, (st.st_atime, st.st_mtime + 1))
+
+    def _write(self, name, data):
+        with open(os.path.join(self.data_path, name), 'wb') as f:
+            f.write(data)
+
+    def test_collect_user(self):
+        self.collector.collect_user('bob')
+        summaries = self.app.userdb.get_backup_summaries('bob')
+        self.assertEqual(1, len(summaries))
+        self.assertEqual('repo', summaries[0]['repo_path'])
+        self.assertEqual(_date('2015-11-02T10:00:00-05:00'), summaries[0]['date'])
+        self.assertEqual(-5 * 3600, summaries[0]['date'].tzOffset)
+        self.assertEqual(1024, summaries[0]['source_size'])
+        self.assertEqual(10, summaries[0]['increment_size'])
+        self.assertEqual(0, summaries[0]['error_count'])
+
+    def test_collect_user_new_backup(self):
+        self.collector.collect_user('bob')
+        self._add_backup(b'2015-11-03T10:00:00-05:00', 2048,
+                         b'UpdateError a/b Permission denied\nListError c\n')
+        self.collector.collect_user('bob')
+        summaries = self.app.userdb.get_backup_summaries('bob')
+        self.assertEqual([2048, 1024], [x['source_size'] for x in summaries])
+        self.assertEqual(2, summaries[0]['error_count'])
+        self.assertEqual('UpdateError a/b Permission denied\nListError c',
+                         summaries[0]['errors'])
+        # Filter by dates.
+        summaries = self.app.userdb.get_backup_summaries(
+            'bob', earliest_date=_date('2015-11-03T00:00:00Z'))
+        self.assertEqual([2048], [x['source_size'] for x in summaries])
+
+    def test_collect_user_with_invalid_repo(self):
+        self.app.userdb.set_repos('bob', ['repo', 'invalid'])
+        self.collector.collect_user('bob')
+        self.assertEqual(['invalid'], self.collector.get_repo_errors('bob').keys())
+        self.assertEqual(1, len(self.app.userdb.get_backup_summaries('bob')))
+
+    def test_get_collected_repos(self):
+        self.assertEqual(set(), self.collector.get_collected_repos('bob'))
+        self.app.userdb.set_repos('bob', ['repo', 'invalid'])
+        self.collector.collect_user('bob')
+        self.assertEqual(set(['repo', 'invalid']), self.collector.get_collected_repos('bob'))
+        # Repository not modified is still collected.
+        self.collector.collect_user('bob')
+        self.assertEqual(set(['repo', 'invalid']), self.collector.get_collected_repos('bob'))
+
+    def test_deleted_repo(self):
+        self.collector.collect_user('bob')
+        self.app.userdb.set_repos('bob', [])
+        self.assertEqual([], self.app.userdb.get_backup_summaries('bob'))
+
+
+if __name__ == "__main__":
+    # import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -112,6 +112,36 @@ class UserManagerSQLiteTest(unittest.TestCase):
         self.assertEqual('/backups/', user_root)
         self.assertEqual(True, is_admin)
 
+    def test_get_cached(self):
+        self.app.userdb.add_user('larry')
+        self.assertEqual('', self.app.userdb.get_email('larry'))
+        # Update made directly in database are not visible until expired.
+        db = self.app.userdb._databases[0]
+        db.set_email('larry', 'larry@gmail.com')
+        self.assertEqual('', self.app.userdb.get_email('larry'))
+        # Update made through the user manager invalidate the cache.
+        self.app.userdb.set_email('larry', 'larry@example.com')
+        self.assertEqual('larry@example.com', self.app.userdb.get_email('larry'))
+
+    def test_get_users(self):
+        self.app.userdb.add_user('bob')
+        self.app.userdb.set_email('bob', 'bob@example.com')
+        self.app.userdb.set_is_admin('bob', True)
+        self.assertEqual(2, self.app.userdb.count_users())
+        self.assertEqual(1, self.app.userdb.count_users(admin_only=True))
+        users = self.app.userdb.get_users(search='bob')
+        self.assertEqual(['bob'], [x['username'] for x in users])
+        users = self.app.userdb.get_users(offset=1, limit=1)
+        self.assertEqual(['bob'], [x['username'] for x in users])
+
+    def test_delete_user_cached(self):
+        self.app.userdb.add_user('vicky')
+        self.assertEqual([], self.app.userdb.get_repos('vicky'))
+        self.app.userdb.delete_user('vicky')
+        self.assertFalse(self.app.userdb.exists('vicky'))
+        with self.assertRaises(InvalidUserError):
+            self.app.userdb.get_repos('vicky')
+
     def test_get_invalid_user(self):
         with self.assertRaises(InvalidUserError):
             self.app.userdb.get_email('invalid')
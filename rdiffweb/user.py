@@ -19,6 +19,8 @@
 from __future__ import unicode_literals
 
 import logging
+import threading
+import time
 
 from rdiffweb.core import RdiffError, Component, InvalidUserError
 from rdiffweb.i18n import ugettext as _
@@ -36,6 +38,34 @@ class UserManager(Component):
 
     def __init__(self, app):
         Component.__init__(self, app)
+        # Cache of user database and attributes. Invalidated when the user
+        # get updated.
+        self._cache_ttl = self.app.cfg.get_config_int("UserCacheTTL", "60")
+        self._cache = {}
+        self._cache_lock = threading.Lock()
+
+    def _cached(self, user, key, func, *args):
+        """
+        Return the value of `key` for the given user from cache. If not
+        cached or expired, call `func` to get the value. None is not cached.
+        """
+        now = time.time()
+        with self._cache_lock:
+            expire, value = self._cache.get(user, {}).get(key, (0, None))
+        if expire > now:
+            return list(value) if isinstance(value, list) else value
+        value = func(*args)
+        if value is not None and self._cache_ttl > 0:
+            with self._cache_lock:
+                self._cache.setdefault(user, {})[key] = (
+                    now + self._cache_ttl,
+                    list(value) if isinstance(value, list) else value)
+        return value
+
+    def _invalidate(self, user):
+        """Remove the given user from cache."""
+        with self._cache_lock:
+            self._cache.pop(user, None)
 
     @property
     def _allow_add_user(self):
@@ -133,6 +163,9 @@ class UserManager(Component):
         returned.
         """
         assert isinstance(user, unicode)
+        return self._cached(user, 'database', self._find_user_database, user)
+
+    def _find_user_database(self, user):
         for db in self._databases:
             if db.exists(user):
                 return db
@@ -143,35 +176,58 @@ class UserManager(Component):
         db = self.find_user_database(user)
         if not db:
             raise InvalidUserError(user)
-        return db.get_email(user)
+        return self._cached(user, 'email', db.get_email, user)
 
     def is_admin(self, user):
         """Return True if the user is Admin."""
         db = self.find_user_database(user)
         if not db:
             raise InvalidUserError(user)
-        return db.is_admin(user)
+        return self._cached(user, 'is_admin', db.is_admin, user)
 
     def get_repos(self, user):
         """Get list of repos for the given `user`."""
         db = self.find_user_database(user)
         if not db:
             raise InvalidUserError(user)
-        return db.get_repos(user)
+        return self._cached(user, 'repos', db.get_repos, user)
+
+    def add_backup_summaries(self, user, repo_path, summaries):
+        """Record the summaries of the backups of the given repository."""
+        db = self.find_user_database(user)
+        if not db:
+            raise InvalidUserError(user)
+        db.add_backup_summaries(user, repo_path, summaries)
+
+    def get_backup_summaries(self, user, earliest_date=None,
+                             latest_date=None):
+        """Return the recorded backup summaries of the user."""
+        db = self.find_user_database(user)
+        if not db:
+            raise InvalidUserError(user)
+        return db.get_backup_summaries(user, earliest_date, latest_date)
+
+    def get_last_backup_dates(self, user):
+        """Return the date of the last recorded backup of each repository."""
+        db = self.find_user_database(user)
+        if not db:
+            raise InvalidUserError(user)
+        return db.get_last_backup_dates(user)
 
     def get_repo_maxage(self, user, repo_path):
         """Return the max age of the given repo."""
         db = self.find_user_database(user)
         if not db:
             raise InvalidUserError(user)
-        return db.get_repo_maxage(user, repo_path)
+        return self._cached(user, ('maxage', repo_path),
+                            db.get_repo_maxage, user, repo_path)
 
     def get_user_root(self, user):
         """Get user root directory."""
         db = self.find_user_database(user)
         if not db:
             raise InvalidUserError(user)
-        return db.get_user_root(user)
+        return self._cached(user, 'user_root', db.get_user_root, user)
 
     def _get_supporting_store(self, operation):
         """
@@ -195,6 +251,31 @@ class UserManager(Component):
                 return db
         return None
 
+    def count_users(self, admin_only=False, search=None):
+        """Return the number of users matching the given criteria."""
+        return sum(db.count_users(admin_only, search)
+                   for db in self._databases)
+
+    def get_users(self, admin_only=False, search=None, offset=0, limit=None):
+        """
+        Return the records (username, email, is_admin and user_root) of the
+        users matching the given criteria. Databases are queried in order.
+        """
+        records = []
+        for db in self._databases:
+            if limit is not None and len(records) >= limit:
+                break
+            if offset:
+                # Skip the databases before the requested offset.
+                count = db.count_users(admin_only, search)
+                if offset >= count:
+                    offset -= count
+                    continue
+            remaining = None if limit is None else limit - len(records)
+            records.extend(db.get_users(admin_only, search, offset, remaining))
+            offset = 0
+        return records
+
     def list(self):
         """List all users from databases."""
         users = []
@@ -244,6 +325,7 @@ class UserManager(Component):
         if not db:
             raise InvalidUserError(user)
         db.set_email(user, email)
+        self._notify('attr_changed', user, {'email': email})
 
     def set_is_admin(self, user, is_admin):
         """Sets the user root directory."""
@@ -251,6 +333,7 @@ class UserManager(Component):
         if not db:
             raise InvalidUserError(user)
         db.set_is_admin(user, is_admin)
+        self._notify('attr_changed', user, {'is_admin': is_admin})
 
     def set_user_root(self, user, user_root):
         """Sets the user root directory."""
@@ -258,6 +341,7 @@ class UserManager(Component):
         if not db:
             raise InvalidUserError(user)
         db.set_user_root(user, user_root)
+        self._notify('attr_changed', user, {'user_root': user_root})
 
     def set_password(self, user, password, old_password=None):
         # Check if user exists in database
@@ -282,6 +366,7 @@ class UserManager(Component):
         if not db:
             raise InvalidUserError(user)
         db.set_repos(user, repo_paths)
+        self._notify('attr_changed', user, {'repos': repo_paths})
 
     def set_repo_maxage(self, user, repo_path, max_age):
         """Sets the max age for the given repo."""
@@ -289,6 +374,7 @@ class UserManager(Component):
         if not db:
             raise InvalidUserError(user)
         db.set_repo_maxage(user, repo_path, max_age)
+        self._notify('attr_changed', user, {'maxage': (repo_path, max_age)})
 
     def supports(self, operation, user=None):
         """
@@ -310,7 +396,10 @@ class UserManager(Component):
             else:
                 return self._get_supporting_database(operation) is not None
 
-    def _notify(self, mod, *args):
+    def _notify(self, mod, user, *args):
+        # Any change to the user invalidate the cache.
+        self._invalidate(user)
+        args = (user,) + args
         mod = '_'.join(['user', mod])
         for listener in self._change_listeners:
             # Support divergent account change listener implementations too.
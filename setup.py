@@ -177,6 +177,7 @@ setup(
         "Jinja2>=2.6",
         "yapsy>=1.10.423",
         "babel>=0.9",
+        "scandir>=1.5",
     ],
     # required packages for build process
     setup_requires=[